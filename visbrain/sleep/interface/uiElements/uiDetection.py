@@ -1,10 +1,14 @@
 """Main class for sleep tools managment."""
+import os
 import numpy as np
 from warnings import warn
+from threading import Event, Lock
+from concurrent.futures import ThreadPoolExecutor, CancelledError
 
-from ....utils import remdetect, spindlesdetect
+from ....utils import (remdetect, spindlesfeatures, spindlesdecide,
+                       peakdetect, fingerprint, DetectionCache)
 
-from PyQt4 import QtGui
+from PyQt4 import QtGui, QtCore
 
 __all__ = ['uiDetection']
 
@@ -29,6 +33,18 @@ class uiDetection(object):
         self._ToolRdAll.clicked.connect(self._fcn_applyMethod)
         self._ToolDetectProgress.hide()
         self._fcn_switchDetection()
+        # Cancel button (next to the apply button) :
+        self._ToolDetectCancel = QtGui.QPushButton(
+            self.scrollAreaWidgetContents_4)
+        self._ToolDetectCancel.setText("Cancel")
+        self.horizontalLayout_8.insertWidget(2, self._ToolDetectCancel)
+        self._ToolDetectCancel.clicked.connect(self._fcn_cancelDetection)
+        self._ToolDetectCancel.hide()
+        # Running detection (polled by a timer) :
+        self._detjob = None
+        self._detjobs = os.cpu_count() or 1
+        self._dettimer = QtCore.QTimer()
+        self._dettimer.timeout.connect(self._fcn_detectionProgress)
 
         # -------------------------------------------------
         # REM detection :
@@ -44,6 +60,14 @@ class uiDetection(object):
         self._DetectLocations.itemSelectionChanged.connect(
                                                         self._fcn_gotoLocation)
 
+        # -------------------------------------------------
+        # Fingerprint of each channel (for the detection cache), computed by
+        # the worker threads :
+        self._datafp = {}
+        self._datafplock = Lock()
+        # Spindles features (amplitude), reused when the threshold changes :
+        self._featcache = DetectionCache(maxsize=8)
+
     # =====================================================================
     # ENABLE / DISABLE GUI COMPONENTS (based on selected channels)
     # =====================================================================
@@ -107,38 +131,167 @@ class uiDetection(object):
 
         return idx
 
+    # -------------- Cached detections --------------
+    def _fcn_dataFingerprint(self, k):
+        """Get the fingerprint of a channel (computed once per channel)."""
+        with self._datafplock:
+            fp = self._datafp.get(k)
+        if fp is None:
+            # Hash outside of the lock (channels are hashed in parallel) :
+            fp = fingerprint(self._data[k, :])
+            with self._datafplock:
+                fp = self._datafp.setdefault(k, fp)
+        return fp
+
+    def _fcn_detectKey(self, k, method, params, hypfp=None):
+        """Get the key of a detection in the detection cache."""
+        return self._detcache.key(self._fcn_dataFingerprint(k),
+                                  self._channels[k], method, params, hypfp)
+
+    def _fcn_detectCached(self, cache, key, fcn, *args, **kwargs):
+        """Get a detection from a cache or compute (and store) it."""
+        out = cache.get(key)
+        if out is None:
+            out = cache.set(key, fcn(*args, **kwargs))
+        return out
+
+    def _fcn_detectChannel(self, k, method, params, hyp, hypfp, cancel):
+        """Run a detection on a single channel (worker thread).
+
+        hyp is a copy of the hypnogram taken at dispatch so that edits made
+        during the detection are not seen by the workers. The cancel event is
+        checked between the steps of the detection (a running step is
+        finished).
+        """
+        if cancel.is_set():
+            raise CancelledError()
+        key = self._fcn_detectKey(k, method, params, hypfp)
+        if cancel.is_set():
+            raise CancelledError()
+        if method == 'REM':
+            thr, rem_only = params
+            return self._fcn_detectCached(self._detcache, key, remdetect,
+                                          self._data[k, :], self._sf,
+                                          hyp, rem_only, thr)
+        elif method == 'Spindles':
+            thr, fMin, fMax, tMin, tMax, nrem_only = params
+            if key in self._detcache:
+                return self._detcache.get(key)
+            # Features are shared by all thresholds / durations :
+            fkey = self._fcn_detectKey(k, 'SpindlesFeatures',
+                                       (fMin, fMax, nrem_only), hypfp)
+            features = self._fcn_detectCached(
+                self._featcache, fkey, spindlesfeatures, self._data[k, :],
+                self._sf, hyp, nrem_only, fMin, fMax)
+            if cancel.is_set():
+                raise CancelledError()
+            return self._fcn_detectCached(
+                self._detcache, key, spindlesdecide, features, self._sf, thr,
+                tMin, tMax)
+        elif method == 'Peaks':
+            return self._fcn_detectCached(self._detcache, key, peakdetect,
+                                          self._data[k, :], self._time,
+                                          params[0])
+
     # -------------- Run detection (only on selected channels) --------------
     def _fcn_applyDetection(self):
-        """Apply detection (either REM / Spindles / Peaks."""
+        """Apply detection (either REM / Spindles / Peaks).
+
+        Channels are dispatched to a pool of threads. The progress is polled
+        by a timer and results are displayed once all channels are done.
+        """
+        # A detection is already running :
+        if self._detjob is not None:
+            return
         # Get channels to apply detection and the detection method :
-        idx = self._fcn_getChanDetection()
+        idx = list(self._fcn_getChanDetection())
         method = self._ToolDetectType.currentText()
-        ind = np.array([], dtype=int)
+        # Freeze the hypnogram (edited inplace) and get its fingerprint (REM
+        # and spindles depend on it) :
+        hyp = self._hypno.copy()
+        hypfp = fingerprint((hyp.values, hyp.partial, hyp.epoch, hyp.offset,
+                             len(hyp)))
+
+        # Get variables :
+        if method == 'REM':
+            params = (self._ToolRemTh.value(), self._ToolRemOnly.isChecked())
+        elif method == 'Spindles':
+            params = (self._ToolSpinTh.value(), self._ToolSpinFmin.value(),
+                      self._ToolSpinFmax.value(), self._ToolSpinTmin.value(),
+                      self._ToolSpinTmax.value(),
+                      self._ToolSpinRemOnly.isChecked())
+        elif method == 'Peaks':
+            params = (int(self._ToolPeakLook.value() * self._sf),)
+
+        # Dispatch channels :
+        executor = ThreadPoolExecutor(max_workers=max(1, min(len(idx),
+                                                             self._detjobs)))
+        cancel = Event()
+        futures = [executor.submit(self._fcn_detectChannel, k, method, params,
+                                   hyp, hypfp, cancel) for k in idx]
+        self._detjob = (method, idx, params, futures, executor, cancel)
+
+        # Display progress bar and cancel button :
+        self._ToolDetectProgress.setValue(0)
+        self._ToolDetectProgress.show()
+        self._ToolDetectCancel.show()
+        self._ToolDetectApply.setEnabled(False)
+        self._dettimer.start(100)
 
-        for i, k in enumerate(idx):
-            # Display progress bar :
-            self._ToolDetectProgress.show()
+    def _fcn_detectionProgress(self):
+        """Update the progress bar and display results when done."""
+        method, idx, params, futures = self._detjob[0:4]
+        done = sum([k.done() for k in futures])
+        self._ToolDetectProgress.setValue(100. * done / max(1, len(futures)))
+        if done == len(futures):
+            self._fcn_detectionStop()
+            self._fcn_detectionMerge(method, idx, params, futures)
 
-            # Get if report is enable and checked:
-            toReport = self._ToolDetecReport.isEnabled(
-            ) and self._ToolDetecReport.isChecked()
+    def _fcn_cancelDetection(self):
+        """Cancel the running detection."""
+        if self._detjob is not None:
+            # Pending channels are cancelled and running channels stop after
+            # their current step (results are ignored) :
+            self._detjob[5].set()
+            for k in self._detjob[3]:
+                k.cancel()
+            self._fcn_detectionStop()
+
+    def _fcn_detectionStop(self):
+        """Stop polling the detection and hide progress widgets."""
+        self._dettimer.stop()
+        self._detjob[4].shutdown(wait=False)
+        self._detjob = None
+        self._ToolDetectProgress.hide()
+        self._ToolDetectCancel.hide()
+        self._ToolDetectApply.setEnabled(True)
+
+    def _fcn_detectionMerge(self, method, idx, params, futures):
+        """Display detection results of all channels."""
+        ind = np.zeros((0, 2), dtype=int)
+        # Get if report is enable and checked:
+        toReport = self._ToolDetecReport.isEnabled(
+        ) and self._ToolDetecReport.isChecked()
+
+        for k, fut in zip(idx, futures):
+            try:
+                out = fut.result()
+            except Exception as e:
+                warn("\nDetection failed on channel " + self._channels[k] +
+                     ": " + str(e))
+                continue
 
             # Switch between detection types :
             # ------------------- REM -------------------
             if method == 'REM':
-                # Get variables :
-                thr = self._ToolRemTh.value()
-                rem_only = self._ToolRemOnly.isChecked()
                 # Get REM indices :
-                index, _, _ = remdetect(self._data[k, :], self._sf,
-                                        self._hypno, rem_only, thr)
+                index = out[0]
                 if index.size:
                     # Set them + color to ChannelPlot object :
                     self._chan.colidx[k]['color'] = self._defrem
                     self._chan.colidx[k]['idx'] = index
-                    # Find only where index start / finish :
-                    ind = np.where(np.gradient(index) != 1.)[0]
-                    ind = index[np.hstack(([0], ind, [len(index) - 1]))]
+                    # REM (start, stop) intervals :
+                    ind = index
                     # Report index on hypnogram :
                     if toReport:
                         # Display on hypnogram :
@@ -151,25 +304,14 @@ class uiDetection(object):
 
             # ------------------- SPINDLES -------------------
             elif method == 'Spindles':
-                # Get variables :
-                thr = self._ToolSpinTh.value()
-                fMin = self._ToolSpinFmin.value()
-                fMax = self._ToolSpinFmax.value()
-                tMin = self._ToolSpinTmin.value()
-                tMax = self._ToolSpinTmax.value()
-                nrem_only = self._ToolSpinRemOnly.isChecked()
-                # Get Spindles indices :
-                index, number, density = spindlesdetect(self._data[k, :],
-                                                        self._sf, thr,
-                                                        self._hypno, nrem_only,
-                                                        fMin, fMax, tMin, tMax)
+                # Get Spindles indices of this channel :
+                index, number, density = out
                 if index.size:
                     # Set them + color to ChannelPlot object :
                     self._chan.colidx[k]['color'] = self._defspin
                     self._chan.colidx[k]['idx'] = index
-                    # Find only where index start / finish :
-                    ind = np.where(np.gradient(index) != 1.)[0]
-                    ind = index[np.hstack(([0], ind, [len(index) - 1]))]
+                    # Spindles (start, stop) intervals :
+                    ind = index
                     # Report index on hypnogram :
                     if toReport:
                         # Display on hypnogram :
@@ -189,13 +331,12 @@ class uiDetection(object):
             # ------------------- PEAKS -------------------
             elif method == 'Peaks':
                 # Get variables :
-                look = self._ToolPeakLook.value() * self._sf
                 disp = self._ToolPeakMinMax.currentIndex()
                 disp_types = ['max', 'min', 'minmax']
                 # Set data :
                 self._peak.set_data(self._sf, self._data[k], self._time,
                                     self._chan.peak[k], disp_types[disp],
-                                    look)
+                                    params[0], peaks=out)
                 # Get index :
                 ind = self._peak.index
                 # Report index on hypnogram :
@@ -209,32 +350,33 @@ class uiDetection(object):
                 self.canvas_setVisible(k, True)
                 self._chan.visible[k] = True
 
-            # Update plot :
-            self._fcn_sliderMove()
-
-            # Update progress bar :
-            self._ToolDetectProgress.setValue(100. * (i + 1) / len(self))
+        # Update plot (once for all channels) :
+        self._fcn_sliderMove()
 
         # Fill the location table (only if selected):
         if self._ToolRdSelected.isChecked() and ind.size:
+            if ind.ndim == 2:
+                # Time of the first and last sample of each event :
+                ind = np.c_[ind[:, 0], ind[:, 1] - 1]
             self._fcn_fillLocations(self._channels[k], method,
                                     self._time[ind])
 
-        # Finally, hide progress bar :
-        self._ToolDetectProgress.hide()
-
     # =====================================================================
     # FILL LOCATION TABLE
     # =====================================================================
     def _fcn_fillLocations(self, channel, kind, index):
-        """Fill the location table."""
+        """Fill the location table.
+
+        For REM and spindles, index is an array of shape (n_events, 2) with
+        the starting and ending time of each event.
+        """
         # Clean table :
         self._scoreTable.setRowCount(0)
         if (kind in ['REM', 'Spindles']) and self._ToolRdSelected.isChecked():
             # Define the lentgh of the table :
-            self._DetectLocations.setRowCount(int(len(index) / 2))
+            self._DetectLocations.setRowCount(len(index))
             # Get starting and ending index :
-            staInd, endInd = index[0::2], index[1::2]
+            staInd, endInd = index[:, 0], index[:, 1]
             # Fill the table :
             for num, (k, i) in enumerate(zip(staInd, endInd)):
                 # Starting :
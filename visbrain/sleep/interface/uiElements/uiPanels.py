@@ -338,7 +338,10 @@ class uiPanels(object):
         # Set data :
         self._spec.set_data(self._sf, self._data[chan, ...], self._time,
                             nfft=nfft, overlap=over, fstart=fstart, fend=fend,
-                            cmap=cmap, contraste=contraste)
+                            cmap=cmap, contraste=contraste, chan=chan)
+        # Prepare the other channels in background :
+        self._spec.warmup(self._sf, self._data, self._time, range(len(self)),
+                          nfft=nfft, overlap=over, fstart=fstart, fend=fend)
         # Set apply button disable :
         self._PanSpecApply.setEnabled(False)
 
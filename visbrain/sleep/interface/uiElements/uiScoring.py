@@ -27,7 +27,6 @@ class uiScoring(object):
     ##########################################################################
     def _fcn_Hypno2Score(self):
         """Update hypno table from hypno data."""
-        self._hypno = -self._hyp.mesh.pos[:, 1]
         # Avoid updating data while setting cell :
         self._scoreSet = False
         items = ['Wake', 'N1', 'N2', 'N3', 'REM', 'Art']
@@ -55,8 +54,8 @@ class uiScoring(object):
     def _fcn_Score2Hypno(self):
         """Update hypno data from hypno score."""
         if self._scoreSet:
-            # Reset hypnogram :
-            self._hypno = np.zeros((len(self._time)), dtype=np.float32)
+            # Reset hypnogram (shared with the hypnogram edition) :
+            self._hypno.set_samples(0, len(self._hypno), 0)
             # Get the current number of rows :
             l = self._scoreTable.rowCount()
             # Reset markers points position and color :
@@ -67,9 +66,9 @@ class uiScoring(object):
                 tstart, tend, stage = self._get_scoreMarker(k)
                 # Update pos if not None :
                 if tstart is not None:
-                    self._hypno[tstart:tend] = stage
+                    self._hypno.set_samples(tstart, tend, stage)
             # Update hypnogram :
-            self._hypedit._transient(-self._hypno, self._time)
+            self._hypedit._transient(self._hypno, self._time)
             self._hypedit.color = np.tile(self._hypedit.color_static,
                                           (self._hypedit.pos.shape[0], 1))
             self._hyp.edit.set_data(pos=self._hypedit.pos,
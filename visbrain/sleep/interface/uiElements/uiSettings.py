@@ -111,8 +111,8 @@ class uiSettings(object):
             filename: str
                 Filename (with full path) of the file to save
 
-            hypno: np.ndarray
-                Hypnogram array, same length as data
+            hypno: EpochHypno
+                Hypnogram, same length as data
 
             sf: int
                 Sampling frequency of the data (after downsampling)
@@ -124,9 +124,8 @@ class uiSettings(object):
 
         # Check data format
         sf = int(sf)
-        hypno = hypno.astype(int)
-        # Save
-        export = np.append(hdr, hypno[::sf].astype(str))
+        # Save (one value per second)
+        export = np.append(hdr, hypno[::sf].astype(int).astype(str))
         np.savetxt(filename, export, fmt='%s')
 
     def _save_hypno_txt(self, filename, hypno, sf, window=1.):
@@ -138,8 +137,8 @@ class uiSettings(object):
             filename: str
                 Filename (with full path) of the file to save
 
-            hypno: np.ndarray
-                Hypnogram array, same length as data
+            hypno: EpochHypno
+                Hypnogram, same length as data
 
             sf: float
                 Sampling frequency of the data (after downsampling)
@@ -235,6 +234,14 @@ class uiSettings(object):
     # =====================================================================
     # SLIDER
     # =====================================================================
+    def _fcn_timeIndex(self, xlim):
+        """Find the closest time indices of a (start, end) time window."""
+        idx = np.searchsorted(self._time, xlim)
+        idx = np.clip(idx, 1, len(self._time) - 1)
+        left, right = self._time[idx - 1], self._time[idx]
+        idx -= np.abs(left - xlim) <= np.abs(right - xlim)
+        return [int(idx[0]), int(idx[1])]
+
     def _fcn_sliderMove(self):
         """Function applied when the slider move."""
         # ================= INDEX =================
@@ -249,9 +256,7 @@ class uiSettings(object):
         unit = self._slRules.currentText()
 
         # Find closest time index :
-        t = [0, 0]
-        t[0] = round(np.abs(self._time - xlim[0]).argmin())
-        t[1] = round(np.abs(self._time - xlim[1]).argmin())
+        t = self._fcn_timeIndex(xlim)
 
         # ================= MESH UPDATES =================
         # ---------------------------------------
@@ -259,6 +264,14 @@ class uiSettings(object):
         sl = slice(t[0], t[1])
         self._chan.set_data(self._sf, self._data, self._time, sl=sl,
                             ylim=self._ylims)
+        # Prepare previous / next windows in background :
+        slices = []
+        for k in range(1, self._nprefetch + 1):
+            for v in [val + k, val - k]:
+                if self._SlVal.minimum() <= v <= self._SlVal.maximum():
+                    slices.append(slice(*self._fcn_timeIndex(
+                        (v * step, v * step + win))))
+        self._chan.prefetch(self._sf, self._data, self._time, slices)
 
         # ---------------------------------------
         # Update spectrogram indicator :
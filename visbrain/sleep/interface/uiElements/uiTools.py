@@ -48,8 +48,8 @@ class uiTools(object):
         self._chan.fstart = fstart
         self._chan.fend = fend
         self._chan.forder = filtorder
-        self._chan.filt_type = filttype
-        self._chan.filt_band = filtband
+        self._chan.filt_meth = filttype
+        self._chan.btype = filtband
 
         self._chan.update()
 
@@ -63,8 +63,8 @@ class uiTools(object):
         self._spec.fstart = fstart
         self._spec.fend = fend
         self._spec.forder = filtorder
-        self._spec.filt_type = filttype
-        self._spec.filt_band = filtband
+        self._spec.filt_meth = filttype
+        self._spec.btype = filtband
 
         self._spec.update()
 
@@ -12,7 +12,8 @@ import vispy.app as visapp
 from .interface import uiInit, uiElements
 from .visuals import visuals
 from .tools import Tools
-from ..utils import FixedCam, load_sleepdataset, load_hypno, color2vb
+from ..utils import (FixedCam, load_sleepdataset, load_hypno, color2vb,
+                     LazyData, decimate, DetectionCache, EpochHypno)
 # from ...utils import id
 # from .user import userfcn
 
@@ -43,11 +44,14 @@ class Sleep(uiInit, visuals, uiElements, Tools):
         sf: float, optional, (def: None)
             The sampling frequency of raw data.
 
-        hypno: np.ndarray, optional, (def: None)
-            Hypnogram data. Should be a raw vector of shape (n_pts,)
+        hypno: np.ndarray / EpochHypno, optional, (def: None)
+            Hypnogram data. Should be a raw vector of shape (n_pts,) or an
+            EpochHypno (one stage per epoch)
 
         downsample: float, optional, (def: 100.)
             The downsampling frequency for the data and hypnogram raw data.
+            If None (or not lower than the sampling frequency), data are
+            used at their native sampling frequency.
 
         axis: bool, optional, (def: Fals)
             Specify if each axis have to contains its own axis. Be carefull
@@ -57,10 +61,24 @@ class Sleep(uiInit, visuals, uiElements, Tools):
             Specify the line rendering. Use 'gl' for the default line (fast) or
             'agg' for smooth lines. This option might not works on some
             plateforms.
+
+        lazy: bool, optional, (def: False)
+            If True, the data file is not loaded in memory. Only the displayed
+            window (or the analysed channel) is read from the file.
+
+        cache: bool/string, optional, (def: False)
+            Store the converted data in a binary cache (next to the file if
+            True or in the specified folder) so that the next opening of the
+            same file is almost instantaneous. Ignored if lazy is True.
+
+        detection_cache: string, optional, (def: None)
+            Folder where the results of detections (REM, spindles, peaks) are
+            persisted. Detections are always cached in memory.
     """
 
     def __init__(self, file=None, hypno_file=None, data=None, channels=None,
-                 sf=None, hypno=None, downsample=100., axis=False, line='gl'):
+                 sf=None, hypno=None, downsample=100., axis=False, line='gl',
+                 lazy=False, cache=False, detection_cache=None):
         """Init."""
         # ====================== APP CREATION ======================
         # Create the app and initialize all graphical elements :
@@ -84,13 +102,10 @@ class Sleep(uiInit, visuals, uiElements, Tools):
                         "Text file (*.txt);;""CSV file (*.csv);;All files "
                         "(*.*)")
 
-            # Load dataset :
-            if downsample:
-                # Apply a specific downsampling (Elan only)
-                sf, data, channels = load_sleepdataset(file, downsample)
-            else:
-                # Default: Apply 100 Hz downsampling (Elan only)
-                sf, data, channels = load_sleepdataset(file)
+            # Load dataset (native sampling frequency if downsample is
+            # None) :
+            sf, data, channels = load_sleepdataset(file, downsample,
+                                                   lazy=lazy, cache=cache)
 
             if hypno_file:
                 # Load hypnogram :
@@ -111,6 +126,10 @@ class Sleep(uiInit, visuals, uiElements, Tools):
         self._lwhyp = 2.
         self._ax = axis
         self._defwin = 30.
+        # Number of previous / next windows prepared in background :
+        self._nprefetch = 2
+        # Detection results :
+        self._detcache = DetectionCache(path=detection_cache)
         # Color :
         self._chancolor = '#292824'
         self._hypcolor = '#292824'
@@ -178,7 +197,7 @@ class Sleep(uiInit, visuals, uiElements, Tools):
             sf: float
                 The sampling frequency.
 
-            data: np.ndarray
+            data: np.ndarray / LazyData
                 The data to use. Must be a (n_channels, n_pts) array.
 
             channel: list
@@ -186,24 +205,26 @@ class Sleep(uiInit, visuals, uiElements, Tools):
                 The length of this list must be n_channels.
 
         Kargs:
-            hypno: np.ndarray, optional, (def: None)
-                A row vector of shape (npts,) containing hypnogram values.
-                If the hypnogram is None, this functions returns a row vector
-                fill with zeros.
+            hypno: np.ndarray / EpochHypno, optional, (def: None)
+                A row vector of shape (npts,) containing hypnogram values
+                or an EpochHypno. If the hypnogram is None, this functions
+                returns an hypnogram fill with zeros.
 
             downsample: float, optional, (def: None)
-                The down-sampling frequency. If this variable is not None it
-                will replace the sampling frequency.
+                The down-sampling frequency. If this variable is lower than
+                the sampling frequency, it will replace the sampling
+                frequency. Data are low-pass filtered before downsampling to
+                prevent aliasing. Data are never upsampled.
 
         Returns:
             sf: float
                 The sampling frequency
 
-            data: np.ndarray
+            data: np.ndarray / LazyData
                 The float 32 data with a shape of (n_channels, n_pts).
 
-            hypno: np.ndarray
-                The float 32 hypnogram with a shape of (npts,).
+            hypno: EpochHypno
+                The hypnogram (one stage per epoch) of length npts.
 
             time: np.ndarray
                 The time vector with a shape of (npts,).
@@ -220,6 +241,9 @@ class Sleep(uiInit, visuals, uiElements, Tools):
         if data.ndim is not 2:
             raise ValueError("The data must be a 2D array")
         if data.shape[0] is not nchan:
+            if isinstance(data, LazyData):
+                raise ValueError("Lazy data must be organized as "
+                                 "(n_channels, n_time_points)")
             warn("Organize data array as (n_channels, n_time_points) is more "
                  "memory efficient")
             data = data.T
@@ -228,52 +252,56 @@ class Sleep(uiInit, visuals, uiElements, Tools):
         if nchan not in data.shape:
             raise ValueError("Incorrect data shape. The number of channels "
                              "("+str(nchan)+') can not be found.')
-        # Check hypnogram and format to float32 :
+        # Check hypnogram and store one stage per epoch (1 second) :
+        empty = EpochHypno(np.zeros((int(np.ceil(npts / sf)),)), sf, npts)
         if hypno is None:
-            hypno = np.zeros((npts,), dtype=np.float32)
+            hypno = empty
         else:
+            if not isinstance(hypno, EpochHypno):
+                hypno = EpochHypno.from_samples(hypno, sf)
             # Check hypno length :
             if len(hypno) != npts:
                 if len(hypno) < npts:
                     # Classic bug in Elan hypnogram file where EEG data is
                     # slightly longer than hyp file
-                    hypno = np.append(hypno,
-                                      (-1 * np.zeros((npts-len(hypno), 1))))
+                    hypno = hypno.resize(npts)
                 else:
                     raise ValueError("The length of the hypnogram \
                                      vector must be" + str(npts) +
                                      " (Currently : " + str(len(hypno)) + ".")
             # Check hypno values :
-            if (hypno.min() < -1.) or (hypno.max() > 4):
+            stages = hypno.stages()
+            if (stages.min() < -1.) or (stages.max() > 4):
                 warn("\nHypnogram values must be comprised between -1 and 4 "
                      "(see Iber et al. 2007). Use:\n-1 -> Art (optional)\n 0 "
                      "-> Wake\n 1 -> N1\n 2 -> N2\n 3 -> N4\n 4 -> REM\nEmpty "
                      "hypnogram will be used instead")
-                hypno = np.zeros((npts,), dtype=np.float32)
+                hypno = empty
         # Define time vector :
         time = np.arange(npts, dtype=np.float32) / sf
 
         # ========================== DOWN-SAMPLING ==========================
-        if isinstance(downsample, (int, float)):
-            # Find frequency ratio :
-            fratio = round(sf / downsample)
-            # Select time, data and hypno points :
-            data = data[:, ::fratio]
-            time = time[::fratio]
-            hypno = hypno[::fratio]
+        if isinstance(downsample, (int, float)) and (0 < downsample < sf):
+            # Anti-aliased downsampling of the data :
+            if isinstance(data, LazyData):
+                data = data.decimate(sf, downsample)
+            else:
+                data = decimate(data, sf, downsample)
+            # Resample the hypnogram epochs :
+            time = np.arange(data.shape[1], dtype=np.float32) / downsample
+            hypno = hypno.resample(sf / downsample, data.shape[1])
             # Replace sampling frequency :
             sf = float(downsample)
 
         # ========================== CONVERSION ==========================
-        # Convert data and hypno to be contiguous and float 32 (for vispy):
-        if not data.flags['C_CONTIGUOUS']:
+        # Convert data to be contiguous and float 32 (for vispy).
+        # Lazy data are already returned as float 32 :
+        if isinstance(data, LazyData):
+            pass
+        elif not data.flags['C_CONTIGUOUS']:
             data = np.ascontiguousarray(data, dtype=np.float32)
         if data.dtype != np.float32:
             data = data.astype(np.float32, copy=False)
-        if not hypno.flags['C_CONTIGUOUS']:
-            hypno = np.ascontiguousarray(hypno, dtype=np.float32)
-        if hypno.dtype != np.float32:
-            hypno = hypno.astype(np.float32, copy=False)
 
         return sf, data, hypno, time
 
@@ -0,0 +1,39 @@
+"""Test the hypnogram edition tools."""
+import numpy as np
+
+from visbrain.utils.sleep.hypnoprocessing import EpochHypno, transient
+from visbrain.sleep.tools.tools import _drag_bounds
+
+
+def _markers(hypno, time):
+    """Get the time of the markers (as HypnoEdition._transient)."""
+    tr = transient(hypno, time)[0] + 1
+    return np.sort(time[np.r_[0, len(hypno) - 1, tr]])
+
+
+def test_drag_last_marker():
+    """Dragging the last marker edits the whole tail of the hypnogram."""
+    sf, epoch = 100., 3000
+    hypno = EpochHypno([0, 0, 1, 2, 2, 3, 3, 3, 4, 4], epoch, 10 * epoch)
+    time = np.arange(len(hypno)) / sf
+    markers = _markers(hypno, time)
+    start, stop = _drag_bounds(time, markers[-2], markers[-1])
+    assert (start, stop) == (8 * epoch, len(hypno))
+    hypno.set_samples(start, stop, 1)
+    assert np.all(np.asarray(hypno)[8 * epoch:] == 1)
+    assert hypno.epoch == epoch
+
+
+def test_drag_marker():
+    """Dragging a marker edits the samples up to the next marker."""
+    sf, epoch = 100., 3000
+    hypno = EpochHypno([0, 0, 1, 2, 2, 3, 3, 3, 4, 4], epoch, 10 * epoch)
+    ref = np.asarray(hypno).copy()
+    time = np.arange(len(hypno)) / sf
+    markers = _markers(hypno, time)
+    start, stop = _drag_bounds(time, markers[2], markers[3])
+    assert (start, stop) == (3 * epoch, 5 * epoch)
+    hypno.set_samples(start, stop, 4)
+    ref[start:stop] = 4
+    assert np.array_equal(np.asarray(hypno), ref)
+    assert hypno.epoch == epoch
@@ -19,7 +19,7 @@ class Tools(object):
 
         # =========== HYPNOGRAM EDITION ===========
         yaxis = (self._hypcam.rect.bottom, self._hypcam.rect.top)
-        self._hypedit = HypnoEdition(self._sf, self._hyp, -self._hypno,
+        self._hypedit = HypnoEdition(self._sf, self._hyp, self._hypno,
                                      self._time, self._hypCanvas.canvas, yaxis,
                                      enable=True, fcn=[self._fcn_infoUpdate,
                                                        self._fcn_Hypno2Score])
@@ -45,7 +45,8 @@ class PeakDetection(object):
         self._edgewidth = edge_width
         self._size = size
 
-    def set_data(self, sf, data, time, marker, display='max', lookahead=10.):
+    def set_data(self, sf, data, time, marker, display='max', lookahead=10.,
+                 peaks=None):
         """Find peaks according to data.
 
         Args:
@@ -69,9 +70,15 @@ class PeakDetection(object):
             lookahead: float, optional, (def: 10.)
                 Distance to look ahead from a peak candidate to determine if
                 it is the actual peaks
+
+            peaks: list, optional, (def: None)
+                Already detected [max_peaks, min_peaks] (output of
+                peakdetect). If None, peaks are detected.
         """
         # Find peaks (Max, Min) :
-        M, m = peakdetect(data, time, int(lookahead))
+        if peaks is None:
+            peaks = peakdetect(data, time, int(lookahead))
+        M, m = peaks
         # Extract (x, y) coordinates for (Max, Min) peaks :
         xM, yM = zip(*M)
         xm, ym = zip(*m)
@@ -109,8 +116,11 @@ class HypnoEdition(object):
         hypno_obj: Hypnogram
             The hypnogram object.
 
-        data: np.ndarray
-            Hypnogram data.
+        data: EpochHypno
+            Hypnogram data (edited inplace).
+
+        time: np.ndarray
+            The time vector.
 
         canvas: AxisCanvas.canvas
             The canvas on which mouse will be active.
@@ -195,9 +205,6 @@ class HypnoEdition(object):
                 # Find previous / next marker position :
                 xprev = self.pos[xpos == xpos_sorted[xpos_z-1], 0]
                 xnext = self.pos[xpos == xpos_sorted[xpos_z+1], 0]
-                # Find their position in the time vector :
-                # xtprev = np.abs(time - xprev).argmin()
-                xtnext = np.abs(time - xnext).argmin()
                 # Move cursor only if xprev <= x < xnext and if -4 <= y <= 1:
                 if all([cpos[0, 0] >= xprev,  cpos[0, 0] <= xnext,
                        cpos[0, 1] <= 1, cpos[0, 1] >= -4]):
@@ -205,10 +212,11 @@ class HypnoEdition(object):
                     cpos[0, 1] = float(round(cpos[0, 1]))
                     # Update position :
                     self.pos[self.keep_idx, 1] = cpos[0, 1]
-                    # Stream hypno data :
-                    xtpos = np.abs(time-self.pos[self.keep_idx, 0]).argmin()
-                    data[xtpos:xtnext+1] = cpos[0, 1]
-                    hypno_obj.set_data(sf, -data, time)
+                    # Stream hypno data (only the edited runs are redrawn) :
+                    xtpos, xtnext = _drag_bounds(
+                        time, self.pos[self.keep_idx, 0], xnext)
+                    edited = data.set_samples(xtpos, xtnext, -cpos[0, 1])
+                    hypno_obj.update_data(data, *edited)
                     # Temporaly turn dragged point to color_dragge :
                     cbackup[self.keep_idx, :] = self.color_dragge
                     # Send data marker :
@@ -266,7 +274,7 @@ class HypnoEdition(object):
             # Get y position :
             if force:
                 # Force cursor to be on the hypnogram :
-                val = data[np.abs(time - cursor).argmin()]
+                val = -data[_time_index(time, cursor)]
             else:
                 # Return converted y axis :
                 val = (yaxis[0]-yaxis[1]) * pos[1] / canvas.size[1] + yaxis[1]
@@ -367,7 +375,7 @@ class HypnoEdition(object):
         predifined markers.
 
         Args:
-            data: np.ndarray
+            data: EpochHypno
                 The hypnogram data.
 
             time: np.ndarray
@@ -378,9 +386,43 @@ class HypnoEdition(object):
         # tr = np.append(tr, tr + 1)
         tr = np.array([0, len(data)-1] + list(tr))
         # Predefined positions :
-        self.pos = np.array([time[tr], data[tr], np.full_like(tr, -1.)]).T
+        self.pos = np.array([time[tr], -data[tr], np.full_like(tr, -1.)]).T
 
     def update(self):
         """Update markers."""
         # Simulate a mouse movement :
         self._call(self.event)
+
+
+def _time_index(time, t):
+    """Get the index of the closest value of a sorted time vector."""
+    t = np.ravel(t)[0]
+    idx = int(np.clip(np.searchsorted(time, t), 1, len(time) - 1))
+    return idx - 1 if t - time[idx - 1] <= time[idx] - t else idx
+
+
+def _drag_bounds(time, xpos, xnext):
+    """Get the samples edited when a marker is dragged.
+
+    The samples from the dragged marker to the next marker (excluded) are
+    edited, except for the last run which is edited up to the end of the
+    hypnogram (the last marker is on the last sample).
+
+    Args:
+        time: np.ndarray
+            The time vector.
+
+        xpos: float
+            Time of the dragged marker.
+
+        xnext: float
+            Time of the next marker.
+
+    Returns:
+        start, stop: int
+            First and last (excluded) edited samples.
+    """
+    start, stop = _time_index(time, xpos), _time_index(time, xnext)
+    if stop == len(time) - 1:
+        stop = len(time)
+    return start, stop
@@ -3,14 +3,24 @@
 This file contains and initialize visual objects (channel plot, spectrogram,
 hypnogram, indicator, shortcuts)
 """
+import threading
+import tempfile
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import scipy.signal as scpsig
 
+import matplotlib.cm as cm
 from vispy import scene
+from vispy.color import Colormap
 import vispy.visuals.transforms as vist
 
 from .marker import Markers
-from ...utils import array2colormap, color2vb, filt
+from ...utils import (color2vb, filt, intervals_overlap, tf_morlet,
+                      spectrogram, EpochHypno)
+from ...utils.filtering import _filt_blocks
 
 
 __all__ = ["visuals"]
@@ -28,12 +38,14 @@ class visuals(object):
                                  width=self._lw, color_detection=self._indicol,
                                  parent=self._chanCanvas,
                                  fcn=self._fcn_sliderMove)
+        self._chan.set_pyramid(data)
 
         # =================== SPECTROGRAM ===================
         # Create a spectrogram object :
         self._spec = Spectrogram(camera=cameras[1], fcn=self._fcn_specSetData,
                                  parent=self._specCanvas.wc.scene)
-        self._spec.set_data(sf, data[0, ...], time, cmap=self._defcmap)
+        self._spec.set_data(sf, data[0, ...], time, cmap=self._defcmap,
+                            chan=0)
         # Create a visual indicator for spectrogram :
         self._specInd = Indicator(name='spectro_indic', visible=True, alpha=.3,
                                   parent=self._specCanvas.wc.scene)
@@ -73,11 +85,19 @@ class PrepareData(object):
         - De-meaning
         - De-trending
         - Filtering
+
+    For windows of 2D data (see _prepare_window), each channel is filtered
+    entirely (block by block, in float32) in a background thread and then
+    served from a memory-bounded cache (channels that are too large are
+    stored in a temporary memmap). Windows are then only demeaned /
+    detrended. Cached data are identified by a generation number which
+    changes each time a new data object is used (see _data_key).
     """
 
     def __init__(self, axis=0, demean=False, detrend=False, filt=False,
                  fstart=12., fend=16., forder=3, way='lfilter',
-                 filt_meth='butterworth', btype='bandpass'):
+                 filt_meth='butterworth', btype='bandpass',
+                 filt_cache=2 ** 28):
         # Axis along which to perform preparation :
         self.axis = axis
         # Demean and detrend :
@@ -88,13 +108,136 @@ class PrepareData(object):
         self.fstart, self.fend = fstart, fend
         self.forder, self.filt_meth = forder, filt_meth
         self.way, self.btype = way, btype
+        # Cache of filtered channels :
+        self._fcache = OrderedDict()
+        self._fcache_size = filt_cache
+        self._fcache_bytes = 0
+        self._fpending = {}
+        self._flock = threading.Lock()
+        self._fexecutor = None
+        # Generation of the data object :
+        self._fdata = None
+        self._fgen = 0
 
     def __bool__(self):
         """Return if data have to be prepared."""
         return any([self.demean, self.detrend, self.filt])
 
-    def _prepare_data(self, sf, data, time):
-        """Prepare data before plotting."""
+    def _filt_settings(self):
+        """Get the current filtering settings."""
+        return (self.fstart, self.fend, self.forder, self.way,
+                self.filt_meth, self.btype)
+
+    def _data_key(self, data):
+        """Get the generation number of a data object.
+
+        Unlike id(data), the number is never reused by another object.
+        """
+        with self._flock:
+            if (self._fdata is None) or (self._fdata() is not data):
+                self._fdata = weakref.ref(data)
+                self._fgen += 1
+            return self._fgen
+
+    def _filt_channel(self, key, sf, data, chan):
+        """Filter an entire channel (background thread)."""
+        try:
+            npts = data.shape[1]
+            # Large channels are stored on disk (4 bytes per point) :
+            if 4 * npts > self._fcache_size // 4:
+                x = np.memmap(tempfile.TemporaryFile(), dtype=np.float32,
+                              mode='w+', shape=(npts,))
+            else:
+                x = np.empty((npts,), dtype=np.float32)
+
+            def read(start, stop):
+                return data[chan, start:stop]
+
+            _filt_blocks(sf, [self.fstart, self.fend], read, npts, x,
+                         btype=self.btype, order=self.forder,
+                         method=self.filt_meth, way=self.way)
+            with self._flock:
+                self._fpending.pop(key, None)
+                # Settings may have changed during the filtering :
+                if key[2] != self._filt_settings():
+                    return
+                self._fcache[key] = x
+                self._fcache_bytes += x.nbytes
+                while self._fcache_bytes > self._fcache_size and len(
+                        self._fcache) > 1:
+                    self._fcache_bytes -= self._fcache.popitem(
+                        last=False)[1].nbytes
+        except Exception:
+            with self._flock:
+                self._fpending.pop(key, None)
+            raise
+
+    def _get_filtered(self, sf, data, chan):
+        """Get filtered channels from the cache.
+
+        Channels that are not in the cache are filtered in background and
+        None is returned.
+        """
+        settings = self._filt_settings()
+        gen = self._data_key(data)
+        keys = [(gen, int(k), settings) for k in chan]
+        with self._flock:
+            # Drop channels of other data or filtered with other settings :
+            for k in [k for k in self._fcache if k[0] != gen or (
+                    k[2] != settings)]:
+                self._fcache_bytes -= self._fcache.pop(k).nbytes
+            missing = [(k, c) for k, c in zip(keys, chan) if (
+                k not in self._fcache) and (k not in self._fpending)]
+            if missing and self._fexecutor is None:
+                self._fexecutor = ThreadPoolExecutor(max_workers=1)
+            for k, c in missing:
+                self._fpending[k] = self._fexecutor.submit(
+                    self._filt_channel, k, sf, data, c)
+            if not all([k in self._fcache for k in keys]):
+                return None
+            for k in keys:
+                self._fcache.move_to_end(k)
+            return [self._fcache[k] for k in keys]
+
+    def _prepare_window(self, sf, data, time, chan, sl):
+        """Prepare a window of 2D data.
+
+        Args:
+            sf: float
+                The sampling frequency.
+
+            data: np.ndarray
+                Array of data of shape (n_channels, n_points)
+
+            time: np.ndarray
+                The time vector.
+
+            chan: np.ndarray
+                Index of channels to prepare.
+
+            sl: slice
+                The time slice of the window.
+
+        Returns:
+            x: np.ndarray
+                The prepared data of shape (len(chan), n_window).
+
+            exact: bool
+                False if the window had to be filtered alone (edge effects)
+                because the entire channels are not filtered yet.
+        """
+        filtered = self._get_filtered(sf, data, chan) if self.filt else None
+        if filtered is not None:
+            x = np.array([k[sl] for k in filtered], dtype=np.float32)
+            return self._prepare_data(sf, x, time[sl], filtered=True), True
+        x = np.array(data[chan, sl], dtype=np.float32)
+        return self._prepare_data(sf, x, time[sl]), not self.filt
+
+    def _prepare_data(self, sf, data, time, filtered=False):
+        """Prepare data before plotting.
+
+        If filtered is True, data are considered as already filtered.
+        """
         # ============= DEMEAN =============
         if self.demean:
             mean = np.mean(data, axis=self.axis, keepdims=True)
@@ -105,7 +248,7 @@ class PrepareData(object):
             data = scpsig.detrend(data, axis=self.axis)
 
         # ============= FILTERING =============
-        if self.filt:
+        if self.filt and not filtered:
             data = filt(sf, np.array([self.fstart, self.fend]), data,
                         btype=self.btype, order=self.forder, way=self.way,
                         method=self.filt_meth, axis=self.axis)
@@ -118,22 +261,91 @@ class PrepareData(object):
             self._fcn()
 
 
+def _minmax(data, bsize):
+    """Get the min / max of consecutive blocks of bsize points.
+
+    The last block is padded with the last point of data.
+
+    Args:
+        data: np.ndarray
+            Array of data of shape (..., n_points).
+
+        bsize: int
+            Number of points per block.
+
+    Returns:
+        vmin, vmax: np.ndarray
+            Min and max arrays of shape (..., ceil(n_points / bsize)).
+    """
+    n = data.shape[-1]
+    nb = -(-n // bsize)
+    if nb * bsize != n:
+        pad = np.repeat(data[..., -1:], nb * bsize - n, axis=-1)
+        data = np.concatenate((data, pad), axis=-1)
+    data = data.reshape(data.shape[:-1] + (nb, bsize))
+    return data.min(-1), data.max(-1)
+
+
 class ChannelPlot(PrepareData):
-    """Plot each channel."""
+    """Plot each channel.
+
+    When the displayed window contains much more points than the number of
+    pixels of the canvas, each channel is plotted using its min / max
+    envelope (one vertical segment per bin). Envelopes are taken from a
+    min / max pyramid (see set_pyramid). The levels of a channel are only
+    computed when the channel is displayed and are kept in a LRU cache.
+
+    Each line keeps its vertex buffer between two calls of set_data. While the
+    number of vertices does not change (e.g. when moving the slider), only
+    the y column is rewritten on the CPU and the time offset is applied
+    through the transform of the line. The whole (n_vertices, 3) buffer is
+    still sent to the GPU (vispy's Line has no partial update), but thanks
+    to the envelope its size depends on the width of the canvas, not on the
+    length of the window.
+
+    Prepared windows (sliced, demeaned / detrended / filtered and reduced) are
+    kept in a LRU cache. Use prefetch() to prepare windows in a background
+    thread before they are displayed.
+
+    Kargs:
+        pyramid_cache: int, optional, (def: 2**27)
+            Maximum size (in bytes) of the cached pyramids. The pyramid of a
+            channel takes about half the size of its float32 data.
+    """
 
     def __init__(self, channels, time, color=(.2, .2, .2),
                  color_detection='red', width=1.5, method='gl', camera=None,
-                 parent=None, fcn=None):
+                 parent=None, fcn=None, bin_size=8, cache_size=16,
+                 pyramid_cache=2 ** 27):
         # Initialize PrepareData :
         PrepareData.__init__(self, axis=1)
 
         # Variables :
         self._camera = camera
+        self._parent = parent
+        self._bin_size = bin_size
+        self._ylim = None
+        # Pyramids of channels (computed on demand) :
+        self._pdata, self._pchunk = None, 2 ** 22
+        self._plevels = []
+        self._pyramid = OrderedDict()
+        self._pyramid_size = pyramid_cache
+        self._pyramid_bytes = 0
+        self._plock = threading.Lock()
+        self._pos = [None] * len(channels)
+        self._poskey = [None] * len(channels)
+        # Cache of prepared windows :
+        self._frames = OrderedDict()
+        self._cache_size = cache_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = None
         self.rect = []
         self.width = width
+        # Detections (as (start, stop) intervals) of each channel.
         # Don't use self.colidx = [{...}] * len(channels)
-        self.colidx = [{'color': color_detection, 'idx': np.array([
-                                            ])} for _ in range(len(channels))]
+        self.colidx = [{'color': color_detection, 'idx': np.zeros((
+                       0, 2), dtype=int)} for _ in range(len(channels))]
         self._fcn = fcn
         self.visible = np.array([True] + [False] * (len(channels) - 1))
 
@@ -150,6 +362,7 @@ class ChannelPlot(PrepareData):
             mesh = scene.visuals.Line(pos, name=k+'plot', color=self.color,
                                       method=method, parent=parent[i].wc.scene)
             mesh.set_gl_state('translucent')
+            mesh.transform = vist.STTransform()
             self.mesh.append(mesh)
             # ----------------------------------------------
             # Create marker peaks :
@@ -164,6 +377,7 @@ class ChannelPlot(PrepareData):
                                      color=self.color_detection,
                                      parent=parent[i].wc.scene)
             rep.set_gl_state('translucent')
+            rep.transform = vist.STTransform()
             self.report.append(rep)
             # ----------------------------------------------
             # Create a grid :
@@ -173,6 +387,252 @@ class ChannelPlot(PrepareData):
             grid.set_gl_state('translucent')
             self.grid.append(grid)
 
+    def set_pyramid(self, data, chunk=2 ** 22):
+        """Set the data of the min / max pyramid.
+
+        Level k contains the min / max of blocks of bin_size * 2 ** k points,
+        for every level with at least 256 blocks. Nothing is computed here
+        except the min / max of each channel, kept as the default y-limits
+        (see _get_pyramid).
+
+        Args:
+            data: np.ndarray / LazyData
+                Array of data of shape (n_channels, n_points)
+
+        Kargs:
+            chunk: int, optional, (def: 2 ** 22)
+                Number of values read at once.
+        """
+        npts = data.shape[1]
+        with self._plock:
+            self._pdata, self._pchunk = data, chunk
+            self._pyramid.clear()
+            self._pyramid_bytes = 0
+        with self._lock:
+            self._frames.clear()
+        self._ylim = np.array([data.min(1), data.max(1)]).T
+        # Bin size of each level :
+        bsize, self._plevels = self._bin_size, []
+        if npts // bsize >= 256:
+            nb = -(-npts // bsize)
+            self._plevels.append(bsize)
+            while nb // 2 >= 256:
+                bsize, nb = 2 * bsize, -(-nb // 2)
+                self._plevels.append(bsize)
+
+    def _get_pyramid(self, chan):
+        """Get the levels of the pyramid of a channel.
+
+        Levels are computed from the data given to set_pyramid the first
+        time the channel is requested and then taken from the cache.
+
+        Returns:
+            levels: list
+                List of (vmin, vmax) vectors, one per level.
+        """
+        with self._plock:
+            if chan in self._pyramid:
+                self._pyramid.move_to_end(chan)
+                return self._pyramid[chan]
+            data, chunk = self._pdata, self._pchunk
+        npts, bsize = data.shape[1], self._bin_size
+        # First level (computed block by block) :
+        step = max(1, chunk // bsize) * bsize
+        nb = -(-npts // bsize)
+        vmin = np.empty((nb,), dtype=np.float32)
+        vmax = np.empty((nb,), dtype=np.float32)
+        for k in range(0, npts, step):
+            sl = slice(k // bsize, -(-min(k + step, npts) // bsize))
+            vmin[sl], vmax[sl] = _minmax(data[chan, k:k + step], bsize)
+        levels = [(vmin, vmax)]
+        # Next levels (from the previous one) :
+        for _ in self._plevels[1:]:
+            vmin, vmax = _minmax(vmin, 2)[0], _minmax(vmax, 2)[1]
+            levels.append((vmin, vmax))
+        with self._plock:
+            # Data may have changed during the computation :
+            if (data is self._pdata) and (chan not in self._pyramid):
+                self._pyramid[chan] = levels
+                self._pyramid_bytes += sum([k.nbytes + v.nbytes for k, v in
+                                            levels])
+                while self._pyramid_bytes > self._pyramid_size and len(
+                        self._pyramid) > 1:
+                    self._pyramid_bytes -= sum([k.nbytes + v.nbytes for k, v
+                                                in self._pyramid.popitem(
+                                                    last=False)[1]])
+        return levels
+
+    def _get_width(self, i):
+        """Get the width (in pixels) of the canvas of channel i."""
+        try:
+            return max(int(self._parent[i].wc.size[0]), 1)
+        except (AttributeError, TypeError, IndexError):
+            return 1000
+
+    def _get_level(self, npts, width):
+        """Get the pyramid level matching a number of points and pixels."""
+        level = None
+        for k, bsize in enumerate(self._plevels):
+            if npts // bsize >= width:
+                level = k
+        return level
+
+    def _get_buffer(self, i, time, bsize):
+        """Get the vertex buffer of channel i.
+
+        The buffer is only (re)allocated if the number of vertices or the bin
+        size change. Otherwise, the relative time column is kept as is (the
+        buffer is nevertheless entirely uploaded by Line.set_data).
+
+        Returns:
+            pos: np.ndarray
+                The (n_vertices, 3) buffer. Time is relative to time[0].
+
+            new: bool
+                True if the buffer has been (re)allocated.
+        """
+        key = (len(time), bsize, self.width, tuple(self.color.ravel()))
+        if self._poskey[i] == key:
+            return self._pos[i], False
+        pos = np.empty((len(time), 3), dtype=np.float32)
+        pos[:, 0] = time - time[0]
+        pos[:, 2] = .5
+        self._pos[i], self._poskey[i] = pos, key
+        return pos, True
+
+    # ----------- PREPARED WINDOWS -----------
+    def _frame_key(self, data, sl, visible, width):
+        """Get the cache key of a window."""
+        settings = (self.demean, self.detrend, self.filt, self.fstart,
+                    self.fend, self.forder, self.way, self.filt_meth,
+                    self.btype)
+        return (self._data_key(data), sl.start, sl.stop, tuple(visible),
+                width, settings)
+
+    def _compute_frame(self, sf, data, time, sl, visible, width, prepare):
+        """Slice, prepare and reduce the data of a window.
+
+        Returns:
+            frame: tuple
+                (start, stop, bsize, time, data) where [start, stop[ is the
+                range of displayed points, bsize the number of points per
+                bin (1 if the data are not reduced) and time / data the
+                vertices of each visible channel.
+
+            exact: bool
+                False if the frame should not be cached (data filtered on
+                the window only).
+        """
+        exact = True
+        npts = sl.stop - sl.start
+        level = None if prepare else self._get_level(npts, width)
+        if level is not None:
+            # Use the pyramid (bins aligned on bsize) :
+            bsize = self._plevels[level]
+            bsl = slice(sl.start // bsize, -(-sl.stop // bsize))
+            start = bsl.start * bsize
+            stop = min(bsl.stop * bsize, data.shape[1])
+            dataSl = np.array([np.stack([k[bsl] for k in self._get_pyramid(
+                int(c))[level]], -1) for c in visible])
+        else:
+            start, stop = sl.start, sl.stop
+            # Prepare the data (only if needed) :
+            if prepare:
+                dataSl, exact = self._prepare_window(sf, data, time, visible,
+                                                     sl)
+            else:
+                dataSl = np.asarray(data[visible, sl])
+            # Compute the envelope on the fly :
+            bsize = self._bin_size
+            if npts // bsize >= width:
+                while npts // (2 * bsize) >= width:
+                    bsize *= 2
+                dataSl = np.stack(_minmax(dataSl, bsize), -1)
+            else:
+                bsize = 1
+        if bsize > 1:
+            # Two vertices (min, max) per bin :
+            dataSl = dataSl.reshape(len(visible), -1)
+            timeSl = np.repeat(time[start:stop:bsize], 2)
+        else:
+            timeSl = time[sl]
+        return (start, stop, bsize, timeSl, dataSl), exact
+
+    def _store_frame(self, key, frame, exact=True):
+        """Add a prepared window to the LRU cache."""
+        with self._lock:
+            if exact:
+                self._frames[key] = frame
+                self._frames.move_to_end(key)
+            while len(self._frames) > self._cache_size:
+                self._frames.popitem(last=False)
+            self._pending.pop(key, None)
+        return frame
+
+    def _get_frame(self, sf, data, time, sl, visible, width):
+        """Get a prepared window (from the cache if possible)."""
+        key = self._frame_key(data, sl, visible, width)
+        with self._lock:
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                return self._frames[key]
+            future = self._pending.get(key)
+        # The window is currently prepared in the background :
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                pass
+        frame, exact = self._compute_frame(sf, data, time, sl, visible,
+                                           width, bool(self))
+        return self._store_frame(key, frame, exact)
+
+    def prefetch(self, sf, data, time, slices):
+        """Prepare windows in a background thread.
+
+        Args:
+            sf: float
+                The sampling frequency.
+
+            data: np.ndarray
+                Array of data of shape (n_channels, n_points)
+
+            time: np.ndarray
+                The time vector.
+
+            slices: list
+                List of slice objects of the windows to prepare.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        visible = np.flatnonzero(self.visible)
+        prepare = bool(self)
+        for sl in slices:
+            npts = sl.stop - sl.start
+            if npts <= 0:
+                continue
+            width = min([self._get_width(i) for i in visible] + [npts])
+            key = self._frame_key(data, sl, visible, width)
+            with self._lock:
+                if (key in self._frames) or (key in self._pending):
+                    continue
+                self._pending[key] = self._executor.submit(
+                    self._prefetch_frame, key, sf, data, time, sl, visible,
+                    width, prepare)
+
+    def _prefetch_frame(self, key, *args):
+        """Prepare a window in the background thread."""
+        try:
+            frame, exact = self._compute_frame(*args)
+            # Settings may have changed during the computation :
+            if key[-1] != self._frame_key(args[1], args[3], (), 0)[-1]:
+                exact = False
+            return self._store_frame(key, frame, exact)
+        except Exception:
+            with self._lock:
+                self._pending.pop(key, None)
+            raise
+
     def set_data(self, sf, data, time, sl=None, ylim=None):
         """Set data to channels.
 
@@ -188,48 +648,63 @@ class ChannelPlot(PrepareData):
                 A slice object for the time selection of data.
 
             ylim: np.ndarray, optional, (def: None)
-                Y-limits of each channel. Must be a (n_channels, 2) array.
+                Y-limits of each channel. Must be a (n_channels, 2) array. If
+                None, the min / max of each channel are used.
         """
         if ylim is None:
-            ylim = np.array([data.min(1), data.max(1)]).T
+            if self._ylim is None:
+                self._ylim = np.array([data.min(1), data.max(1)]).T
+            ylim = self._ylim
 
         # Manage slice :
         sl = slice(0, data.shape[1]) if sl is None else sl
 
-        # Slice selection (of time and data) :
-        timeSl = time[sl]
-        self.x = (timeSl.min(), timeSl.max())
-        dataSl = data[self.visible, sl]
-        z = np.full_like(timeSl, .5, dtype=np.float32)
+        # Slice selection (of time) :
+        self.x = (time[sl].min(), time[sl].max())
+        npts = sl.stop - sl.start
+        visible = np.flatnonzero(self.visible)
 
-        # Prepare the data (only if needed) :
-        if self:
-            dataSl = self._prepare_data(sf, dataSl.copy(), timeSl)
-
-        # Build a index vector:
-        idx = np.arange(sl.start, sl.stop)
+        # ------------- PREPARED WINDOW -------------
+        # Number of pixels (the resolution depends on it) :
+        width = min([self._get_width(i) for i in visible] + [npts])
+        start, stop, bsize, timeSl, dataSl = self._get_frame(
+            sf, data, time, sl, visible, width)
+        offset = (timeSl[0], 0., 0.)
 
         # Set data to each plot :
         for l, (i, k) in enumerate(self):
-            # Concatenate time / data / z axis :
-            dat = np.vstack((timeSl, dataSl[l, :], z)).T
+            # Only update the y column of the vertex buffer (vispy uploads
+            # the entire buffer) :
+            dat, new = self._get_buffer(i, timeSl, bsize)
+            dat[:, 1] = dataSl[l, :]
 
             # Set main ligne :
-            # dat = np.ascontiguousarray(dat)
-            k.set_data(dat, color=self.color, width=self.width)
+            if new:
+                k.set_data(dat, color=self.color, width=self.width)
+            else:
+                k.set_data(dat)
+            k.transform.translate = offset
 
             # Indicator line :
             if self.colidx[i]['idx'].size:
-                # Find index that are both in idx and in indicator :
-                inter = np.intersect1d(idx, self.colidx[i]['idx']) - sl.start
+                # Find events overlapping [start, stop[ :
+                inter = intervals_overlap(self.colidx[i]['idx'], start,
+                                          stop) - start
                 # Build a array for connecting only consecutive segments :
-                index = np.zeros((len(idx)), dtype=bool)
-                index[inter] = True
+                index = np.zeros((stop - start + 1), dtype=int)
+                np.add.at(index, inter[:, 0], 1)
+                np.add.at(index, inter[:, 1], -1)
+                index = np.cumsum(index[:-1]) > 0
+                if bsize > 1:
+                    # A bin is reported if it contains a detected point :
+                    index = np.repeat(_minmax(index, bsize)[1], 2)
                 index[-1] = False
+                dat = dat.copy()
                 dat[:, 2] = -2.
                 # Send data to report :
                 self.report[i].set_data(pos=dat, connect=index, width=4.,
                                         color=self.colidx[i]['color'])
+                self.report[i].transform.translate = offset
 
             # Get camera rectangle and set it:
             rect = (self.x[0], ylim[i][0], self.x[1]-self.x[0],
@@ -264,6 +739,18 @@ class ChannelPlot(PrepareData):
         """Set parent value."""
         for i, k, in zip(value, self.mesh):
             k.parent = i.wc.scene
+        self._parent = value
+
+
+# Vispy colormaps (by matplotlib name) :
+_CMAPS = {}
+
+
+def _vispy_cmap(cmap, n=256):
+    """Get a vispy colormap from the name of a matplotlib colormap."""
+    if cmap not in _CMAPS:
+        _CMAPS[cmap] = Colormap(cm.get_cmap(cmap)(np.linspace(0., 1., n)))
+    return _CMAPS[cmap]
 
 
 class Spectrogram(PrepareData):
@@ -271,9 +758,23 @@ class Spectrogram(PrepareData):
 
     After object creation, use the set_data() method to pass new data, new
     color, new frequency / time range, new settings...
+
+    Power matrices (in dB) are cached in float32 for each channel and
+    settings, and can be computed in background (see warmup). The colormap
+    and the contrast are applied on the GPU so that changing them does not
+    require any computation.
+
+    Kargs:
+        spec_cache: int, optional, (def: 2**28)
+            Maximum size (in bytes) of the cached power matrices.
+
+        spec_jobs: int, optional, (def: 1)
+            Number of processes used to compute the Fourier spectrograms (see
+            visbrain.utils.spectrogram).
     """
 
-    def __init__(self, camera, parent=None, fcn=None):
+    def __init__(self, camera, parent=None, fcn=None, spec_cache=2 ** 28,
+                 spec_jobs=1):
         # Initialize PrepareData :
         PrepareData.__init__(self, axis=0)
 
@@ -283,11 +784,22 @@ class Spectrogram(PrepareData):
         self._fcn = fcn
 
         # Create a vispy image object :
-        self.mesh = scene.visuals.Image(np.zeros((2, 2)), name='spectrogram',
-                                        parent=parent)
+        self.mesh = scene.visuals.Image(np.zeros((2, 2), dtype=np.float32),
+                                        name='spectrogram', parent=parent)
+
+        # Cache of power matrices :
+        self._scache = OrderedDict()
+        self._scache_size = spec_cache
+        self._scache_bytes = 0
+        self._spending = {}
+        self._slock = threading.Lock()
+        self._sexecutor = None
+        self._sdisplayed = None
+        self._sjobs = spec_jobs
 
     def set_data(self, sf, data, time, cmap='rainbow', nfft=30., overlap=.5,
-                 fstart=.5, fend=25., contraste=.7):
+                 fstart=.5, fend=25., contraste=.7, method='fourier',
+                 nfreqs=100, chan=None):
         """Set data to the spectrogram.
 
         Use this method to change data, colormap, spectrogram settings, the
@@ -321,21 +833,34 @@ class Spectrogram(PrepareData):
 
             contraste: float, optional, (def: .7)
                 Contraste of the colormap.
+
+            method: string, optional, (def: 'fourier')
+                Use either 'fourier' (short-time Fourier transform with a
+                Hamming window), 'welch' (average of the periodograms of
+                sub-windows), 'multitaper' (DPSS tapers) or 'wavelet'
+                (Morlet's wavelets). For wavelets, the time step is given by
+                nfft - overlap.
+
+            nfreqs: int, optional, (def: 100)
+                Number of frequencies between fstart and fend for wavelets.
+
+            chan: int, optional, (def: None)
+                Index of the channel. If not None, the power matrix is cached
+                for this channel and the current settings.
         """
         # =================== CONVERSION ===================
         nperseg = int(round(nfft * sf))
         overlap = int(round(overlap * sf))
 
-        # =================== PREPARE DATA ===================
-        # Prepare data (only if needed)
-        if self:
-            data = self._prepare_data(sf, data.copy(), time)
-
         # =================== COMPUTE ===================
-        # Compute the spectrogram :
-        freq, t, mesh = scpsig.spectrogram(data, fs=sf, nperseg=nperseg,
-                                           noverlap=overlap, window='hamming')
-        mesh = 20 * np.log10(mesh)
+        # Get the power matrix (cached if possible) :
+        args = (sf, nperseg, overlap, method, fstart, fend, nfreqs)
+        key = self._spec_key(chan, *args)
+        if key is None:
+            spec = self._compute_spec(data, time, *args)
+        else:
+            spec = self._get_spec(key, data, time, args)
+        freq, t, mesh, (vmin, vmax) = spec
 
         # =================== FREQUENCY SELECTION ===================
         # Find where freq is [fstart, fend] :
@@ -348,11 +873,14 @@ class Spectrogram(PrepareData):
         self._fstart, self._fend = freq[0], freq[-1]
 
         # =================== COLOR ===================
-        # Get clim :
-        clim = (contraste * mesh.min(), contraste * mesh.max())
-        # Turn mesh into color array for selected frequencies:
-        self.mesh.set_data(array2colormap(mesh[sls, :], cmap=cmap,
-                                          clim=clim))
+        # Only send the float32 matrix if it has changed :
+        displayed = (key, f[0], f[1])
+        if (key is None) or (displayed != self._sdisplayed):
+            self.mesh.set_data(np.ascontiguousarray(mesh[sls, :]))
+            self._sdisplayed = displayed
+        # The colormap is applied on the GPU :
+        self.mesh.cmap = _vispy_cmap(cmap)
+        self.mesh.clim = (contraste * vmin, contraste * vmax)
 
         # =================== TRANSFORM ===================
         # Re-scale the mesh for fitting in time / frequency :
@@ -367,6 +895,142 @@ class Spectrogram(PrepareData):
                      freq.max()-freq.min())
         self.freq = freq
 
+    def warmup(self, sf, data, time, chans, nfft=30., overlap=.5, fstart=.5,
+               fend=25., method='fourier', nfreqs=100):
+        """Compute power matrices of several channels in background.
+
+        Channels are computed by groups (one batched spectrogram per group)
+        while they fit in the cache. See set_data for the description of the
+        arguments.
+
+        Args:
+            data: np.ndarray
+                Array of data of shape (n_channels, n_points).
+
+            chans: list
+                Index of the channels to compute.
+        """
+        args = (sf, int(round(nfft * sf)), int(round(overlap * sf)), method,
+                fstart, fend, nfreqs)
+        with self._slock:
+            if self._sexecutor is None:
+                self._sexecutor = ThreadPoolExecutor(max_workers=1)
+            keys = [(self._spec_key(k, *args), k) for k in chans]
+            keys = [(key, k) for key, k in keys if (
+                key not in self._scache) and (key not in self._spending)]
+            # Channels per group :
+            size = max(1, 2 ** 24 // max(1, data.shape[-1]))
+            for i in range(0, len(keys), size):
+                group = keys[i:i + size]
+                future = self._sexecutor.submit(self._warm_spec, group, data,
+                                                time, args)
+                for key, _ in group:
+                    self._spending[key] = future
+
+    def _spec_key(self, chan, sf, nperseg, overlap, method, fstart, fend,
+                  nfreqs):
+        """Get the cache key of a power matrix (None if not cached)."""
+        if chan is None:
+            return None
+        # Data preparation changes the power :
+        prep = (self.demean, self.detrend, self._filt_settings()) if self \
+            else None
+        # The Fourier power is computed for all frequencies :
+        band = (fstart, fend, nfreqs) if method == 'wavelet' else None
+        return (int(chan), sf, nperseg, overlap, method, band, prep)
+
+    def _compute_spec(self, data, time, sf, nperseg, overlap, method, fstart,
+                      fend, nfreqs):
+        """Compute the power matrix (in dB) of a channel.
+
+        Returns:
+            spec: tuple
+                The tuple (freq, t, mesh, (vmin, vmax)) where mesh is a
+                float32 array of shape (n_freqs, n_times).
+        """
+        return self._compute_specs(np.asarray(data)[np.newaxis, ...], time,
+                                   sf, nperseg, overlap, method, fstart, fend,
+                                   nfreqs)[0]
+
+    def _compute_specs(self, data, time, sf, nperseg, overlap, method,
+                       fstart, fend, nfreqs):
+        """Compute the power matrices (in dB) of several channels.
+
+        Args:
+            data: np.ndarray
+                Array of data of shape (n_channels, n_points).
+
+        Returns:
+            specs: list
+                List of tuples (freq, t, mesh, (vmin, vmax)) (one per
+                channel).
+        """
+        # Prepare data (only if needed)
+        data = np.asarray(data)
+        if self:
+            data = np.array([self._prepare_data(sf, k.copy(), time)
+                             for k in data])
+        # Compute the spectrogram of all channels :
+        if method == 'wavelet':
+            freq = np.linspace(max(fstart, .5), fend, nfreqs)
+            decim = max(1, nperseg - overlap)
+            mesh = np.abs(tf_morlet(data, sf, freq, decim=decim,
+                                    dtype=np.complex64)) ** 2
+            t = np.arange(mesh.shape[-1]) * decim / sf
+        else:
+            method = 'hamming' if method == 'fourier' else method
+            freq, t, mesh = spectrogram(data, sf, nperseg, overlap,
+                                        method=method, n_jobs=self._sjobs)
+        with np.errstate(divide='ignore'):
+            mesh = (20 * np.log10(mesh)).astype(np.float32, copy=False)
+        # Copy channels so that they can be evicted separately :
+        mesh = [k.copy() for k in mesh] if len(mesh) > 1 else list(mesh)
+        return [(freq, t, k, (float(k.min()), float(k.max()))) for k in mesh]
+
+    def _get_spec(self, key, data, time, args):
+        """Get a power matrix from the cache (or compute it)."""
+        with self._slock:
+            if key in self._scache:
+                self._scache.move_to_end(key)
+                return self._scache[key]
+            pending = self._spending.get(key)
+        # Wait for a background computation :
+        if pending is not None:
+            pending.result()
+            with self._slock:
+                if key in self._scache:
+                    return self._scache[key]
+        spec = self._compute_spec(data, time, *args)
+        self._store_spec(key, spec)
+        return spec
+
+    def _warm_spec(self, group, data, time, args):
+        """Compute power matrices of a group of channels in background."""
+        try:
+            with self._slock:
+                full = self._scache_bytes >= self._scache_size
+            if not full:
+                chans = [k for _, k in group]
+                specs = self._compute_specs(data[chans, ...], time, *args)
+                for (key, _), spec in zip(group, specs):
+                    self._store_spec(key, spec)
+        finally:
+            with self._slock:
+                for key, _ in group:
+                    self._spending.pop(key, None)
+
+    def _store_spec(self, key, spec):
+        """Store a power matrix and evict the least recently used ones."""
+        with self._slock:
+            if key in self._scache:
+                return
+            self._scache[key] = spec
+            self._scache_bytes += spec[2].nbytes
+            while self._scache_bytes > self._scache_size and len(
+                    self._scache) > 1:
+                self._scache_bytes -= self._scache.popitem(
+                    last=False)[1][2].nbytes
+
     # ----------- RECT -----------
     @property
     def rect(self):
@@ -381,7 +1045,12 @@ class Spectrogram(PrepareData):
 
 
 class Hypnogram(object):
-    """Create a hypnogram object."""
+    """Create a hypnogram object.
+
+    The hypnogram is drawn as a step line with two vertices per run of
+    consecutive samples with the same stage. Edits are applied to the
+    runs around the edited samples only (see update_data).
+    """
 
     def __init__(self, time, camera, color='darkblue', width=2., parent=None):
         # Keep camera :
@@ -422,16 +1091,63 @@ class Hypnogram(object):
             sf: float
                 The sampling frequency.
 
-            data: np.ndarray
+            data: np.ndarray / EpochHypno
                 The data to send. Must be a row vector.
 
             time: np.ndarray
                 The time vector
         """
+        if not isinstance(data, EpochHypno):
+            data = EpochHypno.from_samples(data, sf)
+        self._time = time
+        # Runs (first sample, last sample excluded, stage) and vertices :
+        self._runs = data.runs()
+        self._pos = self._vertices(*self._runs)
         # Set data to the mesh :
-        self.mesh.set_data(pos=np.vstack((time, -data)).T, width=self.width)
+        self.mesh.set_data(pos=self._pos, width=self.width)
+        self.mesh.update()
+
+    def update_data(self, data, start, stop):
+        """Update the hypnogram after an edition.
+
+        Only the runs around the edited samples are recomputed and the line
+        is only updated if its vertices have changed.
+
+        Args:
+            data: EpochHypno
+                The edited hypnogram.
+
+            start: int
+                First edited sample.
+
+            stop: int
+                Last edited sample (excluded).
+        """
+        starts, ends, stages = self._runs
+        n = len(data)
+        # Edited runs and their neighbours (which can be merged) :
+        i = max(np.searchsorted(starts, start - 1, side='right') - 1, 0)
+        j = np.searchsorted(starts, min(stop, n - 1), side='right') - 1
+        new = data.runs(starts[i], ends[j])
+        if (len(new[2]) == j - i + 1) and np.array_equal(new[2],
+                                                         stages[i:j + 1]) \
+                and np.array_equal(new[0], starts[i:j + 1]):
+            return
+        # Splice the new runs and vertices :
+        self._runs = tuple(np.r_[k[:i], v, k[j + 1:]].astype(k.dtype) for k,
+                           v in zip(self._runs, new))
+        self._pos = np.concatenate((self._pos[:2 * i], self._vertices(*new),
+                                    self._pos[2 * (j + 1):]))
+        self.mesh.set_data(pos=self._pos, width=self.width)
         self.mesh.update()
 
+    def _vertices(self, starts, ends, stages):
+        """Get the vertices (two per run) of the step line."""
+        time = self._time
+        x = np.c_[time[starts], time[np.minimum(ends, len(time) - 1)]]
+        y = -np.repeat(stages.astype(np.float32), 2)
+        return np.c_[x.ravel(), y].astype(np.float32)
+
     def set_report(self, time, index, symbol='triangle_down', y=1., size=13.,
                    color='red'):
         """Report additional markers to the hypnogram.
@@ -441,7 +1157,9 @@ class Hypnogram(object):
                 The time vector.
 
             index: np.ndarray
-                Marker index (in sample unit).
+                Marker index (in sample unit). For events, use an array of
+                intervals of shape (n_events, 2) to mark the first and last
+                sample of each event.
 
             symbol: string
                 The marker symbol to use (see vispy.scene.visuals.Markers.
@@ -457,6 +1175,10 @@ class Hypnogram(object):
             color: tuple/string/np.ndarray
                 The color to use.
         """
+        # Mark starting / ending samples of intervals :
+        index = np.asarray(index, dtype=int)
+        if index.ndim == 2:
+            index = np.c_[index[:, 0], index[:, 1] - 1].ravel()
         # Get reduced version of time :
         timeSl = time[index]
         # Build y-position :
@@ -6,3 +6,4 @@ from .others import *
 from .cameras import *
 from .sleep import *
 from .filtering import *
+from .spectral import *
@@ -1,9 +1,18 @@
 """Set of tools to filter data."""
+from fractions import Fraction
+from functools import lru_cache
 
 import numpy as np
-from scipy.signal import butter, filtfilt, lfilter, bessel
+from scipy.signal import (butter, sosfiltfilt, sosfilt, sosfilt_zi, bessel,
+                          firwin, resample_poly, fftconvolve)
+from scipy.fftpack import next_fast_len
+try:
+    from scipy.signal import oaconvolve
+except ImportError:
+    # Overlap-add convolution requires scipy >= 1.4 :
+    oaconvolve = fftconvolve
 
-__all__ = ['filt', 'morlet', 'ndmorlet']
+__all__ = ['filt', 'decimate', 'convolve', 'morlet', 'ndmorlet', 'tf_morlet']
 
 #############################################################################
 # FILTERING
@@ -47,6 +56,87 @@ def filt(sf, f, x, btype='bandpass', order=3, method='butterworth',
         xfilt: np.ndarray
             Filtered data.
     """
+    # Get second-order sections (cached) :
+    sos = _filter_design(float(sf), tuple(np.atleast_1d(f).astype(float)),
+                         btype, int(order), method)
+
+    # Apply filter :
+    if way == 'filtfilt':
+        return sosfiltfilt(sos, x, axis=axis)
+    elif way == 'lfilter':
+        return sosfilt(sos, x, axis=axis)
+
+
+def _filt_blocks(sf, f, read, n, out, btype='bandpass', order=3,
+                 method='butterworth', way='filtfilt', chunk=2 ** 20):
+    """Filt a long signal block by block.
+
+    The state of the filter is kept between blocks so that the output is
+    the same as filt on the entire signal (including the odd extension of
+    filtfilt), but only blocks of chunk points are converted to float64.
+    See filt for the description of the filter arguments.
+
+    Args:
+        read: function
+            Function read(start, stop) returning the points [start, stop[
+            of the signal as a vector.
+
+        n: int
+            Number of points of the signal.
+
+        out: np.ndarray
+            Output vector of length n (e.g. a float32 array or memmap).
+
+    Returns:
+        out: np.ndarray
+            The filtered signal.
+    """
+    sos = _filter_design(float(sf), tuple(np.atleast_1d(f).astype(float)),
+                         btype, int(order), method)
+    blocks = [(k, min(n, k + chunk)) for k in range(0, n, chunk)]
+
+    if way == 'lfilter':
+        zi = np.zeros((sos.shape[0], 2))
+        for start, stop in blocks:
+            out[start:stop], zi = sosfilt(sos, read(start, stop), zi=zi)
+        return out
+
+    # Same padding as sosfiltfilt :
+    ntaps = 2 * sos.shape[0] + 1 - min((sos[:, 2] == 0).sum(),
+                                       (sos[:, 5] == 0).sum())
+    edge = 3 * ntaps
+    if n <= edge:
+        out[:] = sosfiltfilt(sos, read(0, n))
+        return out
+    zi = sosfilt_zi(sos)
+    x0, xn = read(0, 1)[0], read(n - 1, n)[0]
+    left = 2 * x0 - read(1, edge + 1)[::-1]
+    right = 2 * xn - read(n - edge - 1, n - 1)[::-1]
+    # Forward pass (the right extension is kept for the backward pass) :
+    z = sosfilt(sos, left, zi=zi * left[0])[1]
+    for start, stop in blocks:
+        out[start:stop], z = sosfilt(sos, read(start, stop), zi=z)
+    right = sosfilt(sos, right, zi=z)[0]
+    # Backward pass :
+    z = sosfilt(sos, right[::-1], zi=zi * right[-1])[1]
+    for start, stop in blocks[::-1]:
+        y, z = sosfilt(sos, out[start:stop][::-1], zi=z)
+        out[start:stop] = y[::-1]
+    return out
+
+
+@lru_cache(maxsize=128)
+def _filter_design(sf, f, btype, order, method):
+    """Get the second-order sections of a filter.
+
+    Designs are cached (the same filter is used each time the displayed
+    window changes). See filt for the description of the arguments (f must
+    be a tuple).
+
+    Returns:
+        sos: np.ndarray
+            Array of second-order sections of shape (n_sections, 6).
+    """
     # Normalize frequency vector according to btype :
     if btype in ['bandpass', 'bandstop']:
         fnorm = np.divide(f, .5 * sf)
@@ -57,15 +147,253 @@ def filt(sf, f, x, btype='bandpass', order=3, method='butterworth',
 
     # Get filter coefficients :
     if method == 'butterworth':
-        b, a = butter(order, fnorm, btype=btype)
+        sos = butter(order, fnorm, btype=btype, output='sos')
     elif method == 'bessel':
-        b, a = bessel(order, fnorm, btype=btype)
+        sos = bessel(order, fnorm, btype=btype, output='sos')
+    return sos
+
+#############################################################################
+# DECIMATION
+#############################################################################
+
+
+def _resample_ratio(sf, ds_freq):
+    """Get the (up, down) integers such as ds_freq / sf = up / down."""
+    ratio = Fraction(float(ds_freq) / float(sf)).limit_denominator(1000)
+    return ratio.numerator, ratio.denominator
+
+
+def _resample_filter(up, down, window=('kaiser', 5.0)):
+    """Get the anti-aliasing FIR filter used for a polyphase resampling.
+
+    Args:
+        up: int
+            Upsampling factor.
+
+        down: int
+            Downsampling factor.
+
+    Kargs:
+        window: string/tuple/np.ndarray, optional, (def: ('kaiser', 5.0))
+            Window used to design the low-pass filter (see scipy.signal.firwin)
+            or directly the FIR coefficients (at the upsampled rate).
+
+    Returns:
+        h: np.ndarray
+            The FIR coefficients.
+    """
+    if isinstance(window, (list, np.ndarray)):
+        return np.asarray(window, dtype=float)
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    return firwin(2 * half_len + 1, 1. / max_rate, window=window)
+
+
+def _resample_range(read, n, up, down, h, start, stop):
+    """Compute a range of points of a polyphase resampling.
+
+    Only the input points needed by the output points [start, stop) (plus
+    the filter margins) are read. Results are identical to those obtained by
+    resampling the entire signal.
+
+    Args:
+        read: function
+            Function read(a, b) returning input points [a, b) along the last
+            axis.
+
+        n: int
+            Number of input points.
+
+        up, down: int
+            Upsampling and downsampling factors.
+
+        h: np.ndarray
+            FIR coefficients (see _resample_filter).
+
+        start, stop: int
+            Range of output points to compute.
+
+    Returns:
+        y: np.ndarray
+            Resampled data, float64 array with stop - start points along the
+            last axis.
+    """
+    half_len = (len(h) - 1) // 2
+    # Margin (in input points), multiple of down to stay on the output grid :
+    pad = down * int(np.ceil((np.ceil(half_len / up) + 1) / down))
+    # First output point aligned on an input point :
+    first = (start // up) * up
+    s, e = first // up * down, int(np.ceil(stop * down / up))
+    a, b = max(0, s - pad), min(n, e + pad)
+    seg = np.asarray(read(a, b), dtype=np.float64)
+    # Zero padding before the beginning of the signal :
+    if a > s - pad:
+        zeros = np.zeros(seg.shape[:-1] + (a - s + pad,))
+        seg = np.concatenate((zeros, seg), axis=-1)
+    y = resample_poly(seg, up, down, axis=-1, window=h)
+    off = pad * up // down + start - first
+    return y[..., off:off + stop - start]
+
+
+def decimate(x, sf, ds_freq, window=('kaiser', 5.0), chunk=2 ** 22,
+             out=None):
+    """Anti-aliased downsampling of data along the last axis.
+
+    Data are resampled using a polyphase FIR filter, with the exact (rational)
+    ratio between ds_freq and sf. Data are processed block by block so that
+    the memory used only depends on the chunk size and not on the length of
+    the recording.
+
+    Args:
+        x: np.ndarray / np.memmap / LazyData
+            The data to downsample. The time must be the last axis and x must
+            support the x[..., a:b] slicing.
+
+        sf: float
+            The sampling frequency of x.
+
+        ds_freq: float
+            The downsampling frequency.
+
+    Kargs:
+        window: string/tuple/np.ndarray, optional, (def: ('kaiser', 5.0))
+            Window used to design the anti-aliasing filter (see
+            scipy.signal.firwin) or directly the FIR coefficients.
+
+        chunk: int, optional, (def: 2 ** 22)
+            Approximative number of values (all axis) processed at once.
+
+        out: np.ndarray, optional, (def: None)
+            Preallocated output array (e.g. a memmap).
+
+    Returns:
+        xds: np.ndarray
+            The float32 downsampled data.
+    """
+    up, down = _resample_ratio(sf, ds_freq)
+    n = x.shape[-1]
+    n_out = -(-n * up // down)
+    if out is None:
+        out = np.empty(tuple(x.shape[:-1]) + (n_out,), dtype=np.float32)
+
+    # Number of output points computed per block (multiple of up) :
+    rows = max(1, int(np.prod(x.shape[:-1])))
+    blen = max(1, (max(1, chunk // rows) * up // down) // up) * up
+
+    def read(a, b):
+        return x[..., a:b]
+
+    if up == down:
+        for k in range(0, n_out, blen):
+            out[..., k:k + blen] = read(k, min(n_out, k + blen))
+    else:
+        h = _resample_filter(up, down, window)
+        for k in range(0, n_out, blen):
+            stop = min(n_out, k + blen)
+            out[..., k:stop] = _resample_range(read, n, up, down, h, k, stop)
+
+    return out
+
+#############################################################################
+# CONVOLUTION
+#############################################################################
+
+
+def convolve(x, h, axis=-1, method='auto'):
+    """Convolve a signal with one or several kernels.
+
+    The output is centered and has the length of the signal (same as
+    np.convolve(x, h, 'same')). The convolution is computed using one of
+    the following methods :
+        - 'cumsum' : running sum, only for a boxcar kernel (constant values)
+        - 'direct' : sum of the shifted signal, for short kernels
+        - 'fft' : FFT of the entire signal
+        - 'oa' : overlap-add, for kernels much shorter than the signal
+
+    Args:
+        x: np.ndarray
+            The signal(s).
+
+        h: np.ndarray
+            The kernel, of shape (M,), or several kernels of same length,
+            of shape (n_kernels, M) (see _pad_kernels).
+
+    Kargs:
+        axis: int, optional, (def: -1)
+            Time axis of x.
+
+        method: string, optional, (def: 'auto')
+            Convolution method. If 'auto', the method is selected according
+            to the kernel and signal lengths.
+
+    Returns:
+        y: np.ndarray
+            The convolved signal, same shape as x. For several kernels, the
+            shape is (n_kernels,) + x.shape.
+    """
+    x = np.moveaxis(np.asarray(x), axis, -1)
+    h = np.asarray(h)
+    n, m = x.shape[-1], h.shape[-1]
+    # Select the method :
+    if method == 'auto':
+        if (h.ndim == 1) and (m > 16) and np.all(h == h[0]):
+            method = 'cumsum'
+        elif m <= 32:
+            method = 'direct'
+        elif n > 8 * m:
+            method = 'oa'
+        else:
+            method = 'fft'
+    # Kernels along a new leading axis :
+    hb = h.reshape(h.shape[:-1] + (1,) * (x.ndim - 1) + (m,))
+    o = (m - 1) // 2
+
+    if method == 'cumsum':
+        if h.ndim > 1:
+            raise ValueError("The cumsum method requires a single kernel")
+        # Running sum over m samples of the zero-padded signal :
+        cs = np.zeros(x.shape[:-1] + (n + m,), dtype=np.result_type(x, h))
+        np.cumsum(x, axis=-1, out=cs[..., m - o:n + m - o])
+        cs[..., n + m - o:] = cs[..., n + m - o - 1:n + m - o]
+        y = h[0] * (cs[..., m:] - cs[..., :n])
+    elif (method == 'direct') and (x.ndim == h.ndim == 1):
+        y = np.convolve(x, h)[o:o + n]
+    elif method == 'direct':
+        y = np.zeros(h.shape[:-1] + x.shape[:-1] + (n,),
+                     dtype=np.result_type(x, h))
+        # y[i] = sum_j h[j] * x[i + o - j] :
+        for j in range(m):
+            s = o - j
+            a, b = max(0, -s), min(n, n - s)
+            if a < b:
+                y[..., a:b] += hb[..., j:j + 1] * x[..., a + s:b + s]
+    elif method in ['fft', 'oa']:
+        conv = fftconvolve if method == 'fft' else oaconvolve
+        xb = x.reshape((1,) * (h.ndim - 1) + x.shape)
+        y = conv(xb, hb, axes=-1)[..., o:o + n]
+    else:
+        raise ValueError("method must be 'auto', 'cumsum', 'direct', 'fft' "
+                         "or 'oa'")
+
+    # Time axis is shifted by the kernels axis :
+    if axis >= 0:
+        axis += h.ndim - 1
+    return np.moveaxis(y, -1, axis)
+
+
+def _pad_kernels(kernels):
+    """Stack kernels of different lengths into a (n_kernels, M) array.
+
+    Each kernel is zero-padded and centered so that the 'same' convolution
+    with the padded kernel is equal to the convolution with the original.
+    """
+    m = max([len(k) for k in kernels])
+    out = np.zeros((len(kernels), m), dtype=np.result_type(*kernels))
+    for i, k in enumerate(kernels):
+        a = (m - 1) // 2 - (len(k) - 1) // 2
+        out[i, a:a + len(k)] = k
+    return out
 
-    # Apply filter :
-    if way == 'filtfilt':
-        return filtfilt(b, a, x, axis=axis)
-    elif way == 'lfilter':
-        return lfilter(b, a, x, axis=axis)
 
 #############################################################################
 # MORLET
@@ -129,10 +457,7 @@ def morlet(x, sf, f, width=7.0):
     m = _morlet_wlt(sf, f, width)
 
     # Compute morlet :
-    y = np.convolve(x, m)
-    xout = y[int(np.ceil(len(m) / 2)) - 1:int(len(y) - np.floor(len(m) / 2))]
-
-    return xout
+    return convolve(x, m)
 
 
 def ndmorlet(x, sf, f, axis=0, get=None, width=7.0):
@@ -145,8 +470,9 @@ def ndmorlet(x, sf, f, axis=0, get=None, width=7.0):
     sf: float
         Sampling frequency
 
-    f: array, shape (2,)
-        Frequency vector
+    f: float or array
+        Central frequency of the wavelet. Use an array of n_freqs frequencies
+        to decompose x at all frequencies in a single call.
 
     axis: integer, optional, (def: 0)
         Specify the axis where is located the time dimension
@@ -156,16 +482,95 @@ def ndmorlet(x, sf, f, axis=0, get=None, width=7.0):
 
     Returns:
         xout: array, same shape as x
-            Complex decomposition of x.
+            Complex decomposition of x. For several frequencies, the shape
+            is (n_freqs,) + x.shape.
     """
-    # Get the wavelet :
-    m = _morlet_wlt(sf, f, width)
+    if np.ndim(f):
+        # Centered wavelets of all frequencies :
+        m = _pad_kernels([_morlet_wlt(sf, k, width) for k in f])
+    else:
+        m = _morlet_wlt(sf, f, width)
+
+    return convolve(x, m, axis=axis)
+
+
+def tf_morlet(x, sf, freqs, width=7.0, decim=1, chunk=None,
+              dtype=np.complex128, axis=-1):
+    """Time-frequency decomposition using Morlet's wavelets.
+
+    The FFT of the signal is computed once and multiplied by the spectra of
+    the wavelets of all frequencies. Long signals can be processed by blocks
+    of time (overlap-save) to bound memory.
+
+    Args:
+        x: np.ndarray
+            The signal(s) to decompose.
 
-    # Define a morlet function :
-    def morletFcn(xt):
-        # Compute morlet :
-        y = np.convolve(xt, m)
-        return y[int(np.ceil(len(m) / 2)) - 1:int(len(y) - np.floor(
-                                                                len(m) / 2))]
+        sf: float
+            Sampling frequency
+
+        freqs: array
+            Central frequencies of the wavelets.
+
+    Kargs:
+        width: float, optional, (def: 7.0)
+            Width of the wavelets
 
-    return np.apply_along_axis(morletFcn, axis, x)
+        decim: int, optional, (def: 1)
+            Decimation factor of the output (only one time point over decim
+            is computed). Useful for display.
+
+        chunk: int, optional, (def: None)
+            Number of output time points computed at once. If None, blocks
+            of max(2**13, 8 * wavelet length) points are used (short FFTs
+            are faster than a single FFT of the entire signal).
+
+        dtype: np.dtype, optional, (def: np.complex128)
+            Type of the output. Use np.complex64 to divide memory by two.
+
+        axis: int, optional, (def: -1)
+            Time axis of x.
+
+    Returns:
+        tf: np.ndarray
+            Complex decomposition of shape (n_freqs,) + x.shape, with
+            ceil(n_points / decim) time points.
+    """
+    x = np.moveaxis(np.asarray(x), axis, -1)
+    n, decim = x.shape[-1], max(1, int(decim))
+    freqs = np.atleast_1d(freqs)
+    h = _pad_kernels([_morlet_wlt(sf, k, width) for k in freqs])
+    m = h.shape[-1]
+    o = (m - 1) // 2
+    n_out = -(-n // decim)
+    # Output points per block (multiple of decim) :
+    chunk = max(2 ** 13, 8 * m) if chunk is None else max(1, int(chunk))
+    blen = -(-min(chunk, n) // decim) * decim
+    # Shift outputs of a block to multiples of decim :
+    p = -(m - 1) % decim
+    nfft = decim * next_fast_len(-(-(p + blen + m - 1) // decim))
+    # Spectra of the wavelets :
+    hf = np.fft.fft(h, nfft).reshape((len(freqs),) + (1,) * (x.ndim - 1) +
+                                     (nfft,))
+    tf = np.empty((len(freqs),) + x.shape[:-1] + (n_out,), dtype=dtype)
+    seg = np.zeros(x.shape[:-1] + (nfft,), dtype=x.dtype)
+
+    for s in range(0, n, blen):
+        stop = min(n, s + blen)
+        # Signal needed for outputs [s, stop), zero-padded outside of x :
+        a, b = s + o - m + 1, stop + o
+        seg[:] = 0
+        seg[..., p + max(0, -a):p + b - a - max(0, b - n)] = x[
+            ..., max(0, a):min(n, b)]
+        prod = np.fft.fft(seg) * hf
+        # Keep one point over decim (aliasing of the spectrum) :
+        if decim > 1:
+            prod = prod.reshape(prod.shape[:-1] + (decim, -1)).mean(-2)
+        y = np.fft.ifft(prod)
+        k0 = (m - 1 + p) // decim
+        nk = -(-(stop - s) // decim)
+        tf[..., s // decim:s // decim + nk] = y[..., k0:k0 + nk]
+
+    if axis >= 0:
+        axis += 1
+    return np.moveaxis(tf, -1, axis)
@@ -1,3 +1,6 @@
 from .detection import *
 from .fileconvert import *
 from .hypnoprocessing import *
+from .lazydata import *
+from .streaming import *
+from .detectioncache import *
@@ -4,12 +4,94 @@ Perform:
 - REM detection
 - Spindles detection
 - Peak detection
+
+Detected events (spindles, REM) are returned as an array of intervals of
+shape (n_events, 2) containing the first and last (excluded) sample of each
+event, sorted by starting sample.
 """
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 from scipy.signal import hilbert
-from ..filtering import filt, morlet
+from scipy.fftpack import next_fast_len
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
+from ..filtering import filt, convolve, ndmorlet
+from .hypnoprocessing import EpochHypno
 
-__all__ = ['peakdetect', 'remdetect', 'spindlesdetect']
+__all__ = ['peakdetect', 'ndpeakdetect', 'remdetect', 'spindlesdetect',
+           'spindlesfeatures', 'spindlesdecide', 'spindlessweep',
+           'index2intervals',
+           'intervals_overlap']
+
+
+###########################################################################
+# EVENTS AS INTERVALS
+###########################################################################
+
+def index2intervals(index):
+    """Convert sorted sample indices into intervals of consecutive samples.
+
+    Args:
+        index: np.ndarray
+            Sorted array of sample indices.
+
+    Returns:
+        intervals: np.ndarray
+            Array of shape (n_events, 2) with the first and last (excluded)
+            sample of each run of consecutive indices.
+    """
+    index = np.asarray(index, dtype=int)
+    if not index.size:
+        return np.zeros((0, 2), dtype=int)
+    # Find where runs break :
+    breaks = np.flatnonzero(np.diff(index) != 1)
+    start = index[np.r_[0, breaks + 1]]
+    stop = index[np.r_[breaks, index.size - 1]] + 1
+    return np.c_[start, stop]
+
+
+def intervals_overlap(intervals, start, stop):
+    """Get intervals overlapping [start, stop[.
+
+    Intervals must be sorted and non-overlapping so that the search only
+    costs two binary searches.
+
+    Args:
+        intervals: np.ndarray
+            Array of shape (n_events, 2).
+
+        start: int
+            First sample of the window.
+
+        stop: int
+            Last sample (excluded) of the window.
+
+    Returns:
+        intervals: np.ndarray
+            Overlapping intervals, clipped to [start, stop[.
+    """
+    intervals = np.asarray(intervals, dtype=int).reshape(-1, 2)
+    i_start = np.searchsorted(intervals[:, 1], start, side='right')
+    i_stop = np.searchsorted(intervals[:, 0], stop, side='left')
+    return np.clip(intervals[i_start:i_stop], start, stop)
+
+
+###########################################################################
+# HYPNOGRAM
+###########################################################################
+
+def _hypno_stages(hypno):
+    """Get the scored stages of an hypnogram (vector or EpochHypno)."""
+    if isinstance(hypno, EpochHypno):
+        return hypno.stages()
+    return np.unique(hypno)
+
+
+def _hypno_mask(hypno, stages):
+    """Get the samples of an hypnogram (vector or EpochHypno) in stages."""
+    if isinstance(hypno, EpochHypno):
+        return hypno.mask(stages)
+    return np.isin(hypno, stages)
 
 
 ###########################################################################
@@ -18,12 +100,14 @@ __all__ = ['peakdetect', 'remdetect', 'spindlesdetect']
 
 def spindlesdetect(data, sf, threshold, hypno, nrem_only, min_freq=12.,
                    max_freq=14., min_dur_ms=500, max_dur_ms=1500,
-                   method='hilbert'):
+                   method='hilbert', n_jobs=1):
     """Perform a sleep spindles detection.
 
     Args:
         data: np.ndarray
-            eeg signal (preferably central electrodes)
+            eeg signal (preferably central electrodes). Use an array of shape
+            (n_channels, n_points) to detect spindles on several channels in
+            a single vectorized pass.
 
         sf: float
             Downsampling frequency
@@ -50,9 +134,13 @@ def spindlesdetect(data, sf, threshold, hypno, nrem_only, min_freq=12.,
             Method to extract complex decomposition. Use either 'hilbert' or
             'wavelet'.
 
+        n_jobs: int, optional (def 1)
+            Number of processes used to split channels of a 2D data array.
+
     Return:
         idx_spindles: np.ndarray
-            Array of supra-threshold indices
+            Array of shape (n_spindles, 2) with the first and last (excluded)
+            sample of each spindle.
 
         number: int
             Number of detected spindles
@@ -60,76 +148,273 @@ def spindlesdetect(data, sf, threshold, hypno, nrem_only, min_freq=12.,
         density: float
             Number of spindles per minute
 
+        For 2D data, idx_spindles is a list with one array per channel and
+        number / density are arrays of shape (n_channels,).
     """
-    # Find if hypnogram is loaded :
-    hypLoaded = True if np.unique(hypno).size > 1 and nrem_only else False
-
-    if hypLoaded:
-        data.copy()[(np.where(np.logical_or(hypno < 1, hypno == 4)))] = 0.
-        length = np.count_nonzero(data)
-        idx_zero = np.where(data == 0)[0]
+    data = np.asarray(data)
+    is_vector = data.ndim == 1
+    data = np.atleast_2d(data)
+    args = (sf, threshold, hypno, nrem_only, min_freq, max_freq, min_dur_ms,
+            max_dur_ms, method)
+
+    if (n_jobs > 1) and (data.shape[0] > 1):
+        # Split channels across processes :
+        groups = np.array_split(np.arange(data.shape[0]),
+                                min(n_jobs, data.shape[0]))
+        with ProcessPoolExecutor(max_workers=len(groups)) as executor:
+            res = list(executor.map(_spindles_batch, [data[k] for k in groups],
+                                    *[[k] * len(groups) for k in args]))
+        idx_spindles = [i for r in res for i in r[0]]
+        number = np.concatenate([r[1] for r in res])
+        density = np.concatenate([r[2] for r in res])
     else:
-        length = max(data.shape)
+        idx_spindles, number, density = _spindles_batch(data, *args)
+
+    if is_vector:
+        return idx_spindles[0], number[0], density[0]
+    return idx_spindles, number, density
+
+
+def _spindles_batch(data, sf, threshold, hypno, nrem_only, min_freq,
+                    max_freq, min_dur_ms, max_dur_ms, method, chunk=2 ** 24):
+    """Detect spindles on each channel of a (n_channels, n_points) array.
+
+    Features of channels are computed together, by blocks of about chunk
+    values. See spindlesdetect for the description of the arguments.
+    """
+    nchan, npts = data.shape
+    step = max(1, chunk // next_fast_len(npts))
+    idx_spindles, number, density = [], [], []
+
+    for c in range(0, nchan, step):
+        features = spindlesfeatures(data[c:c + step, :], sf, hypno, nrem_only,
+                                    min_freq, max_freq, method)
+        out = _spindles_decide(*(features + (sf, threshold, min_dur_ms,
+                                             max_dur_ms)))
+        idx_spindles += out[0]
+        number.append(out[1])
+        density.append(out[2])
+
+    return idx_spindles, np.concatenate(number), np.concatenate(density)
+
+
+def _spindles_decide(amplitude, mean, std, length, sf, threshold, min_dur_ms,
+                     max_dur_ms):
+    """Get spindles of each channel from a (n_channels, n_points) amplitude.
+    """
+    idx_spindles = []
+    number = np.zeros((amplitude.shape[0],), dtype=int)
+    for k in range(amplitude.shape[0]):
+        idx_sup_thr = _spindles_threshold(amplitude[k, :],
+                                          mean[k] + threshold * std[k])
+        idx_spindles.append(_spindles_decision(idx_sup_thr, sf, min_dur_ms,
+                                               max_dur_ms))
+        number[k] = len(idx_spindles[-1])
+    density = number / (length / sf / 60.)
+    return idx_spindles, number, density
+
+
+def spindlesfeatures(data, sf, hypno, nrem_only, min_freq=12., max_freq=14.,
+                     method='hilbert'):
+    """Compute the features of the spindles detection.
+
+    This is the expensive part of spindlesdetect (filtering and complex
+    decomposition). The output can be reused to test several thresholds
+    and durations (see spindlesdecide and spindlessweep).
+
+    Args:
+        data: np.ndarray
+            eeg signal of shape (n_points,) or (n_channels, n_points).
+
+        sf: float
+            Downsampling frequency
+
+        hypno: np.ndarray
+            Hypnogram vector, same length as data
+            Vector with only 0 if no hypnogram is loaded
+
+        nrem_only: boolean
+            Only consider NREM sleep period
+
+    Kargs:
+        min_freq: float, optional (def 12)
+            Lower bandpass frequency
+
+        max_freq: float, optional (def 14)
+            Higher bandpass frequency
+
+        method: string
+            Method to extract complex decomposition. Use either 'hilbert' or
+            'wavelet'.
+
+    Return:
+        amplitude: np.ndarray
+            Amplitude (float32) of the filtered signal, same shape as data.
+            Values outside of the considered sleep stages are NaN.
+
+        mean: np.ndarray
+            Mean of the amplitude (float for a vector).
+
+        std: np.ndarray
+            Standard deviation of the amplitude (float for a vector).
+
+        length: int
+            Number of considered points.
+    """
+    data = np.asarray(data)
+    is_vector = data.ndim == 1
+    data = np.atleast_2d(data)
+    npts = data.shape[1]
+
+    # Find if hypnogram is loaded :
+    hypLoaded = True if _hypno_stages(hypno).size > 1 and nrem_only else False
 
     # Get complex decomposition of filtered data :
     if method == 'hilbert':
         # Bandpass filter
-        data_filt = filt(sf, [min_freq, max_freq], data, order=4)
-        # Hilbert transform on odd-length signals is twice longer. To avoid
-        # this extra time, simply set to zero padding.
-        # See https://github.com/scipy/scipy/issues/6324
-        if data.size % 2:
-            analytic = hilbert(data_filt)
-        else:
-            analytic = hilbert(data_filt[:-1], len(data_filt))
+        data_filt = filt(sf, [min_freq, max_freq], data, order=4, axis=1)
+        # Zero padding to a fast FFT length :
+        analytic = hilbert(data_filt, next_fast_len(npts), axis=1)[:, :npts]
     elif method == 'wavelet':
-        analytic = morlet(data, sf, np.mean([min_freq, max_freq]))
+        analytic = ndmorlet(data, sf, np.mean([min_freq, max_freq]), axis=1)
 
-    # Get amplitude and phase :
+    # Get amplitude :
     amplitude = np.abs(analytic)
-    phase = np.unwrap(np.angle(analytic))
-    # Phase derivative (instantaneaous frequencies) :
-    inst_freq = np.diff(phase) / (2.0 * np.pi) * sf
-    inst_freq = np.append(inst_freq, 0.)  # What for?
 
     if hypLoaded:
-        amplitude[idx_zero] = np.nan
+        # Only keep NREM sleep (N1, N2 and N3) :
+        idx_zero = ~_hypno_mask(hypno, [1, 2, 3])
+        amplitude[:, idx_zero] = np.nan
+        length = npts - np.count_nonzero(idx_zero)
+    else:
+        length = npts
+
+    mean = np.nanmean(amplitude, axis=1)
+    std = np.nanstd(amplitude, axis=1)
+    amplitude = amplitude.astype(np.float32)
+
+    if is_vector:
+        return amplitude[0, :], mean[0], std[0], length
+    return amplitude, mean, std, length
+
+
+def spindlesdecide(features, sf, threshold, min_dur_ms=500, max_dur_ms=1500):
+    """Perform the decision stage of the spindles detection.
+
+    spindlesdetect(data, ...) is the same as
+    spindlesdecide(spindlesfeatures(data, ...), ...).
+
+    Args:
+        features: tuple
+            Output of spindlesfeatures.
+
+        sf: float
+            Downsampling frequency
 
-    thresh = np.nanmean(amplitude) + threshold * np.nanstd(amplitude)
+        threshold: float
+            Number of standard deviation to use as threshold
+
+    Kargs:
+        min_dur_ms, max_dur_ms: float, optional (def 500 and 1500)
+            Minimum and maximum spindles duration.
+
+    Return:
+        idx_spindles, number, density: see spindlesdetect.
+    """
+    amplitude, mean, std, length = features
+    idx_spindles, number, density = _spindles_decide(
+        np.atleast_2d(amplitude), np.atleast_1d(mean), np.atleast_1d(std),
+        length, sf, threshold, min_dur_ms, max_dur_ms)
+    if np.ndim(amplitude) == 1:
+        return idx_spindles[0], number[0], density[0]
+    return idx_spindles, number, density
+
+
+def spindlessweep(features, sf, thresholds, durations=((500, 1500),)):
+    """Evaluate several thresholds and durations of the spindles detection.
+
+    Args:
+        features: tuple
+            Output of spindlesfeatures.
+
+        sf: float
+            Downsampling frequency
+
+        thresholds: list
+            List of thresholds (number of standard deviations).
+
+    Kargs:
+        durations: list, optional, (def: ((500, 1500),))
+            List of (min_dur_ms, max_dur_ms) bounds.
 
-    # Amplitude criteria
+    Return:
+        number: np.ndarray
+            Number of spindles, of shape (n_thresholds, n_durations) (with a
+            leading n_channels dimension for 2D features).
+
+        density: np.ndarray
+            Number of spindles per minute, same shape as number.
+    """
+    amplitude, mean, std, length = features
+    is_vector = amplitude.ndim == 1
+    amplitude = np.atleast_2d(amplitude)
+    mean, std = np.atleast_1d(mean), np.atleast_1d(std)
+    number = np.zeros((amplitude.shape[0], len(thresholds), len(durations)),
+                      dtype=int)
+
+    for k in range(amplitude.shape[0]):
+        for i, th in enumerate(thresholds):
+            # Supra-threshold samples are shared by all durations :
+            idx_sup_thr = _spindles_threshold(amplitude[k, :],
+                                              mean[k] + th * std[k])
+            for j, (dmin, dmax) in enumerate(durations):
+                number[k, i, j] = len(_spindles_decision(idx_sup_thr, sf,
+                                                         dmin, dmax))
+
+    density = number / (length / sf / 60.)
+    if is_vector:
+        return number[0], density[0]
+    return number, density
+
+
+def _spindles_threshold(amplitude, thresh):
+    """Get the indices where amplitude is above a threshold."""
     with np.errstate(divide='ignore', invalid='ignore'):
-        idx_sup_thr = np.where(amplitude > thresh)[0]
+        return np.where(amplitude > thresh)[0]
 
-    if idx_sup_thr.size > 0:
 
-        # Get where spindles start / end and duration :
-        _, duration_ms, idx_start, idx_stop = _spindles_duration(idx_sup_thr,
-                                                                 sf)
-        # Get where min_dur < spindles duration < max_dur :
-        good_dur = np.where(np.logical_and(duration_ms > min_dur_ms,
-                                           duration_ms < max_dur_ms))[0]
+def _spindles_decision(idx_sup_thr, sf, min_dur_ms, max_dur_ms):
+    """Get spindles intervals from supra-threshold indices.
 
-        good_idx = _spindles_removal(idx_start, idx_stop, good_dur)
+    Args:
+        idx_sup_thr: np.ndarray
+            Sorted indices where amplitude is above the threshold.
 
-        idx_sup_thr = idx_sup_thr[good_idx]
+        sf: float
+            Downsampling frequency
+
+        min_dur_ms, max_dur_ms: float
+            Minimum and maximum spindles duration.
 
-        # Frequency criteria
-        # To Do: Instantaneous frequency on original signal ?
-        # idx_insta_freq = np.array(
-        # np.where(
-        # (inst_freq[idx_sup_thr] > min_freq) & (
-        # inst_freq[idx_sup_thr] < max_freq))).flatten()
-        # idx_sup_thr = idx_sup_thr[idx_insta_freq]
+    Return:
+        intervals: np.ndarray
+            Array of shape (n_spindles, 2).
+    """
+    if idx_sup_thr.size > 0:
+        # Get where spindles start / end and duration :
+        _, duration_ms, idx_start, idx_stop = _spindles_duration(
+            idx_sup_thr, sf)
+        # Get where min_dur < spindles duration < max_dur :
+        good_dur = np.where(np.logical_and(
+            duration_ms > min_dur_ms, duration_ms < max_dur_ms))[0]
 
-        number, duration_ms, _, _ = _spindles_duration(idx_sup_thr, sf)
-        density = number / (length / sf / 60.)
+        good_idx = _spindles_removal(idx_start, idx_stop, good_dur,
+                                     idx_sup_thr.size)
 
-    else:
-        number = 0
-        density = 0.
+        idx_sup_thr = idx_sup_thr[good_idx]
 
-    return idx_sup_thr, number, density
+    # Spindles as intervals :
+    return index2intervals(idx_sup_thr)
 
 
 def _spindles_duration(index, sf):
@@ -168,7 +453,7 @@ def _spindles_duration(index, sf):
     return number, duration_ms, idx_start, idx_stop
 
 
-def _spindles_removal(idx_start, idx_stop, good_dur):
+def _spindles_removal(idx_start, idx_stop, good_dur, n):
     """Remove events that do not have the good duration.
 
     Args:
@@ -181,22 +466,19 @@ def _spindles_removal(idx_start, idx_stop, good_dur):
         good_dur: np.ndarray
             Indices of spindles having a proper duration.
 
+        n: int
+            Number of supra-threshold indices.
+
     Return:
         good_idx: np.ndarray
-            Row vector containing the extending version of indices.
+            Boolean vector of length n, True inside spindles having a proper
+            duration.
     """
-    # Get where good duration start / end :
-    start = idx_start[good_dur]
-    stop = idx_stop[good_dur]
-
-    # Extend each spindle duration (start -> stop) :
-    extend = np.array([np.arange(i, j) for i, j in zip(start, stop)])
-
-    # Get it as a flatten array :
-    if extend.size:
-        return np.hstack(extend.flat)
-    else:
-        return np.array([], dtype=int)
+    # Mark where good duration start (+1) / end (-1) :
+    mark = np.zeros((n + 1,), dtype=int)
+    np.add.at(mark, idx_start[good_dur], 1)
+    np.add.at(mark, idx_stop[good_dur], -1)
+    return np.cumsum(mark[:-1]) > 0
 
 ###########################################################################
 # REM DETECTION
@@ -238,8 +520,9 @@ def remdetect(eog, sf, hypno, rem_only, threshold, moving_ms=100, deriv_ms=40):
             above 500°/sec, see Bahill et al., 1975)
 
     Return:
-        idx_sup_thr: np.ndarray
-            Array of supra-threshold indices
+        idx_rem: np.ndarray
+            Array of shape (n_rem, 2) with the first and last (excluded)
+            sample of each REM.
 
         number: int
             Number of detected REMs
@@ -250,8 +533,9 @@ def remdetect(eog, sf, hypno, rem_only, threshold, moving_ms=100, deriv_ms=40):
     """
     eog = np.array(eog)
 
-    if rem_only and 4 in hypno:
-        eog[(np.where(hypno < 4))] = 0
+    has_rem = rem_only and 4 in _hypno_stages(hypno)
+    if has_rem:
+        eog[~_hypno_mask(hypno, [4])] = 0
         length = np.count_nonzero(eog)
         idx_zero = np.where(eog == 0)
     else:
@@ -267,7 +551,7 @@ def remdetect(eog, sf, hypno, rem_only, threshold, moving_ms=100, deriv_ms=40):
     deriv = _movingaverage(deriv, moving_ms, sf)
 
     # Define threshold
-    if rem_only and 4 in hypno:
+    if has_rem:
         deriv[idx_zero] = np.nan
 
     thresh = np.nanmean(deriv) + threshold * np.nanstd(deriv)
@@ -281,13 +565,13 @@ def remdetect(eog, sf, hypno, rem_only, threshold, moving_ms=100, deriv_ms=40):
         idx_sup_thr = np.delete(idx_sup_thr, 0)
 
         # Number and density of REM
-        rem = np.diff(idx_sup_thr, n=1)
-        number = np.array(np.where(rem > 1)).size
+        idx_rem = index2intervals(idx_sup_thr)
+        number = len(idx_rem)
         density = number / (length / sf / 60)
 
-        return idx_sup_thr, number, density
+        return idx_rem, number, density
     else:
-        return np.array([], dtype=int), 0., 0.
+        return np.zeros((0, 2), dtype=int), 0., 0.
 
 def _movingaverage(x, window, sf):
     """Perform a moving average.
@@ -305,7 +589,7 @@ def _movingaverage(x, window, sf):
     """
     window = int(window / (1000 / sf))
     weights = np.repeat(1.0, window) / window
-    sma = np.convolve(x, weights, 'same')
+    sma = convolve(x, weights)
     return sma
 
 
@@ -368,8 +652,6 @@ def peakdetect(y_axis, x_axis=None, lookahead=200, delta=0):
         to hinder the function from picking up false peaks towards to end of
         the signal. To work well delta should be set to delta >= RMSnoise * 5.
         (default: 0)
-            When omitted delta function causes a 20% decrease in speed.
-            When used Correctly it can double the speed of the function
 
 
     return: two lists [max_peaks, min_peaks] containing the positive and
@@ -379,14 +661,8 @@ def peakdetect(y_axis, x_axis=None, lookahead=200, delta=0):
         results to unpack one of the lists into x, y coordinates do:
         x, y = zip(*max_peaks)
     """
-    max_peaks = []
-    min_peaks = []
-    dump = []   # Used to pop the first hit which almost always is false
-
     # check input data
     x_axis, y_axis = _datacheck(x_axis, y_axis)
-    # store data length for later use
-    length = len(y_axis)
 
     # perform some checks
     if lookahead < 1:
@@ -394,69 +670,157 @@ def peakdetect(y_axis, x_axis=None, lookahead=200, delta=0):
     if not (np.isscalar(delta) and delta >= 0):
         raise ValueError("delta must be a positive number")
 
-    # maxima and minima candidates are temporarily stored in
-    # mx and mn respectively
-    mn, mx = np.Inf, -np.Inf
+    # Max / min of the next 'lookahead' points :
+    fmax, fmin = _peak_lookahead(y_axis, lookahead)
 
     # Only detect peak if there is 'lookahead' amount of points after it
-    for index, (x, y) in enumerate(zip(x_axis[:-lookahead],
-                                       y_axis[:-lookahead])):
-        if y > mx:
-            mx = y
-            mxpos = x
-        if y < mn:
-            mn = y
-            mnpos = x
-
-        # ==== Look for max ====
-        if y < mx - delta and mx != np.Inf:
-            # Maxima peak candidate found
-            # look ahead in signal to ensure that this is a peak and not jitter
-            if y_axis[index:index + lookahead].max() < mx:
-                max_peaks.append([mxpos, mx])
-                dump.append(True)
-                # set algorithm to only find minima now
-                mx = np.Inf
-                mn = np.Inf
-                if index + lookahead >= length:
-                    # end is within lookahead no more peaks can be found
-                    break
-                continue
-            # else:  #slows shit down this does
-            #    mx = ahead
-            #    mxpos = x_axis[np.where(y_axis[index:index+lookahead]==mx)]
-
-        # ==== Look for max ====
-        if y > mn + delta and mn != -np.Inf:
-            # Minima peak candidate found
-            # look ahead in signal to ensure that this is a peak and not jitter
-            if y_axis[index:index + lookahead].min() > mn:
-                min_peaks.append([mnpos, mn])
-                dump.append(False)
-                # set algorithm to only find maxima now
-                mn = -np.Inf
-                mx = -np.Inf
-                if index + lookahead >= length:
-                    # end is within lookahead no more peaks can be found
-                    break
-            # else:  #slows shit down this does
-            #    mn = ahead
-            #    mnpos = x_axis[np.where(y_axis[index:index+lookahead]==mn)]
+    state = _peak_state()
+    peaks = _peak_scan(y_axis, fmax, fmin, len(y_axis) - lookahead, delta,
+                       state)
 
     # Remove the false hit on the first value of the y_axis
-    try:
-        if dump[0]:
-            max_peaks.pop(0)
-        else:
-            min_peaks.pop(0)
-        del dump
-    except IndexError:
-        # no peaks were found, should the function return empty lists?
-        pass
+    peaks = peaks[1:]
 
+    max_peaks = [[x_axis[k], y_axis[k]] for k, is_max in peaks if is_max]
+    min_peaks = [[x_axis[k], y_axis[k]] for k, is_max in peaks if not is_max]
     return [max_peaks, min_peaks]
 
 
+def ndpeakdetect(y_axis, x_axis=None, lookahead=200, delta=0, axis=-1):
+    """Perform a peak detection on several signals.
+
+    Look-ahead windows of all signals are computed at once. See peakdetect
+    for the description of the arguments.
+
+    Args:
+        y_axis: np.ndarray
+            Array of signals of shape (n_signals, n_points) (time along
+            axis).
+
+    Kargs:
+        axis: int, optional, (def: -1)
+            Time axis.
+
+    Returns:
+        peaks: list
+            List of [max_peaks, min_peaks] for each signal.
+    """
+    y_axis = np.moveaxis(np.atleast_2d(np.asarray(y_axis)), axis, -1)
+    y_axis = y_axis.reshape(-1, y_axis.shape[-1])
+    if x_axis is None:
+        x_axis = np.arange(y_axis.shape[-1])
+    x_axis, _ = _datacheck(x_axis, y_axis[0, :])
+
+    # perform some checks
+    if lookahead < 1:
+        raise ValueError("Lookahead must be '1' or above in value")
+    if not (np.isscalar(delta) and delta >= 0):
+        raise ValueError("delta must be a positive number")
+
+    fmax, fmin = _peak_lookahead(y_axis, lookahead)
+    stop = y_axis.shape[-1] - lookahead
+    out = []
+    for y, M, m in zip(y_axis, fmax, fmin):
+        peaks = _peak_scan(y, M, m, stop, delta, _peak_state())[1:]
+        out.append([[[x_axis[k], y[k]] for k, is_max in peaks if is_max],
+                    [[x_axis[k], y[k]] for k, is_max in peaks if not is_max]])
+    return out
+
+
+def _peak_lookahead(y, lookahead):
+    """Get the max and min of y[..., i:i + lookahead] for each point i."""
+    o = -(lookahead // 2)
+    fmax = maximum_filter1d(y, lookahead, axis=-1, origin=o, mode='nearest')
+    fmin = minimum_filter1d(y, lookahead, axis=-1, origin=o, mode='nearest')
+    return fmax, fmin
+
+
+def _peak_state():
+    """Initial state of the peak scan (look for both max and min)."""
+    return {'i': 0, 'find_max': True, 'find_min': True, 'mx': -np.Inf,
+            'mxpos': None, 'mn': np.Inf, 'mnpos': None}
+
+
+def _peak_scan(y, fmax, fmin, stop, delta, state, block=64):
+    """Scan y[state['i']:stop] for peaks.
+
+    This gives the same peaks as the sample by sample loop of the original
+    peakdetect, but it is not fully vectorized : the scan is still a Python
+    loop with at least one iteration per peak. Between two peaks, only one
+    kind of peak is searched (except before the first one). Along such a
+    phase, the running max (or min) is obtained with an accumulated maximum
+    (or minimum), processed by blocks of increasing size until the first
+    point satisfying the peak condition is found. The cost is therefore
+    dominated by the number of peaks rather than by the number of samples.
+
+    Args:
+        y: np.ndarray
+            The signal.
+
+        fmax, fmin: np.ndarray
+            Max and min of y over the look-ahead window of each point.
+
+        stop: int
+            Index where to stop the scan.
+
+        delta: float
+            Minimum difference between a peak and the following points.
+
+        state: dict
+            State of the scan (see _peak_state). Updated in place so that
+            the scan can be resumed.
+
+    Returns:
+        peaks: list
+            List of (index, is_max) tuples.
+    """
+    peaks = []
+    i, size = state['i'], block
+    find_max, find_min = state['find_max'], state['find_min']
+    mx, mxpos, mn, mnpos = state['mx'], state['mxpos'], state['mn'], state[
+        'mnpos']
+    while i < stop:
+        j = min(stop, i + size)
+        ys = y[i:j]
+        hit = np.zeros((j - i,), dtype=bool)
+        # Running max / min and peak conditions :
+        if find_max:
+            rmax = np.maximum(np.maximum.accumulate(ys), mx)
+            cmax = (ys < rmax - delta) & (fmax[i:j] < rmax)
+            hit |= cmax
+        if find_min:
+            rmin = np.minimum(np.minimum.accumulate(ys), mn)
+            cmin = (ys > rmin + delta) & (fmin[i:j] > rmin)
+            hit |= cmin
+        k = np.argmax(hit) if hit.any() else j - i - 1
+        # Update max / min candidates up to k (first occurrence) :
+        if find_max and ys[:k + 1].max() > mx:
+            mxpos = i + np.argmax(ys[:k + 1])
+            mx = ys[mxpos - i]
+        if find_min and ys[:k + 1].min() < mn:
+            mnpos = i + np.argmin(ys[:k + 1])
+            mn = ys[mnpos - i]
+        if not hit[k]:
+            # No peak in this block :
+            i, size = j, 2 * size
+            continue
+        # Max peak (checked first) :
+        if find_max and cmax[k]:
+            peaks.append((mxpos, True))
+            find_max, find_min = False, True
+            mx, mn = np.Inf, np.Inf
+        # Min peak :
+        else:
+            peaks.append((mnpos, False))
+            find_max, find_min = True, False
+            mx, mn = -np.Inf, -np.Inf
+        i, size = i + k + 1, block
+    state.update({'i': max(i, state['i']), 'find_max': find_max,
+                  'find_min': find_min, 'mx': mx, 'mxpos': mxpos, 'mn': mn,
+                  'mnpos': mnpos})
+    return peaks
+
+
 def _datacheck(x_axis, y_axis):
     """Check inputs for peak detection."""
     if x_axis is None:
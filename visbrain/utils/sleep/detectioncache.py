@@ -0,0 +1,169 @@
+"""Cache of detection results.
+
+Detections (filtering, Hilbert transform, thresholding...) are expensive
+while they are often repeated with the same data and parameters (revisiting
+a channel, toggling an option, comparing thresholds). DetectionCache stores
+their results under a key built from the parts identifying a detection
+(data fingerprint, channel, method, parameters, hypnogram...). The least
+recently used results are evicted and results can be persisted on disk.
+"""
+import os
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+__all__ = ['DetectionCache', 'fingerprint']
+
+
+def fingerprint(x):
+    """Get a fingerprint (hexadecimal md5 digest) of an object.
+
+    Arrays are hashed using their dtype, shape and content. Lists, tuples
+    and dictionaries are hashed recursively. Other objects are hashed using
+    their representation.
+
+    Args:
+        x: object
+            The object to hash.
+
+    Returns:
+        fp: string
+            The fingerprint of x.
+    """
+    h = hashlib.md5()
+    _update(h, x)
+    return h.hexdigest()
+
+
+def _update(h, x):
+    """Recursively feed an md5 object with x."""
+    if isinstance(x, np.ndarray) or hasattr(x, '__array__'):
+        x = np.ascontiguousarray(x)
+        h.update(('array' + str(x.dtype) + str(x.shape)).encode())
+        h.update(x.view(np.uint8).ravel())
+    elif isinstance(x, (list, tuple)):
+        h.update((type(x).__name__ + str(len(x))).encode())
+        for k in x:
+            _update(h, k)
+    elif isinstance(x, dict):
+        h.update(('dict' + str(len(x))).encode())
+        for k in sorted(x.keys(), key=str):
+            _update(h, k)
+            _update(h, x[k])
+    elif callable(x):
+        h.update((getattr(x, '__module__', '') + '.' + getattr(
+            x, '__name__', repr(x))).encode())
+    else:
+        h.update((type(x).__name__ + repr(x)).encode())
+
+
+class DetectionCache(object):
+    """LRU cache of detection results with optional disk persistence.
+
+    >>> cache = DetectionCache(maxsize=32)
+    >>> key = cache.key(data_fp, channel, 'REM', {'threshold': 3.}, hypno)
+    >>> out = cache.get(key)
+    >>> if out is None:
+    >>>     out = cache.set(key, remdetect(data, sf, hypno, True, 3.))
+
+    Kargs:
+        maxsize: int, optional, (def: 64)
+            Maximum number of results kept in memory.
+
+        path: string, optional, (def: None)
+            Folder where results are persisted. Results of a previous session
+            are read from this folder. If None, results are only kept in
+            memory.
+    """
+
+    def __init__(self, maxsize=64, path=None):
+        """Init."""
+        self.maxsize = maxsize
+        self.path = path
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        if (path is not None) and not os.path.isdir(path):
+            os.makedirs(path)
+
+    def __len__(self):
+        """Return the number of results in memory."""
+        return len(self._mem)
+
+    def __contains__(self, key):
+        """Check if a result is available (in memory or on disk)."""
+        return (key in self._mem) or ((self.path is not None) and
+                                      os.path.isfile(self._file(key)))
+
+    def __call__(self, fcn, *args, **kwargs):
+        """Call fcn(*args, **kwargs) or get its cached result."""
+        key = self.key(fcn, args, kwargs)
+        out = self.get(key)
+        if out is None:
+            out = self.set(key, fcn(*args, **kwargs))
+        return out
+
+    @staticmethod
+    def key(*parts):
+        """Build a key from the parts identifying a detection.
+
+        Arrays are hashed using their content, so prefer passing a
+        precomputed fingerprint of large data (see fingerprint).
+        """
+        return fingerprint(parts)
+
+    def get(self, key):
+        """Get a result (None if the key is unknown)."""
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                return self._mem[key]
+        if self.path is None:
+            return None
+        # Read a persisted result :
+        try:
+            with open(self._file(key), 'rb') as f:
+                out = pickle.load(f)
+        except (OSError, IOError, EOFError, pickle.UnpicklingError):
+            return None
+        self._store(key, out)
+        return out
+
+    def set(self, key, value):
+        """Store a result (and persist it if a path is defined).
+
+        Returns:
+            value: object
+                The stored value.
+        """
+        self._store(key, value)
+        if self.path is not None:
+            # Write a temporary file first so that results are never partial :
+            tmp = self._file(key) + '.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._file(key))
+        return value
+
+    def clear(self, disk=False):
+        """Remove all results from memory (and from disk if disk is True)."""
+        with self._lock:
+            self._mem.clear()
+        if disk and (self.path is not None):
+            for k in os.listdir(self.path):
+                if k.endswith('.vbdetect'):
+                    os.remove(os.path.join(self.path, k))
+
+    def _store(self, key, value):
+        """Store a result in memory and evict the least recently used."""
+        with self._lock:
+            self._mem[key] = value
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.maxsize:
+                self._mem.popitem(last=False)
+
+    def _file(self, key):
+        """Get the file of a persisted result."""
+        return os.path.join(self.path, key + '.vbdetect')
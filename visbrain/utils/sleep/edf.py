@@ -16,7 +16,8 @@ from math import floor
 from re import findall
 from struct import pack
 
-from numpy import empty, asarray, fromstring, iinfo, abs, max
+from numpy import (empty, asarray, frombuffer, iinfo, abs, max, memmap,
+                   dtype as npdtype)
 
 EDF_FORMAT = 'int16'  # by definition
 edf_iinfo = iinfo(EDF_FORMAT)
@@ -38,6 +39,10 @@ class Edf:
     ----------
     edffile : str
         Full path for the EDF file
+    memmap : bool
+        If True, the data section is memory-mapped as an array of records and
+        samples are extracted with strided views instead of one read per
+        record.
 
     Attributes
     ----------
@@ -46,7 +51,9 @@ class Edf:
 
     """
 
-    def __init__(self, edffile):
+    def __init__(self, edffile, memmap=False):
+        self.memmap = memmap
+        self._records = None
         if isinstance(edffile, str):
             self.filename = edffile
             self._read_hdr()
@@ -201,24 +208,92 @@ class Edf:
                 samples = f.read(2 * (endpos - begpos))
 
                 i_dat_end = i_dat + endpos - begpos
-                dat[i_dat:i_dat_end] = fromstring(samples, dtype='<i2')
+                dat[i_dat:i_dat_end] = frombuffer(samples, dtype='<i2')
                 i_dat = i_dat_end
 
         return dat
 
-    def return_dat(self, chan, begsam, endsam):
+    def _memmap_records(self):
+        """Memory-map the data section of the EDF file.
+
+        Each data record is described by a structured dtype with one field per
+        signal (named 's0', 's1', ...), sized from n_samples_per_record. The
+        map is created once and reused by the following reads.
+
+        Returns
+        -------
+        numpy.memmap
+            A vector of records, of length the number of data records.
+
+        """
+        if self._records is None:
+            hdr = self.hdr
+            rec_dtype = npdtype([('s' + str(i), '<i2', (n,)) for i, n in
+                               enumerate(hdr['n_samples_per_record'])])
+            # Number of complete records actually written on disk :
+            with open(self.filename, 'rb') as f:
+                f.seek(0, 2)
+                n_bytes = f.tell() - hdr['header_n_bytes']
+            n_records = n_bytes // rec_dtype.itemsize
+            if hdr['n_records'] > 0:
+                n_records = min(n_records, hdr['n_records'])
+
+            self._records = memmap(self.filename, dtype=rec_dtype, mode='r',
+                                   offset=hdr['header_n_bytes'],
+                                   shape=(n_records,))
+
+        return self._records
+
+    def _read_dat_memmap(self, i_chan, begsam, endsam):
+        """Read raw data from a single EDF channel using the memory-map.
+
+        The records spanning [begsam, endsam) are selected as a strided view
+        of the channel's field, so only those samples are copied.
+
+        Parameters
+        ----------
+        i_chan : int
+            index of the channel to read
+        begsam : int
+            index of the first sample
+        endsam : int
+            index of the last sample
+
+        Returns
+        -------
+        numpy.ndarray
+            A vector with the data as written on file, in 16-bit precision
+
+        """
+        assert begsam < endsam
+
+        n_sam_rec = self.hdr['n_samples_per_record'][i_chan]
+
+        begrec = begsam // n_sam_rec
+        endrec = (endsam - 1) // n_sam_rec + 1
+
+        # (n_records, n_samples_per_record) strided view on the file :
+        sig = self._memmap_records()['s' + str(i_chan)][begrec:endrec]
+
+        begsam_rec = begsam - begrec * n_sam_rec
+        return sig.reshape(-1)[begsam_rec:begsam_rec + endsam - begsam]
+
+    def return_dat(self, chan, begsam, endsam, dtype='float64'):
         """Read data from an EDF file.
 
-        Reads channel by channel, and adjusts the values by calibration.
+        Reads channel by channel, and adjusts the values by calibration. The
+        calibration is applied once, on all channels at the same time.
 
         Parameters
         ----------
-        chan : list of str
-            index (indices) of the channels to read
+        chan : list of str or list of int
+            names or index (indices) of the channels to read
         begsam : int
             index of the first sample
         endsam : int
             index of the last sample
+        dtype : str
+            data type of the returned array
 
         Returns
         -------
@@ -228,21 +303,29 @@ class Edf:
 
         """
         hdr = self.hdr
-        dig_min = hdr['digital_min']
-        phys_min = hdr['physical_min']
-        phys_range = hdr['physical_max'] - hdr['physical_min']
-        dig_range = hdr['digital_max'] - hdr['digital_min']
+        idx = [hdr['label'].index(k) if isinstance(k, str) else int(k)
+               for k in chan]
+
+        dig_min = hdr['digital_min'][idx]
+        phys_min = hdr['physical_min'][idx]
+        phys_range = hdr['physical_max'][idx] - hdr['physical_min'][idx]
+        dig_range = hdr['digital_max'][idx] - hdr['digital_min'][idx]
 
         #assert all(phys_range > 0)
         #assert all(dig_range > 0)
 
         gain = phys_range / dig_range
+        offset = phys_min - dig_min * gain
+
+        read = self._read_dat_memmap if self.memmap else self._read_dat
+        dat = empty(shape=(len(idx), endsam - begsam), dtype=dtype)
 
-        dat = empty(shape=(len(chan), endsam - begsam), dtype='float64')
+        for i, i_chan in enumerate(idx):
+            dat[i, :] = read(i_chan, begsam, endsam)
 
-        for i, i_chan in enumerate(chan):
-            d = self._read_dat(i, begsam, endsam).astype('float64')
-            dat[i, :] = (d - dig_min[i]) * gain[i] + phys_min[i]
+        # Calibration (vectorized over channels) :
+        dat *= gain[:, None].astype(dat.dtype)
+        dat += offset[:, None].astype(dat.dtype)
 
         return dat
 
@@ -6,11 +6,18 @@ specific files including *.eeg, *.edf...
 
 import numpy as np
 import os
+import json
+import hashlib
+from warnings import warn
+
+from .lazydata import MemmapData, EdfData
+from .hypnoprocessing import EpochHypno
+from ..filtering import decimate
 
 __all__ = ['load_sleepdataset', 'load_hypno']
 
 
-def load_sleepdataset(path, downsample=100):
+def load_sleepdataset(path, downsample=100, lazy=False, cache=False):
     """Load a sleep dataset (elan, edf, brainvision).
 
     Args:
@@ -19,13 +26,28 @@ def load_sleepdataset(path, downsample=100):
 
     Kargs:
         downsample: int (def 100)
-            Downsampling frequency
+            Downsampling frequency. Data are downsampled using an
+            anti-aliasing filter (see visbrain.utils.decimate). If None or
+            not lower than the native sampling frequency, data are loaded at
+            their native sampling frequency.
+
+        lazy: bool (def False)
+            If True, data are not loaded but returned as a LazyData object
+            reading the file on demand. In that case, no downsampling is
+            applied and the native sampling frequency is returned.
+
+        cache: bool/string (def False)
+            Store the converted (scaled and downsampled) data in a binary
+            cache so that the next loading of the same file is only a memmap
+            opening. Use True to write the cache next to the file or a path
+            to a folder. The cache is ignored when lazy is True and is
+            rebuilt if the file changes.
 
     Return:
         sf: int
             The sampling frequency.
 
-        data: np.ndarray
+        data: np.ndarray / LazyData
             The data organised as well (n_channels, n_points)
 
         chan: list
@@ -37,6 +59,10 @@ def load_sleepdataset(path, downsample=100):
     # Test if file exist :
     assert os.path.isfile(path)
 
+    # Use the binary cache :
+    if cache and not lazy:
+        return _load_cached(path, downsample, cache)
+
     # Extract file extension :
     file, ext = os.path.splitext(path)
 
@@ -45,13 +71,13 @@ def load_sleepdataset(path, downsample=100):
         # ELAN :
         if os.path.isfile(path + '.ent'):
             # Apply an automatic downsampling to 100 Hz
-            sf, data, chan = elan2array(path, downsample)
-            return downsample, data, chan
+            sf, data, chan = elan2array(path, downsample, lazy=lazy)
+            return sf if lazy else _ds_freq(sf, downsample), data, chan
 
         # BRAINVISION :
         elif os.path.isfile(file + '.vhdr'):
-            sf, data, chan = brainvision2array(path)
-            return sf, data, chan
+            sf, data, chan = brainvision2array(path, downsample, lazy=lazy)
+            return sf if lazy else _ds_freq(sf, downsample), data, chan
 
         # None :
         else:
@@ -61,14 +87,85 @@ def load_sleepdataset(path, downsample=100):
 
     # EDF :
     elif ext == '.edf':
-        sf, data, chan = edf2array(path)
-        return sf, data, chan
+        sf, data, chan = edf2array(path, downsample, lazy=lazy)
+        return sf if lazy else _ds_freq(sf, downsample), data, chan
 
     # None :
     else:
         raise ValueError("*" + ext + " files are currently not supported.")
 
 
+def _ds_freq(sf, ds_freq):
+    """Get the sampling frequency after downsampling (never upsampled)."""
+    return float(ds_freq) if ds_freq and (ds_freq < sf) else float(sf)
+
+
+def _cache_files(path, downsample, cache):
+    """Get the data (.npy) and description (.json) files of the cache."""
+    path = os.path.abspath(path)
+    name = os.path.basename(path) + '.' + str(downsample) + 'Hz.vbcache'
+    if isinstance(cache, str):
+        # Cache folder : prevent collisions between files with the same name
+        uid = hashlib.md5(os.path.dirname(path).encode()).hexdigest()[:8]
+        name = os.path.join(cache, uid + '-' + name)
+    else:
+        name = os.path.join(os.path.dirname(path), name)
+    return name + '.npy', name + '.json'
+
+
+def _cache_key(path, downsample):
+    """Get the key identifying a converted file."""
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size,
+            'mtime': stat.st_mtime, 'downsample': downsample}
+
+
+def _load_cached(path, downsample, cache):
+    """Load a sleep dataset using the binary cache.
+
+    If the cache is valid, the data are memory-mapped (copy-on-write).
+    Otherwise, the file is converted directly into the cache.
+    """
+    npy, desc = _cache_files(path, downsample, cache)
+    key = _cache_key(path, downsample)
+
+    # Read an existing cache :
+    if os.path.isfile(npy) and os.path.isfile(desc):
+        try:
+            with open(desc, 'r') as f:
+                info = json.load(f)
+            if info['key'] == key:
+                data = np.load(npy, mmap_mode='c')
+                return info['sf'], data, info['chan']
+        except (ValueError, KeyError, OSError):
+            pass
+
+    # Convert the file (block by block) into the cache :
+    sf, lazy, chan = load_sleepdataset(path, lazy=True)
+    chan = [str(k) for k in chan]
+    downsample = _ds_freq(sf, downsample)
+    tmp = npy + '.tmp.npy'
+    try:
+        if isinstance(cache, str) and not os.path.isdir(cache):
+            os.makedirs(cache)
+        shape = lazy.decimate(sf, downsample).shape
+        out = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32,
+                                        shape=shape)
+        decimate(lazy, sf, downsample, out=out)
+        out.flush()
+        del out
+        os.replace(tmp, npy)
+        with open(desc, 'w') as f:
+            json.dump({'key': key, 'sf': downsample, 'chan': chan}, f)
+    except OSError as e:
+        warn("Sleep dataset cache can not be written (" + str(e) + ")")
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+        return downsample, decimate(lazy, sf, downsample), chan
+
+    return downsample, np.load(npy, mmap_mode='c'), chan
+
+
 def load_hypno(path, ds_freq):
     """Load hypnogram file.
 
@@ -90,8 +187,8 @@ def load_hypno(path, ds_freq):
             Down-sampling frequency
 
     Return:
-        hypno: np.ndarray
-            The hypnogram vector with same length as downsampled data.
+        hypno: EpochHypno
+            The hypnogram (one stage per epoch) with same length as data.
     """
     # Test if file exist :
     assert os.path.isfile(path)
@@ -124,8 +221,8 @@ def elan_hyp(path, ds_freq):
             Downsampling frequency
 
     Return:
-        hypno: np.ndarray
-            The hypnogram vector with same length as downsampled data.
+        hypno: EpochHypno
+            The hypnogram (one stage per epoch) with same length as data.
 
     """
     hyp = np.genfromtxt(path, delimiter='\n', usecols=[0],
@@ -144,10 +241,8 @@ def elan_hyp(path, ds_freq):
     hypno[hypno == 4] = 3
     hypno[hypno == 5] = 4
 
-    # Resample to get same number of points as in eeg file
-    hypno = np.repeat(hypno, ds_freq)
-
-    return hypno
+    # One epoch per second (same number of points as in eeg file) :
+    return EpochHypno(hypno, ds_freq, round(len(hypno) * ds_freq))
 
 
 def txt_hyp(path, ds_freq):
@@ -161,8 +256,8 @@ def txt_hyp(path, ds_freq):
             Downsampling frequency
 
     Return:
-        hypno: np.ndarray
-            The hypnogram vector with same length as downsampled data.
+        hypno: EpochHypno
+            The hypnogram (one stage per epoch) with same length as data.
 
     """
     assert os.path.isfile(path)
@@ -190,10 +285,9 @@ def txt_hyp(path, ds_freq):
 
     hypno = swap_hyp_values(hypno, desc)
 
-    # Resample to get same number of points as in eeg file
-    hypno = np.repeat(hypno, ds_freq * desc['time'])
-
-    return hypno
+    # One epoch per time window (same number of points as in eeg file) :
+    epoch = ds_freq * desc['time']
+    return EpochHypno(hypno, epoch, round(len(hypno) * epoch))
 
 
 def swap_hyp_values(hypno, desc):
@@ -261,7 +355,7 @@ def swap_hyp_values(hypno, desc):
     return hypno_s
 
 
-def elan2array(path, ds_freq):
+def elan2array(path, ds_freq, lazy=False, chan=None):
     """Read Elan eeg file into NumPy.
 
     Elan format specs: http: // elan.lyon.inserm.fr/
@@ -275,13 +369,23 @@ def elan2array(path, ds_freq):
             Filename(with full path) to Elan .eeg file
 
         ds_freq: int, (def 100)
-            Down - sampling frequency
+            Down - sampling frequency. If None (or not lower than the
+            sampling frequency), data are not downsampled.
+
+    Kargs:
+        lazy: bool, (def False)
+            Return a LazyData object instead of loading data. In that case,
+            ds_freq is ignored.
+
+        chan: list, (def None)
+            List of channels (names or indices) to load. Other channels are
+            never read. If None, all channels are loaded.
 
     Return:
         sf: int
             The sampling frequency.
 
-        data: np.ndarray
+        data: np.ndarray / LazyData
             The data organised as well(n_channels, n_points)
 
         chan: list
@@ -294,6 +398,7 @@ def elan2array(path, ds_freq):
         >> > path = os.path.join(pathfile, 'myfile.eeg')
         >> > sf, data, chan, = elan2array(path)
     """
+    sel = chan
     header = path + '.ent'
 
     assert os.path.isfile(path)
@@ -327,6 +432,16 @@ def elan2array(path, ds_freq):
     chan_list = np.arange(0, nb_chan_data)
     chan = ent[10:10 + nb_chan_data]
 
+    # Channel selection
+    if sel is not None:
+        names = list(chan)
+        chan_list = np.array([names.index(k) if isinstance(k, str) else int(k)
+                              for k in sel], dtype=int)
+        if np.any(chan_list < 0) or np.any(chan_list >= nb_chan_data):
+            raise ValueError("Channel index out of range (" +
+                             str(nb_chan_data) + " channels in file)")
+        chan = chan[chan_list]
+
     # Gain
     Gain = np.zeros(nb_chan)
     offset1 = 9 + 3 * nb_chan
@@ -348,19 +463,22 @@ def elan2array(path, ds_freq):
     nb_samples = int(nb_bytes / (nb_oct * nb_chan))
 
     m_raw = np.memmap(path, dtype=formread, mode='r',
-                      shape=(nb_chan, nb_samples), order={'F'})
+                      shape=(nb_chan, nb_samples), order='F')
 
-    # Downsample
-    ds_factor = np.int(sf / ds_freq)
-    m_ds = m_raw[:, ::ds_factor]
+    # Gain is applied block by block on the selected channels only
+    data = MemmapData(m_raw, Gain, chan_list)
 
-    # Multiply by gain
-    data = np.diag(Gain[chan_list]).dot(m_ds[chan_list, ])
+    if lazy:
+        return float(sf), data, list(chan)
+    elif ds_freq and (ds_freq < sf):
+        data = decimate(data, sf, ds_freq)
+    else:
+        data = np.asarray(data)
 
-    return float(sf), data.astype(np.float32), list(chan)
+    return float(sf), data, list(chan)
 
 
-def edf2array(path):
+def edf2array(path, ds_freq=None, lazy=False):
     """Read European Data Format (EDF) file into NumPy.
 
     Use phypno class for reading EDF files:
@@ -370,11 +488,20 @@ def edf2array(path):
         path: str
             Filename(with full path) to EDF file
 
+    Kargs:
+        ds_freq: int, (def None)
+            Down - sampling frequency. If None (or not lower than the
+            sampling frequency), data are not downsampled.
+
+        lazy: bool, (def False)
+            Return a LazyData object instead of loading data. In that case,
+            ds_freq is ignored.
+
     Return:
         sf: int
             The sampling frequency.
 
-        data: np.ndarray
+        data: np.ndarray / LazyData
             The data organised as well(n_channels, n_points)
 
         chan: list
@@ -391,45 +518,90 @@ def edf2array(path):
 
     from .edf import Edf
 
-    edf = Edf(path)
+    edf = Edf(path, memmap=True)
 
     # Return header informations
     _, _, sf, chan, n_samples, _ = edf.return_hdr()
 
     # Keep only data channels (e.g excludes marker chan)
-    freqs = np.unique(edf.hdr['n_samples_per_record'])
-    sf = freqs.max()
+    n_sam_rec = np.asarray(edf.hdr['n_samples_per_record'])
+    freqs = np.unique(n_sam_rec)
+    sf = freqs.max() / edf.hdr['record_length']
+    # Records actually on disk (the header could be -1 or truncated) :
+    n_samples = int(freqs.max() * len(edf._memmap_records()))
 
     if len(freqs) != 1:
-        bad_chans = np.where(edf.hdr['n_samples_per_record'] < sf)
+        bad_chans = np.where(n_sam_rec < freqs.max())
         chan = np.delete(chan, bad_chans)
 
+    if lazy:
+        return float(sf), EdfData(edf, chan, n_samples), list(chan)
+
     # Load all samples of selected channels
     np.seterr(divide='ignore', invalid='ignore')
-    data = edf.return_dat(chan, 0, n_samples)
+    if ds_freq and (ds_freq < sf):
+        data = decimate(EdfData(edf, chan, n_samples), sf, ds_freq)
+    else:
+        data = edf.return_dat(list(chan), 0, n_samples, dtype=np.float32)
 
-    return float(sf), data.astype(np.float32), list(chan)
+    return float(sf), data, list(chan)
 
 
-def brainvision2array(path):
-    """Read BrainVision file.
+def _read_vhdr(header):
+    """Read a BrainVision header file (.vhdr).
 
-    Poor man's version of https: // gist.github.com / breuderink / 6266871
+    Args:
+        header: str
+            Filename (with full path) to the .vhdr file.
 
-    Assumes that data are saved with the following parameters:
+    Return:
+        vhdr: dict
+            Dictionary of sections (e.g. 'Common Infos', 'Channel Infos').
+            Each section is a dictionary of (key, value) strings.
+    """
+    vhdr, section = {}, None
+    with open(header, 'r', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            # Skip empty lines and comments :
+            if not line or line.startswith(';'):
+                continue
+            # New section :
+            if line.startswith('[') and line.endswith(']'):
+                section = vhdr.setdefault(line[1:-1].strip(), {})
+            elif (section is not None) and ('=' in line):
+                key, val = line.split('=', 1)
+                section[key.strip()] = val.strip()
+    return vhdr
+
+
+def brainvision2array(path, ds_freq=None, lazy=False):
+    """Read BrainVision file.
+
+    The binary file is memory-mapped and read block by block. Supported
+    parameters are:
         - Data format: Binary
-        - Orientation: Multiplexed
-        - Format: int16
+        - Orientation: Multiplexed or Vectorized
+        - Format: int16, int32 or float32
 
     Args:
         path: str
             Filename(with full path) to .eeg file
 
+    Kargs:
+        ds_freq: int, (def None)
+            Down - sampling frequency. If None (or not lower than the
+            sampling frequency), data are not downsampled.
+
+        lazy: bool, (def False)
+            Return a LazyData object instead of loading data. In that case,
+            ds_freq is ignored.
+
     Return:
         sf: int
             The sampling frequency.
 
-        data: np.ndarray
+        data: np.ndarray / LazyData
             The data organised as well(n_channels, n_points)
 
         chan: list
@@ -442,8 +614,6 @@ def brainvision2array(path):
         >> > path = os.path.join(pathfile, 'myfile.eeg')
         >> > sf, data, chan, = brainvision2array(path)
     """
-    import re
-
     assert os.path.splitext(path)[1] == '.eeg'
 
     header = os.path.splitext(path)[0] + '.vhdr'
@@ -452,39 +622,51 @@ def brainvision2array(path):
     assert os.path.isfile(header)
 
     # Read header
-    ent = np.genfromtxt(header, delimiter='\n', usecols=[0],
-                        dtype=None, skip_header=0)
-
-    ent = np.char.decode(ent)
-
-    # Channels info
-    n_chan = int(re.findall('\d+', ent[10])[0])
-    # n_samples = int(re.findall('\d+', ent[11])[0])
-    sf = int(re.findall('\d+', ent[14])[0])
-
-    # Extract channel labels and resolution
-    start_label = np.array(np.where(np.char.find(ent, 'Ch1=') == 0)).min()
-
-    chan = {}
-    resolution = np.empty(shape=n_chan)
-
-    for i, j in enumerate(range(start_label, start_label + n_chan)):
-        chan[i] = re.split('\W+', ent[j])[1]
-        resolution[i] = float(ent[j].split(",")[2])
-
-    chan = np.array(list(chan.values())).flatten()
+    vhdr = _read_vhdr(header)
+    common = vhdr.get('Common Infos', {})
+    binary = vhdr.get('Binary Infos', {})
+    infos = vhdr.get('Channel Infos', {})
 
     # Check binary format
-    assert "MULTIPLEXED" in ent[8]
-    assert "BINARY" in ent[6]
-    assert "INT_16" in ent[22]
-
-    with open(path, 'rb') as f:
-        raw = f.read()
-        size = int(len(raw) / 2)
-        ints = np.ndarray((n_chan, int(size / n_chan)),
-                          dtype='<i2', order='F', buffer=raw)
-
-        data = np.diag(resolution).dot(ints)
+    fmt = {'INT_16': '<i2', 'INT_32': '<i4', 'IEEE_FLOAT_32': '<f4'}
+    orientation = {'MULTIPLEXED': 'F', 'VECTORIZED': 'C'}
+    data_format = common.get('DataFormat', 'BINARY').upper()
+    bin_format = binary.get('BinaryFormat', 'INT_16').upper()
+    data_orient = common.get('DataOrientation', 'MULTIPLEXED').upper()
+    if data_format != 'BINARY':
+        raise ValueError("Only binary BrainVision files are supported "
+                         "(DataFormat=" + data_format + ")")
+    if bin_format not in fmt:
+        raise ValueError("BinaryFormat=" + bin_format + " is not supported. "
+                         "Use " + ", ".join(fmt.keys()))
+    if data_orient not in orientation:
+        raise ValueError("DataOrientation=" + data_orient + " is not "
+                         "supported. Use " + ", ".join(orientation.keys()))
+
+    # Channels info (sampling interval is in microseconds)
+    n_chan = int(common['NumberOfChannels'])
+    sf = 1e6 / float(common['SamplingInterval'])
+
+    # Extract channel labels and resolution (Chn=name,ref,res,unit)
+    chan, resolution = [], np.ones((n_chan,), dtype=np.float32)
+    for k in range(n_chan):
+        info = infos.get('Ch' + str(k + 1), '').split(',')
+        chan.append(info[0].replace('\\1', ',') or 'Ch' + str(k + 1))
+        if len(info) > 2 and info[2].strip():
+            resolution[k] = float(info[2])
+
+    # Memory map the binary file
+    dtype = np.dtype(fmt[bin_format])
+    n_samples = int(os.path.getsize(path) // (dtype.itemsize * n_chan))
+    m_raw = np.memmap(path, dtype=dtype, mode='r', shape=(n_chan, n_samples),
+                      order=orientation[data_orient])
+    data = MemmapData(m_raw, resolution)
+
+    if lazy:
+        return float(sf), data, chan
+    elif ds_freq and (ds_freq < sf):
+        data = decimate(data, sf, ds_freq)
+    else:
+        data = np.asarray(data)
 
-    return float(sf), data.astype(np.float32), list(chan)
+    return float(sf), data, chan
@@ -3,14 +3,20 @@
 import numpy as np
 from os import path
 
-__all__ = ['sleepstats', 'transient']
+__all__ = ['EpochHypno', 'sleepstats', 'sleepstats_batch',
+           'hypnotransitions', 'hypnobouts', 'transient']
+
+# Scored stages (Art, W, N1, N2, N3, REM) and padding value :
+_STAGES = np.array([-1, 0, 1, 2, 3, 4])
+_NAMES = ['Art', 'W', 'N1', 'N2', 'N3', 'REM']
+_PAD = -2
 
 
 def transient(data, xvec=None):
     """Perform a transient detection on hypnogram.
 
     Args:
-        data: np.ndarray
+        data: np.ndarray / EpochHypno
             The hypnogram data.
 
     Kargs:
@@ -29,12 +35,19 @@ def transient(data, xvec=None):
         stages: np.ndarray
             The stages for each segment.
     """
-    # Transient detection :
-    t = list(np.nonzero(np.abs(data[:-1] - data[1:]))[0])
-    # Add first and last points :
-    idx = np.vstack((np.array([-1] + t) + 1, np.array(t + [len(data) - 1]))).T
-    # Get stages :
-    stages = data[idx[:, 0]]
+    if isinstance(data, EpochHypno):
+        # Transients from the runs of epochs :
+        starts, ends, stages = data.runs()
+        t = list(ends[:-1] - 1)
+        idx = np.vstack((starts, ends - 1)).T
+    else:
+        # Transient detection :
+        t = list(np.nonzero(np.abs(data[:-1] - data[1:]))[0])
+        # Add first and last points :
+        idx = np.vstack((np.array([-1] + t) + 1,
+                         np.array(t + [len(data) - 1]))).T
+        # Get stages :
+        stages = data[idx[:, 0]]
     # Convert (if needed) :
     if (xvec is not None) and (len(xvec) == len(data)):
         st = idx.copy().astype(float)
@@ -53,7 +66,7 @@ def sleepstats(file, hypno, sf=100, time_window=30.):
         file: str
             Filename (with full path) to sleep dataset.
 
-        hypno: np.ndarray
+        hypno: np.ndarray / EpochHypno
             Hypnogram vector
 
         sf: int (def 100)
@@ -94,62 +107,568 @@ def sleepstats(file, hypno, sf=100, time_window=30.):
     ======================================================================
 
     """
-    # Get a step (integer) and resample to get one value per 30 seconds :
-    step = int(round(sf * time_window))
-    hypno = hypno[::step]
+    stats = sleepstats_batch([hypno], sf, time_window, files=[file])
+    return {k: v[0] for k, v in stats.items()}
 
-    stats = {}
+
+def sleepstats_batch(hypnos, sf=100, time_window=30., files=None):
+    """Compute sleep stats of several hypnograms (e.g. a cohort).
+
+    All statistics are computed at once from the run-length encoding of the
+    hypnograms (see sleepstats for their specifications).
+
+    Args:
+        hypnos: np.ndarray or list
+            Array of hypnograms of shape (n_nights, n_points) or list of
+            hypnogram vectors / EpochHypno (possibly of different lengths).
+
+    Kargs:
+        sf: int (def 100)
+            Sampling frequency of hypnograms / data
+
+        time_window: int (def 30)
+            Length (seconds) of the time window on which to compute stats
+
+        files: list, optional, (def: None)
+            Filename of each night.
+
+    Return:
+        stats: dict
+            Sleep statistics (same keys as sleepstats). Each value is an array
+            with one value per night.
+    """
+    h, lengths = _stack_hypnos(hypnos, int(round(sf * time_window)))
+    n_nights, n_pts = h.shape
+    n_st = len(_STAGES)
+    row, start, length, value, code = _hypno_runs(h)
     tov = np.nan
 
-    stats['Duration (TIB)_3'] = hypno.size
-    stats['TDT_4'] = np.where(hypno != 0)[0].max() if np.nonzero(
-        hypno)[0].size else tov
-
-    # Duration of each sleep stages
-    stats['Art_5'] = hypno[hypno == -1].size
-    stats['W_6'] = hypno[hypno == 0].size
-    stats['N1_7'] = hypno[hypno == 1].size
-    stats['N2_8'] = hypno[hypno == 2].size
-    stats['N3_9'] = hypno[hypno == 3].size
-    stats['REM_10'] = hypno[hypno == 4].size
-
-    # Sleep stage latencies
-    stats['LatN1_11'] = np.where(hypno == 1)[0].min() if 1 in hypno else tov
-    stats['LatN2_12'] = np.where(hypno == 2)[0].min() if 2 in hypno else tov
-    stats['LatN3_13'] = np.where(hypno == 3)[0].min() if 3 in hypno else tov
-    stats['LatREM_14'] = np.where(hypno == 4)[0].min() if 4 in hypno else tov
-
-    if not np.isnan(stats['LatN1_11']) and not np.isnan(stats['TDT_4']):
-        hypno_s = hypno[stats['LatN1_11']:stats['TDT_4']]
-
-        stats['SPT_15'] = hypno_s.size
-        stats['WASO_16'] = hypno_s[hypno_s == 0].size
-        stats['TST_17'] = stats['SPT_15'] - stats['WASO_16']
-    else:
-        stats['SPT_15'] = np.nan
-        stats['WASO_16'] = np.nan
-        stats['TST_17'] = np.nan
+    # Stage durations and latencies (first run of each stage) :
+    rcode = row * (n_st + 1) + code
+    count = np.bincount(rcode, weights=length, minlength=n_nights * (
+        n_st + 1)).reshape(n_nights, -1)[:, :-1]
+    first = np.full((n_nights * (n_st + 1),), n_pts)
+    np.minimum.at(first, rcode, start)
+    first = first.reshape(n_nights, -1)[:, :-1].astype(float)
+    first[first == n_pts] = tov
+
+    # TDT (last sample different from wake) :
+    tdt = np.full((n_nights,), -1)
+    nwake = (value != 0) & (value != _PAD)
+    np.maximum.at(tdt, row[nwake], (start + length - 1)[nwake])
+    tdt = tdt.astype(float)
+    tdt[tdt < 0] = tov
+
+    # SPT, WASO and TST (from N1 latency to TDT) :
+    lat_n1 = first[:, 2]
+    with np.errstate(invalid='ignore'):
+        spt = np.maximum(tdt - lat_n1, 0.)
+        wake = value == 0
+        end = np.minimum(start + length, tdt[row])[wake]
+        beg = np.maximum(start, lat_n1[row])[wake]
+        waso = np.bincount(row[wake], weights=np.maximum(end - beg, 0.),
+                           minlength=n_nights).astype(float)
+    waso[np.isnan(spt)] = tov
+
+    stats = {}
+    stats['Duration (TIB)_3'] = lengths.astype(float)
+    stats['TDT_4'] = tdt
+    for k, name in enumerate(_NAMES):
+        stats[name + '_' + str(k + 5)] = count[:, k]
+    for k, name in enumerate(_NAMES[2:]):
+        stats['Lat' + name + '_' + str(k + 11)] = first[:, k + 2]
+    stats['SPT_15'] = spt
+    stats['WASO_16'] = waso
+    stats['TST_17'] = spt - waso
 
     # Convert to minutes
     for key, value in stats.items():
         stats[key] = value / (60. / time_window)
 
     # Add global informations
-    if file == None:
-        stats['Filename_0'] = ''
-    else:
-        stats['Filename_0'] = path.basename(file)
-    stats['Downsampling_1'] = str(int(sf)) + " Hz"
-    stats['Units_2'] = 'minutes'
+    if files is None:
+        files = [None] * n_nights
+    stats['Filename_0'] = np.array([path.basename(k) if k is not None else
+                                    '' for k in files])
+    stats['Downsampling_1'] = np.full((n_nights,), str(int(sf)) + " Hz")
+    stats['Units_2'] = np.full((n_nights,), 'minutes')
 
-    stats['SE (%)_18'] = np.round(stats['TST_17'] / stats['TDT_4'] * 100., 2)
-
-    # Percentages of TDT
-    # stats['%Art_18'] = stats['Art_4'] / stats['TDT_3'] * 100.
-    # stats['%W_19'] = stats['W_5'] / stats['TDT_3'] * 100.
-    # stats['%N1_20'] = stats['N1_6'] / stats['TDT_3'] * 100.
-    # stats['%N2_21'] = stats['N2_7'] / stats['TDT_3'] * 100.
-    # stats['%N3_22'] = stats['N3_8'] / stats['TDT_3'] * 100.
-    # stats['%REM_23'] = stats['REM_9'] / stats['TDT_3'] * 100.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats['SE (%)_18'] = np.round(stats['TST_17'] / stats['TDT_4'] *
+                                      100., 2)
 
     return stats
+
+
+def hypnotransitions(hypno, sf=100, time_window=30.):
+    """Get the transitions matrix of an hypnogram.
+
+    Args:
+        hypno: np.ndarray or list
+            Hypnogram vector, or several hypnograms (see sleepstats_batch).
+
+    Kargs:
+        sf: int (def 100)
+            Sampling frequency of hypnogram / data
+
+        time_window: int (def 30)
+            Length (seconds) of the time window on which to compute stats
+
+    Return:
+        trans: np.ndarray
+            Number of transitions between stages (Art, W, N1, N2, N3, REM)
+            of shape (n_stages, n_stages) (from stages in rows, to stages in
+            columns) or (n_nights, n_stages, n_stages).
+    """
+    is_vector = isinstance(hypno, EpochHypno) or (isinstance(
+        hypno, np.ndarray) and (hypno.ndim == 1))
+    h, _ = _stack_hypnos([hypno] if is_vector else hypno,
+                         int(round(sf * time_window)))
+    row, _, _, _, code = _hypno_runs(h)
+    n_st = len(_STAGES)
+    # Consecutive runs of the same night :
+    keep = (row[1:] == row[:-1]) & (code[1:] < n_st) & (code[:-1] < n_st)
+    idx = (row[1:] * n_st + code[:-1]) * n_st + code[1:]
+    trans = np.bincount(idx[keep], minlength=h.shape[0] * n_st ** 2)
+    trans = trans.reshape(h.shape[0], n_st, n_st)
+    return trans[0] if is_vector else trans
+
+
+def hypnobouts(hypno, sf=100, time_window=30.):
+    """Get the length of the bouts of each sleep stage.
+
+    Args:
+        hypno: np.ndarray / EpochHypno
+            Hypnogram vector
+
+    Kargs:
+        sf: int (def 100)
+            Sampling frequency of hypnogram / data
+
+        time_window: int (def 30)
+            Length (seconds) of the time window on which to compute stats
+
+    Return:
+        bouts: dict
+            Length (in minutes) of the successive bouts of each stage (Art,
+            W, N1, N2, N3, REM).
+    """
+    h, _ = _stack_hypnos([hypno], int(round(sf * time_window)))
+    _, _, length, value, _ = _hypno_runs(h)
+    length = length / (60. / time_window)
+    return {name: length[value == k] for k, name in zip(_STAGES, _NAMES)}
+
+
+def _stack_hypnos(hypnos, step):
+    """Resample hypnograms and stack them in a padded matrix.
+
+    Returns:
+        h: np.ndarray
+            Array of shape (n_nights, n_epochs) padded with _PAD.
+
+        lengths: np.ndarray
+            Number of epochs of each night.
+    """
+    if isinstance(hypnos, np.ndarray) and (hypnos.ndim == 2):
+        h = hypnos[:, ::step].astype(int)
+        return h, np.full((h.shape[0],), h.shape[1])
+    hypnos = [k[::step] if isinstance(k, EpochHypno) else np.asarray(
+        k)[::step] for k in hypnos]
+    lengths = np.array([len(k) for k in hypnos], dtype=int)
+    n_pts = lengths.max() if len(lengths) else 0
+    h = np.full((len(hypnos), n_pts), _PAD, dtype=int)
+    h[np.arange(n_pts) < lengths[:, np.newaxis]] = np.concatenate(
+        hypnos) if len(hypnos) else []
+    return h, lengths
+
+
+def _hypno_runs(h):
+    """Run-length encoding of stacked hypnograms.
+
+    Returns:
+        row, start, length, value, code: np.ndarray
+            Night, first epoch, number of epochs, stage value and stage index
+            (in _STAGES, len(_STAGES) for other values) of each run.
+    """
+    n_nights, n_pts = h.shape
+    if not h.size:
+        empty = np.array([], dtype=int)
+        return (empty,) * 5
+    change = np.ones(h.shape, dtype=bool)
+    change[:, 1:] = h[:, 1:] != h[:, :-1]
+    idx = np.flatnonzero(change)
+    length = np.diff(np.r_[idx, h.size])
+    row, start = np.divmod(idx, n_pts)
+    value = h.ravel()[idx]
+    code = np.searchsorted(_STAGES, value)
+    code[(code == len(_STAGES)) | (_STAGES[np.minimum(
+        code, len(_STAGES) - 1)] != value)] = len(_STAGES)
+    return row, start, length, value, code
+
+
+class EpochHypno(object):
+    """Compact hypnogram (one stage per epoch).
+
+    The hypnogram is stored as one int8 stage per epoch instead of one value
+    per data sample. Samples are mapped to epochs using the epoch length and
+    the offset of the first epoch, so that the hypnogram can still be indexed
+    and used as a sample vector :
+
+    >>> hypno = EpochHypno(stages, epoch=30 * sf, npts=data.shape[1])
+    >>> hypno[1000]  # Stage of the 1000th sample
+    >>> hypno[::sf]  # Stage of each second
+    >>> hypno.set_samples(0, 3000, 2)  # Score the first 3000 samples as N2
+    >>> np.asarray(hypno)  # Full sample vector
+
+    The epoch grid never changes. Epochs scored with several stages (e.g.
+    partly edited epochs) keep their own sample vector in the partial
+    dictionary, so that edits are exact and only cost the edited epochs.
+
+    Args:
+        values: array_like
+            Stage of each epoch.
+
+        epoch: float
+            Number of samples per epoch.
+
+        npts: int
+            Number of samples of the hypnogram (i.e. of the data).
+
+    Kargs:
+        offset: float, optional, (def: 0)
+            First sample of the first epoch. Samples before belong to the
+            first epoch.
+
+        partial: dict, optional, (def: None)
+            Stage of each sample of the epochs scored with several stages
+            ({epoch index: sample vector}).
+    """
+
+    def __init__(self, values, epoch, npts, offset=0, partial=None):
+        """Init."""
+        if epoch <= 0:
+            raise ValueError("The epoch length must be strictly positive")
+        self.values = np.atleast_1d(np.asarray(values)).astype(np.int8)
+        self.epoch = epoch
+        self.offset = offset
+        self.npts = int(npts)
+        # First sample of each epoch (and last sample excluded) :
+        bounds = np.ceil(offset + np.arange(len(self.values) + 1) * epoch -
+                         1e-6).astype(int)
+        bounds[0], bounds[-1] = 0, self.npts
+        self._bounds = np.clip(bounds, 0, self.npts)
+        self.partial = {}
+        for k, samples in (partial or {}).items():
+            self._set_epoch(int(k), np.asarray(samples, dtype=np.int8))
+
+    @classmethod
+    def from_samples(cls, hypno, epoch=None):
+        """Compress a sample vector hypnogram.
+
+        Args:
+            hypno: array_like
+                Hypnogram vector (one value per sample).
+
+        Kargs:
+            epoch: float, optional, (def: None)
+                Number of samples per epoch. Epochs containing a stage change
+                are stored as partial epochs. If None, the longest epoch
+                without partial epochs is used (the greatest common divisor
+                of the change points).
+
+        Returns:
+            hypno: EpochHypno
+                The compact hypnogram.
+        """
+        hypno = np.asarray(hypno).ravel()
+        npts = len(hypno)
+        change = np.flatnonzero(hypno[1:] != hypno[:-1]) + 1
+        if epoch is None:
+            epoch = max(int(np.gcd.reduce(change)) if len(change) else npts,
+                        1)
+        n_epochs = max(1, int(np.ceil(npts / epoch)))
+        out = cls(np.zeros((n_epochs,)), epoch, npts)
+        if npts:
+            out.values[:] = hypno[np.minimum(out._bounds[:-1], npts - 1)]
+        # Epochs containing a stage change :
+        change = change[~np.isin(change, out._bounds)]
+        for k in np.unique(out.index(change)):
+            out._set_epoch(k, hypno[out._bounds[k]:out._bounds[k + 1]].astype(
+                np.int8))
+        return out
+
+    def __len__(self):
+        """Return the number of samples."""
+        return self.npts
+
+    def __repr__(self):
+        """Representation."""
+        return ('EpochHypno(n_epochs=%i, epoch=%s, offset=%s, npts=%i, '
+                'n_partial=%i)' % (len(self.values), self.epoch, self.offset,
+                                   self.npts, len(self.partial)))
+
+    def __contains__(self, stage):
+        """Check if a stage is scored."""
+        return stage in self.stages()
+
+    def __getitem__(self, key):
+        """Get the stage of samples (int, slice or array of samples)."""
+        if isinstance(key, (int, np.integer)):
+            key = key + self.npts if key < 0 else key
+            if not 0 <= key < self.npts:
+                raise IndexError("Sample index out of range")
+            k = int(self.index(key))
+            if k in self.partial:
+                return int(self.partial[k][key - self._bounds[k]])
+            return int(self.values[k])
+        elif isinstance(key, slice):
+            start, stop, step = key.indices(self.npts)
+            if step == 1:
+                return self._expand(start, stop)
+            key = np.arange(start, stop, step)
+        key = np.asarray(key)
+        idx = self.index(key)
+        out = self.values[idx]
+        # Samples of partial epochs :
+        for k in np.unique(idx[np.isin(idx, list(self.partial))]):
+            sel = idx == k
+            samples = self.partial[k]
+            out[sel] = samples[np.clip(key[sel] - self._bounds[k], 0,
+                                       len(samples) - 1)]
+        return out
+
+    def __array__(self, dtype=None):
+        """Get the full sample vector."""
+        hypno = self._expand(0, self.npts)
+        return hypno if dtype is None else hypno.astype(dtype)
+
+    @property
+    def size(self):
+        """Get the number of samples."""
+        return self.npts
+
+    @property
+    def shape(self):
+        """Get the shape of the sample vector."""
+        return (self.npts,)
+
+    @property
+    def ndim(self):
+        """Get the number of dimensions of the sample vector."""
+        return 1
+
+    @property
+    def _scored(self):
+        """Get the epochs covering at least one sample."""
+        return self._bounds[1:] > self._bounds[:-1]
+
+    def index(self, samples):
+        """Get the epoch of samples.
+
+        Args:
+            samples: int or np.ndarray
+                Sample indices.
+
+        Returns:
+            epochs: int or np.ndarray
+                Epoch indices.
+        """
+        idx = np.searchsorted(self._bounds, samples, side='right') - 1
+        return np.clip(idx, 0, len(self.values) - 1)
+
+    def stages(self):
+        """Get the (sorted) scored stages."""
+        return np.unique(np.concatenate([self.values[self._scored]] + list(
+            self.partial.values())))
+
+    def runs(self, start=0, stop=None):
+        """Get the runs of consecutive samples with the same stage.
+
+        Kargs:
+            start: int, optional, (def: 0)
+                First sample.
+
+            stop: int, optional, (def: None)
+                Last sample (excluded). If None, the number of samples is
+                used.
+
+        Returns:
+            starts: np.ndarray
+                First sample of each run.
+
+            ends: np.ndarray
+                Last sample (excluded) of each run.
+
+            stages: np.ndarray
+                Stage of each run.
+        """
+        stop = self.npts if stop is None else stop
+        if stop <= start:
+            return (np.array([], dtype=int), np.array([], dtype=int),
+                    np.array([], dtype=np.int8))
+        first, last = self.index([start, stop - 1])
+        bounds = self._bounds[first:last + 2].copy()
+        bounds[0], bounds[-1] = start, stop
+        values = self.values[first:last + 1]
+        # Replace partial epochs by their own runs :
+        partial = sorted(self._partial_in(first, last))
+        if partial:
+            starts, stages, prev = [], [], first
+            for k in partial:
+                starts.append(bounds[prev - first:k - first])
+                stages.append(values[prev - first:k - first])
+                b0, b1 = bounds[k - first], bounds[k + 1 - first]
+                samples = self.partial[k][b0 - self._bounds[k]:b1 -
+                                          self._bounds[k]]
+                change = np.flatnonzero(np.r_[True,
+                                              samples[1:] != samples[:-1]])
+                starts.append(b0 + change)
+                stages.append(samples[change])
+                prev = k + 1
+            starts.append(bounds[prev - first:-1])
+            stages.append(values[prev - first:])
+            bounds = np.r_[np.concatenate(starts), stop]
+            values = np.concatenate(stages)
+        # Skip epochs without samples :
+        scored = np.flatnonzero(bounds[1:] > bounds[:-1])
+        values = values[scored]
+        change = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+        starts = bounds[scored[change]].astype(int)
+        ends = np.r_[starts[1:], stop].astype(int)
+        return starts, ends, values[change]
+
+    def set_samples(self, start, stop, stage):
+        """Set the stage of samples.
+
+        Exactly the samples in [start, stop[ are edited. Epochs that are
+        only partly edited are stored as partial epochs (the epoch grid is
+        unchanged).
+
+        Args:
+            start: int
+                First sample.
+
+            stop: int
+                Last sample (excluded).
+
+            stage: int
+                The stage.
+
+        Returns:
+            edited: tuple
+                First and last (excluded) edited sample.
+        """
+        start, stop = (int(k) for k in np.clip([start, stop], 0, self.npts))
+        if stop <= start:
+            return start, start
+        bounds = self._bounds
+        first, last = (int(k) for k in self.index([start, stop - 1]))
+        # Whole epochs :
+        lo = first if bounds[first] >= start else first + 1
+        hi = last if bounds[last + 1] <= stop else last - 1
+        if lo <= hi:
+            self.values[lo:hi + 1] = stage
+            for k in list(self._partial_in(lo, hi)):
+                del self.partial[k]
+        # Partly edited epochs (first and / or last one) :
+        for k in [k for k in {first, last} if not lo <= k <= hi]:
+            samples = self._epoch_samples(k)
+            samples[max(start, bounds[k]) - bounds[k]:min(
+                stop, bounds[k + 1]) - bounds[k]] = stage
+            self._set_epoch(k, samples)
+        return start, stop
+
+    def mask(self, stages):
+        """Get the samples scored in some stages.
+
+        Args:
+            stages: list
+                List of stages.
+
+        Returns:
+            mask: np.ndarray
+                Boolean vector of shape (npts,).
+        """
+        mask = np.repeat(np.isin(self.values, stages), np.diff(self._bounds))
+        for k, samples in self.partial.items():
+            mask[self._bounds[k]:self._bounds[k + 1]] = np.isin(samples,
+                                                                stages)
+        return mask
+
+    def resize(self, npts):
+        """Get a copy with a different number of samples.
+
+        Added samples are scored as wake.
+        """
+        n_epochs = max(1, int(np.ceil((npts - self.offset) / self.epoch)))
+        values = np.zeros((n_epochs,), dtype=np.int8)
+        n = min(n_epochs, len(self.values))
+        values[:n] = self.values[:n]
+        hypno = EpochHypno(values, self.epoch, npts, self.offset)
+        # Partial epochs and last epoch (cut or extended with wake) :
+        for k in set(self.partial) | {len(self.values) - 1}:
+            if k < n_epochs:
+                old = self._epoch_samples(k)
+                samples = np.zeros((hypno._bounds[k + 1] - hypno._bounds[k],),
+                                   dtype=np.int8)
+                n = min(len(samples), len(old))
+                samples[:n] = old[:n]
+                hypno._set_epoch(k, samples)
+        return hypno
+
+    def resample(self, ratio, npts):
+        """Get a resampled copy.
+
+        Args:
+            ratio: float
+                Ratio between the old and the new sampling frequency.
+
+            npts: int
+                Number of samples of the resampled hypnogram.
+        """
+        hypno = EpochHypno(self.values.copy(), self.epoch / ratio, npts,
+                           self.offset / ratio)
+        for k, samples in self.partial.items():
+            idx = np.floor(np.arange(hypno._bounds[k], hypno._bounds[k + 1]) *
+                           ratio).astype(int) - self._bounds[k]
+            hypno._set_epoch(k, samples[np.clip(idx, 0, len(samples) - 1)])
+        return hypno
+
+    def copy(self):
+        """Get a copy of the hypnogram."""
+        return EpochHypno(self.values.copy(), self.epoch, self.npts,
+                          self.offset, self.partial)
+
+    def _partial_in(self, first, last):
+        """Get the partial epochs in [first, last]."""
+        return [k for k in self.partial if first <= k <= last]
+
+    def _epoch_samples(self, k):
+        """Get a copy of the stage of each sample of an epoch."""
+        if k in self.partial:
+            return self.partial[k].copy()
+        return np.full((self._bounds[k + 1] - self._bounds[k],),
+                       self.values[k], dtype=np.int8)
+
+    def _set_epoch(self, k, samples):
+        """Set the stage of each sample of an epoch."""
+        self.partial.pop(k, None)
+        if len(samples):
+            self.values[k] = samples[0]
+            if np.any(samples != samples[0]):
+                self.partial[k] = samples
+
+    def _expand(self, start, stop):
+        """Get the stage of samples in [start, stop[."""
+        if stop <= start:
+            return np.array([], dtype=np.int8)
+        first, last = self.index([start, stop - 1])
+        bounds = self._bounds[first:last + 2].copy()
+        bounds[0], bounds[-1] = start, stop
+        hypno = np.repeat(self.values[first:last + 1], np.diff(bounds))
+        for k in self._partial_in(first, last):
+            b0, b1 = max(self._bounds[k], start), min(self._bounds[k + 1],
+                                                      stop)
+            hypno[b0 - start:b1 - start] = self.partial[k][
+                b0 - self._bounds[k]:b1 - self._bounds[k]]
+        return hypno
@@ -0,0 +1,338 @@
+"""Lazy access to sleep recordings stored on disk.
+
+The classes below behave like a (n_channels, n_points) float32 array but only
+read (and scale) the channels and time points that are requested. This allows
+to browse recordings that do not fit in memory :
+- LazyData : base class (shape, slicing, reductions)
+- MemmapData : raw data already organized as a 2D memmap (ELAN, BrainVision)
+- EdfData : data read through the Edf class
+- DecimatedData : anti-aliased downsampling of another LazyData
+"""
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from ..filtering import _resample_ratio, _resample_filter, _resample_range
+
+__all__ = ['LazyData', 'MemmapData', 'EdfData', 'DecimatedData']
+
+
+class LazyData(ABC):
+    """Array-like object for data that are read on demand.
+
+    Subclasses only have to implement the _read(chan, start, stop) method
+    which returns the scaled float32 data of the channels chan between the
+    native time points start and stop.
+
+    Args:
+        n_channels: int
+            Number of channels.
+
+        n_points: int
+            Number of time points.
+
+    Kargs:
+        chunk: int, optional, (def: 2 ** 22)
+            Number of values (n_channels * n_points) read at once when the
+            whole recording has to be scanned.
+    """
+
+    ndim = 2
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, n_channels, n_points, chunk=2 ** 22):
+        """Init."""
+        self._nchan = int(n_channels)
+        self._npts = int(n_points)
+        self._chunk = int(chunk)
+        self._info = None
+
+    @abstractmethod
+    def _read(self, chan, start, stop):
+        """Read data of channels chan between points start and stop."""
+
+    # ----------- SHAPE -----------
+    @property
+    def shape(self):
+        """Get the shape of the data."""
+        return (self._nchan, self._npts)
+
+    @property
+    def size(self):
+        """Get the number of elements."""
+        return self.shape[0] * self.shape[1]
+
+    def __len__(self):
+        """Return the number of channels."""
+        return self._nchan
+
+    # ----------- SLICING -----------
+    def __getitem__(self, key):
+        """Read data for a (channel, time) selection."""
+        # Split channel / time keys :
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 2 or sum(k is Ellipsis for k in key) > 1:
+            raise IndexError("Too many indices for a 2D data array")
+        if key[0] is Ellipsis:
+            key = (slice(None),) * (3 - len(key)) + key[1:]
+        key = tuple(slice(None) if k is Ellipsis else k for k in key)
+        key += (slice(None),) * (2 - len(key))
+        chan, sl, squeeze = self._check_key(*key)
+
+        # Empty selection :
+        n_out = len(range(sl.start, sl.stop, sl.step))
+        if not len(chan) or not n_out:
+            data = np.zeros((len(chan), n_out), dtype=self.dtype)
+        else:
+            stop = sl.start + (n_out - 1) * sl.step + 1
+            data = self._read(chan, sl.start, stop)[:, ::sl.step]
+
+        # Drop dimensions indexed with an integer :
+        if squeeze[1]:
+            data = data[:, 0]
+        if squeeze[0]:
+            data = data[0, ...]
+        return data
+
+    def _check_key(self, chan, time):
+        """Convert channel and time keys into indices and slice."""
+        nchan, npts = self.shape
+        squeeze = [False, False]
+
+        # ============= CHANNELS =============
+        if isinstance(chan, (int, np.integer)):
+            if not -nchan <= chan < nchan:
+                raise IndexError("Channel index out of range")
+            chan, squeeze[0] = np.array([chan % nchan]), True
+        elif isinstance(chan, slice):
+            chan = np.arange(nchan)[chan]
+        else:
+            chan = np.asarray(chan)
+            if chan.dtype == bool:
+                chan = np.flatnonzero(chan)
+            chan = chan.astype(int) % nchan
+
+        # ============= TIME =============
+        if isinstance(time, (int, np.integer)):
+            if not -npts <= time < npts:
+                raise IndexError("Time index out of range")
+            time = time % npts
+            time, squeeze[1] = slice(time, time + 1, 1), True
+        elif isinstance(time, slice):
+            start, stop, step = time.indices(npts)
+            if step < 0:
+                raise IndexError("Negative steps are not supported")
+            time = slice(start, max(start, stop), step)
+        else:
+            raise IndexError("Time must be selected with an integer or a "
+                             "slice")
+
+        return chan, time, squeeze
+
+    def __array__(self, dtype=None, copy=None):
+        """Read the entire data (block by block in a preallocated array)."""
+        nchan, npts = self.shape
+        data = np.empty((nchan, npts), dtype=self.dtype)
+        chunk = max(1, self._chunk // max(nchan, 1))
+        for k in range(0, npts, chunk):
+            data[:, k:k + chunk] = self[:, k:k + chunk]
+        return data if dtype is None else data.astype(dtype, copy=False)
+
+    # ----------- DECIMATION -----------
+    def decimate(self, sf, ds_freq, window=('kaiser', 5.0)):
+        """Get an anti-aliased downsampled version of the data.
+
+        Nothing is read : the returned object shares the same file and
+        resamples the requested points on the fly (see filtering.decimate).
+
+        Args:
+            sf: float
+                The sampling frequency of the data.
+
+            ds_freq: float
+                The downsampling frequency.
+
+        Kargs:
+            window: string/tuple/np.ndarray, optional, (def: ('kaiser', 5.0))
+                Window used to design the anti-aliasing filter or directly
+                the FIR coefficients.
+
+        Returns:
+            data: DecimatedData
+                The downsampled lazy data.
+        """
+        return DecimatedData(self, sf, ds_freq, window=window,
+                             chunk=self._chunk)
+
+    # ----------- REDUCTIONS -----------
+    def _get_info(self):
+        """Get min, max, mean and std of each channel in a single pass."""
+        if self._info is None:
+            nchan, npts = self.shape
+            vmin = np.full((nchan,), np.inf)
+            vmax = np.full((nchan,), -np.inf)
+            vsum, vsq = np.zeros((nchan,)), np.zeros((nchan,))
+            chunk = max(1, self._chunk // max(nchan, 1))
+            for k in range(0, npts, chunk):
+                data = self[:, k:k + chunk].astype(np.float64)
+                np.minimum(vmin, data.min(1), out=vmin)
+                np.maximum(vmax, data.max(1), out=vmax)
+                vsum += data.sum(1)
+                vsq += np.square(data).sum(1)
+            mean = vsum / npts
+            std = np.sqrt(np.maximum(vsq / npts - np.square(mean), 0.))
+            self._info = {'min': vmin, 'max': vmax, 'mean': mean, 'std': std}
+        return self._info
+
+    def _reduce(self, name, axis):
+        """Return a reduction over time (axis=1) or over all data."""
+        val = self._get_info()[name]
+        if axis in [1, -1]:
+            return val.astype(self.dtype)
+        elif axis is None:
+            if name == 'min':
+                return self.dtype.type(val.min())
+            elif name == 'max':
+                return self.dtype.type(val.max())
+            elif name == 'mean':
+                return self.dtype.type(val.mean())
+            elif name == 'std':
+                mean = self._get_info()['mean']
+                var = np.square(val) + np.square(mean - mean.mean())
+                return self.dtype.type(np.sqrt(var.mean()))
+        raise ValueError("Lazy data can only be reduced along the time axis")
+
+    def min(self, axis=None):
+        """Minimum of the data."""
+        return self._reduce('min', axis)
+
+    def max(self, axis=None):
+        """Maximum of the data."""
+        return self._reduce('max', axis)
+
+    def mean(self, axis=None):
+        """Mean of the data."""
+        return self._reduce('mean', axis)
+
+    def std(self, axis=None):
+        """Standard deviation of the data."""
+        return self._reduce('std', axis)
+
+
+class MemmapData(LazyData):
+    """Lazy data from a raw 2D memmap.
+
+    Args:
+        raw: np.memmap
+            The raw data organized as (n_channels, n_points). Could either be
+            stored channel by channel (C order) or point by point (F order).
+
+    Kargs:
+        gain: np.ndarray, optional, (def: None)
+            Gain of each channel in raw. Row vector of shape (n_channels,).
+
+        chan: np.ndarray, optional, (def: None)
+            Indices of the channels in raw to use. If None, all channels are
+            used.
+
+        kwargs: dict, optional
+            Further arguments are passed to LazyData.
+    """
+
+    def __init__(self, raw, gain=None, chan=None, **kwargs):
+        """Init."""
+        self._raw = raw
+        self._chan = np.arange(raw.shape[0]) if chan is None else np.asarray(
+            chan, dtype=int)
+        self._gain = np.ones((raw.shape[0],)) if gain is None else np.asarray(
+            gain)
+        LazyData.__init__(self, len(self._chan), raw.shape[1], **kwargs)
+
+    def _read(self, chan, start, stop):
+        """Read and scale raw data."""
+        idx = self._chan[chan]
+        # Use a view on the memmap for consecutive channels :
+        if len(idx) and np.all(np.diff(idx) == 1):
+            raw = self._raw[idx[0]:idx[-1] + 1, start:stop]
+        else:
+            raw = self._raw[idx, start:stop]
+        gain = self._gain[idx, np.newaxis].astype(np.float32)
+        data = np.empty(raw.shape, dtype=np.float32)
+        np.multiply(raw, gain, out=data, casting='unsafe')
+        return data
+
+
+class EdfData(LazyData):
+    """Lazy data from an EDF file.
+
+    Args:
+        edf: Edf
+            The Edf object (preferably using memmap=True).
+
+        chan: list
+            List of channels (names or indices) to use.
+
+        n_points: int
+            Number of time points.
+
+    Kargs:
+        kwargs: dict, optional
+            Further arguments are passed to LazyData.
+    """
+
+    def __init__(self, edf, chan, n_points, **kwargs):
+        """Init."""
+        self._edf = edf
+        self._chan = list(chan)
+        LazyData.__init__(self, len(self._chan), n_points, **kwargs)
+
+    def _read(self, chan, start, stop):
+        """Read and calibrate EDF data."""
+        return self._edf.return_dat([self._chan[k] for k in chan], start,
+                                    stop, dtype=np.float32)
+
+
+class DecimatedData(LazyData):
+    """Lazy anti-aliased downsampling of another LazyData.
+
+    Args:
+        data: LazyData
+            The data to downsample.
+
+        sf: float
+            The sampling frequency of data.
+
+        ds_freq: float
+            The downsampling frequency.
+
+    Kargs:
+        window: string/tuple/np.ndarray, optional, (def: ('kaiser', 5.0))
+            Window used to design the anti-aliasing filter or directly the FIR
+            coefficients.
+
+        kwargs: dict, optional
+            Further arguments are passed to LazyData.
+    """
+
+    def __init__(self, data, sf, ds_freq, window=('kaiser', 5.0), **kwargs):
+        """Init."""
+        self._data = data
+        self._up, self._down = _resample_ratio(sf, ds_freq)
+        self._h = None
+        if self._up != self._down:
+            self._h = _resample_filter(self._up, self._down, window)
+        n_points = -(-data.shape[1] * self._up // self._down)
+        LazyData.__init__(self, data.shape[0], n_points, **kwargs)
+
+    def _read(self, chan, start, stop):
+        """Read and resample data."""
+        if self._h is None:
+            return self._data[chan, start:stop]
+
+        def read(a, b):
+            return self._data[chan, a:b]
+
+        data = _resample_range(read, self._data.shape[1], self._up,
+                               self._down, self._h, start, stop)
+        return data.astype(np.float32)
@@ -0,0 +1,547 @@
+"""Streaming (chunk by chunk) detection of sleep events.
+
+The functions of the detection module need the entire signal and use global
+statistics (mean / std over the whole night). The detectors defined here are
+stateful objects fed with consecutive chunks of a signal :
+
+    >>> det = SpindlesStream(sf=100., threshold=2.)
+    >>> for chunk in chunks:
+    >>>     events = det.feed(chunk)
+    >>> events = det.finalize()
+
+Filters keep their state across chunks, thresholds are computed from running
+(mean / std) or robust (median / MAD) statistics and events are emitted as
+soon as they are over, as an array of intervals of shape (n_events, 2) with
+the first and last (excluded) sample of each event (absolute sample index,
+counted from the first chunk). Memory usage only depends on the chunk size so
+that detection can be performed on files larger than RAM (see the run method)
+or on data arriving from an acquisition device.
+"""
+from abc import ABC, abstractmethod
+
+import numpy as np
+from scipy.signal import sosfilt, sosfilt_zi, lfilter, hilbert
+from scipy.fftpack import next_fast_len
+
+from .detection import _peak_lookahead, _peak_state, _peak_scan
+from ..filtering import _filter_design
+
+__all__ = ['SpindlesStream', 'RemStream', 'PeakStream']
+
+
+###########################################################################
+# STATISTICS
+###########################################################################
+
+class _RunningStats(object):
+    """Running statistics used to define the detection threshold.
+
+    Args:
+        method: string, optional, (def: 'running')
+            Use either 'running' (mean + threshold * std, updated with
+            Welford's algorithm) or 'robust' (median + threshold * MAD,
+            estimated on a fixed size random reservoir of samples).
+
+        size: int, optional, (def: 2**16)
+            Size of the reservoir for robust statistics.
+    """
+
+    def __init__(self, method='running', size=2 ** 16):
+        """Init."""
+        if method not in ['running', 'robust']:
+            raise ValueError("Statistics method must be 'running' or "
+                             "'robust'")
+        self.method = method
+        self.n, self._mean, self._m2 = 0, 0., 0.
+        self._res = np.zeros((size,), dtype=np.float64)
+        self._rng = np.random.RandomState(0)
+
+    def update(self, x):
+        """Update statistics with a new set of values."""
+        x = np.asarray(x, dtype=np.float64).ravel()
+        nb = x.size
+        if not nb:
+            return
+        if self.method == 'running':
+            # Combine (count, mean, M2) of both sets :
+            n = self.n + nb
+            mb = x.mean()
+            delta = mb - self._mean
+            self._m2 += ((x - mb) ** 2).sum() + delta ** 2 * self.n * nb / n
+            self._mean += delta * nb / n
+        else:
+            # Fill the reservoir, then randomly replace its values :
+            size = self._res.size
+            fill = max(0, min(nb, size - self.n))
+            self._res[self.n:self.n + fill] = x[:fill]
+            seen = self.n + fill + 1 + np.arange(nb - fill)
+            j = (self._rng.rand(nb - fill) * seen).astype(int)
+            keep = j < size
+            self._res[j[keep]] = x[fill:][keep]
+            n = self.n + nb
+        self.n = n
+
+    def threshold(self, k):
+        """Get the threshold center + k * dispersion."""
+        if not self.n:
+            return np.inf
+        if self.method == 'running':
+            return self._mean + k * np.sqrt(self._m2 / self.n)
+        res = self._res[:min(self.n, self._res.size)]
+        med = np.median(res)
+        return med + k * 1.4826 * np.median(np.abs(res - med))
+
+
+###########################################################################
+# THRESHOLD DETECTOR
+###########################################################################
+
+class _StreamDetector(ABC):
+    """Base class for threshold based streaming detectors.
+
+    Subclasses transform each chunk into a detection signal (the
+    _transform method) and send it to _push, with a boolean mask of the
+    samples to consider. Supra-threshold runs of samples are tracked across
+    chunks and emitted as intervals when they are over.
+
+    Args:
+        sf: float
+            The sampling frequency.
+
+        threshold: float
+            Number of dispersions (std or MAD) above the center (mean or
+            median) of the detection signal.
+
+    Kargs:
+        stats: string, optional, (def: 'running')
+            Use either 'running' or 'robust' statistics (see _RunningStats).
+
+        warmup: float, optional, (def: 60.)
+            Minimum duration (in seconds) of valid signal before taking any
+            decision. Until then, the detection signal is kept in memory.
+    """
+
+    def __init__(self, sf, threshold, stats='running', warmup=60.):
+        """Init."""
+        self.sf = float(sf)
+        self.threshold = threshold
+        self._stats = _RunningStats(stats)
+        self._nwarm = int(warmup * sf)
+        self._warm = []
+        self._nout = 0
+        self._run = None
+        self._events = []
+        self._length = 0
+        self._closed = False
+
+    def __len__(self):
+        """Return the number of detected events."""
+        return sum([len(k) for k in self._events])
+
+    # ----------- FEED / FINALIZE -----------
+    def feed(self, chunk, hypno=None):
+        """Feed the detector with the next chunk of signal.
+
+        Args:
+            chunk: np.ndarray
+                Consecutive samples of the signal.
+
+        Kargs:
+            hypno: np.ndarray, optional, (def: None)
+                Hypnogram values of the chunk (same length).
+
+        Returns:
+            events: np.ndarray
+                Array of shape (n_events, 2) of the events ending in the
+                samples available so far.
+        """
+        if self._closed:
+            raise ValueError("Detector already finalized.")
+        chunk = np.asarray(chunk, dtype=np.float64).ravel()
+        if hypno is not None:
+            hypno = np.asarray(hypno).ravel()
+            if hypno.size != chunk.size:
+                raise ValueError("chunk and hypno must have the same length")
+        return self._push(*self._transform(chunk, hypno))
+
+    def finalize(self):
+        """Flush the remaining samples and close the last event.
+
+        Returns:
+            events: np.ndarray
+                Array of shape (n_events, 2) of the last events.
+        """
+        if self._closed:
+            return np.zeros((0, 2), dtype=int)
+        x, mask = self._transform(None, None)
+        events = [self._push(x, mask, True)]
+        # Close an event lasting until the end of the signal :
+        if self._run is not None:
+            events.append(self._select(np.array([[self._run, self._nout]])))
+            self._run = None
+        self._closed = True
+        events = np.concatenate(events)
+        self._events.append(events)
+        return events
+
+    def run(self, data, hypno=None, chunk=2 ** 20):
+        """Run the detection on an entire signal, chunk by chunk.
+
+        Args:
+            data: array_like
+                The signal (vector). Anything supporting slicing (e.g. a row
+                of a memory map) is read one chunk at a time.
+
+        Kargs:
+            hypno: array_like, optional, (def: None)
+                The hypnogram (same length as data).
+
+            chunk: int, optional, (def: 2**20)
+                Number of samples per chunk.
+
+        Returns:
+            events: np.ndarray
+                Array of shape (n_events, 2) of all the detected events.
+        """
+        for k in range(0, len(data), chunk):
+            hyp = None if hypno is None else hypno[k:k + chunk]
+            self.feed(data[k:k + chunk], hyp)
+        self.finalize()
+        return self.events
+
+    # ----------- RESULTS -----------
+    @property
+    def events(self):
+        """Get all the events emitted so far."""
+        if not self._events:
+            return np.zeros((0, 2), dtype=int)
+        return np.concatenate(self._events)
+
+    @property
+    def number(self):
+        """Get the number of events emitted so far."""
+        return len(self)
+
+    @property
+    def density(self):
+        """Get the number of events per minute of valid signal."""
+        if not self._length:
+            return 0.
+        return len(self) / (self._length / self.sf / 60.)
+
+    # ----------- THRESHOLDING -----------
+    @abstractmethod
+    def _transform(self, chunk, hypno):
+        """Get the detection signal and mask of a chunk (None to flush)."""
+
+    def _select(self, events):
+        """Select events among supra-threshold intervals."""
+        return events
+
+    def _push(self, x, mask, flush=False):
+        """Threshold the detection signal starting at sample self._nout."""
+        self._stats.update(x[mask])
+        self._length += np.count_nonzero(mask)
+        # Keep the signal until enough samples have been seen :
+        if self._nwarm:
+            self._warm.append((x, mask))
+            if (self._stats.n < self._nwarm) and not flush:
+                return np.zeros((0, 2), dtype=int)
+            x = np.concatenate([k[0] for k in self._warm])
+            mask = np.concatenate([k[1] for k in self._warm])
+            self._warm, self._nwarm = [], 0
+        thr = self._stats.threshold(self.threshold)
+        sup = np.r_[self._run is not None, (x > thr) & mask].astype(np.int8)
+        # Find where runs start / stop :
+        d = np.diff(sup)
+        starts = np.flatnonzero(d == 1) + self._nout
+        stops = np.flatnonzero(d == -1) + self._nout
+        if self._run is not None:
+            starts = np.r_[self._run, starts]
+        self._run = starts[-1] if len(starts) > len(stops) else None
+        self._nout += len(x)
+        events = self._select(np.c_[starts[:len(stops)], stops].astype(int))
+        if not flush:
+            self._events.append(events)
+        return events
+
+
+###########################################################################
+# SPINDLES
+###########################################################################
+
+class SpindlesStream(_StreamDetector):
+    """Streaming spindles detection.
+
+    The signal is bandpass filtered (causal filter, state kept across
+    chunks) and the amplitude is obtained using the Hilbert transform on
+    overlapping blocks. Spindles are the supra-threshold runs of the
+    amplitude with a proper duration. Because of the causal filter, events
+    are delayed by the group delay of the filter (about 400 ms for the
+    default 12-14 Hz band) compared with spindlesdetect.
+
+    Args:
+        sf: float
+            The sampling frequency.
+
+        threshold: float
+            Number of dispersions above the center of the amplitude.
+
+    Kargs:
+        nrem_only: bool, optional, (def: True)
+            Only consider NREM sleep (requires the hypnogram in feed).
+
+        min_freq, max_freq: float, optional, (def: 12., 14.)
+            Spindles frequency band.
+
+        min_dur_ms, max_dur_ms: float, optional, (def: 500., 1500.)
+            Spindles minimum and maximum duration (ms).
+
+        order: int, optional, (def: 4)
+            Order of the bandpass filter.
+
+        pad: float, optional, (def: 1.)
+            Duration (s) of the overlap of the Hilbert transform. Amplitude
+            is emitted with this delay.
+
+        stats, warmup:
+            See _StreamDetector.
+    """
+
+    def __init__(self, sf, threshold, nrem_only=True, min_freq=12.,
+                 max_freq=14., min_dur_ms=500., max_dur_ms=1500., order=4,
+                 pad=1., stats='running', warmup=60.):
+        """Init."""
+        _StreamDetector.__init__(self, sf, threshold, stats, warmup)
+        self.nrem_only = nrem_only
+        self._dur = (min_dur_ms * sf / 1000., max_dur_ms * sf / 1000.)
+        # Filter design and state :
+        self._sos = _filter_design(float(sf), (float(min_freq),
+                                               float(max_freq)), 'bandpass',
+                                   int(order), 'butterworth')
+        self._zi = None
+        # Filtered signal (context + pending samples) :
+        self._pad = max(1, int(pad * sf))
+        self._buf = np.zeros((0,), dtype=np.float64)
+        self._mbuf = np.zeros((0,), dtype=bool)
+        self._ctx = 0
+
+    def _transform(self, chunk, hypno):
+        """Filter the chunk and get the amplitude of pending samples."""
+        if chunk is not None:
+            if self._zi is None:
+                self._zi = sosfilt_zi(self._sos) * chunk[:1]
+            xf, self._zi = sosfilt(self._sos, chunk, zi=self._zi)
+            mask = np.ones((chunk.size,), dtype=bool)
+            if self.nrem_only and hypno is not None:
+                mask = np.logical_and(hypno >= 1, hypno != 4)
+            self._buf = np.r_[self._buf, xf]
+            self._mbuf = np.r_[self._mbuf, mask]
+            stop = len(self._buf) - self._pad
+        else:
+            stop = len(self._buf)
+        if stop <= self._ctx:
+            return np.zeros((0,)), np.zeros((0,), dtype=bool)
+        # Amplitude of the analytic signal :
+        n = len(self._buf)
+        amp = np.abs(hilbert(self._buf, next_fast_len(n))[:n])
+        x, mask = amp[self._ctx:stop], self._mbuf[self._ctx:stop]
+        # Keep pad samples before the next pending one :
+        start = max(0, stop - self._pad)
+        self._buf, self._mbuf = self._buf[start:], self._mbuf[start:]
+        self._ctx = stop - start
+        return x, mask
+
+    def _select(self, events):
+        """Only keep events with a proper duration."""
+        dur = events[:, 1] - events[:, 0]
+        return events[(dur > self._dur[0]) & (dur < self._dur[1]), :]
+
+
+###########################################################################
+# REM
+###########################################################################
+
+class RemStream(_StreamDetector):
+    """Streaming rapid eye movements detection.
+
+    The detection signal is the smoothed absolute derivative of the smoothed
+    EOG, as in remdetect. Centered moving averages and derivative are
+    computed with causal filters and events are realigned, so that the
+    detection signal is the one of remdetect and only the threshold (running
+    statistics) differs. With a warmup covering the whole signal, events are
+    the ones of remdetect.
+
+    Args:
+        sf: float
+            The sampling frequency.
+
+        threshold: float
+            Number of dispersions above the center of the derivative.
+
+    Kargs:
+        rem_only: bool, optional, (def: True)
+            Only consider REM sleep (requires the hypnogram in feed).
+
+        moving_ms: int, optional, (def: 100)
+            Time (ms) window of the moving average.
+
+        deriv_ms: int, optional, (def: 40)
+            Time (ms) window of derivative computation.
+
+        stats, warmup:
+            See _StreamDetector.
+    """
+
+    def __init__(self, sf, threshold, rem_only=True, moving_ms=100,
+                 deriv_ms=40, stats='running', warmup=60.):
+        """Init."""
+        _StreamDetector.__init__(self, sf, threshold, stats, warmup)
+        self.rem_only = rem_only
+        win = max(1, int(moving_ms / (1000 / sf)))
+        self._step = int(deriv_ms / (1000 / sf))
+        self._w = np.repeat(1.0, win) / win
+        self._zi1 = np.zeros((win - 1,))
+        self._zi2 = np.zeros((win - 1,))
+        self._prev = np.zeros((self._step,))
+        # Delay of the centered moving average and of the causal chain :
+        self._o = (win - 1) // 2
+        self._delay = 2 * self._o + self._step - self._step // 2
+        self._mtail = np.zeros((self._delay,), dtype=bool)
+        self._nin = 0
+        self._ncausal = 0
+        self._first = True
+
+    def _transform(self, chunk, hypno):
+        """Get the smoothed derivative of the chunk."""
+        flush = chunk is None
+        if flush:
+            # Flush with zeros (zero padding of the centered filters) :
+            chunk = np.zeros((self._delay,))
+            mask = np.zeros((self._delay,), dtype=bool)
+        else:
+            self._nin += chunk.size
+            mask = np.ones((chunk.size,), dtype=bool)
+            if self.rem_only and hypno is not None:
+                chunk = chunk.copy()
+                chunk[hypno < 4] = 0
+                mask = chunk != 0
+        # Moving average and derivative :
+        sm, self._zi1 = lfilter(self._w, 1., chunk, zi=self._zi1)
+        sm = np.r_[self._prev, sm]
+        deriv = np.abs(sm[self._step:] - sm[:-self._step or None])
+        self._prev = sm[len(sm) - self._step:]
+        # As remdetect, the derivative is zero where one of the centered
+        # averages is out of the signal :
+        t = self._ncausal + np.arange(len(deriv))
+        deriv[(t < self._step + self._o) | (t >= self._nin + self._o)] = 0.
+        # Moving average of the derivative :
+        deriv, self._zi2 = lfilter(self._w, 1., deriv, zi=self._zi2)
+        # Delay the mask :
+        mask = np.r_[self._mtail, mask]
+        self._mtail = mask[len(mask) - self._delay:]
+        mask = mask[:len(deriv)]
+        # Drop the samples located before the first input sample :
+        skip = max(0, min(len(deriv), self._delay - self._ncausal))
+        self._ncausal += len(deriv)
+        # With an odd step, the derivative of remdetect is one sample short :
+        stop = len(deriv) - (self._step % 2 if flush else 0)
+        return deriv[skip:stop], mask[skip:stop]
+
+    def _select(self, events):
+        """Remove the first supra-threshold sample (false positive)."""
+        if self._first and len(events):
+            self._first = False
+            events = events.copy()
+            events[0, 0] += 1
+            events = events[events[:, 1] > events[:, 0], :]
+        return events
+
+
+###########################################################################
+# PEAKS
+###########################################################################
+
+class PeakStream(object):
+    """Streaming peak detection.
+
+    Equivalent to peakdetect applied on the concatenation of all chunks.
+    Only the samples following the last peak candidate are kept in memory.
+
+    Args:
+        lookahead: int, optional, (def: 200)
+            Distance to look ahead from a peak candidate to determine if it
+            is the actual peak.
+
+        delta: float, optional, (def: 0)
+            Minimum difference between a peak and the following points.
+    """
+
+    def __init__(self, lookahead=200, delta=0):
+        """Init."""
+        if lookahead < 1:
+            raise ValueError("Lookahead must be '1' or above in value")
+        if not (np.isscalar(delta) and delta >= 0):
+            raise ValueError("delta must be a positive number")
+        self.lookahead, self.delta = int(lookahead), delta
+        self._buf = np.zeros((0,), dtype=np.float64)
+        self._offset = 0
+        self._state = _peak_state()
+        self._first = True
+        self.max_peaks, self.min_peaks = [], []
+
+    def feed(self, chunk):
+        """Feed the detector with the next chunk of signal.
+
+        Args:
+            chunk: np.ndarray
+                Consecutive samples of the signal.
+
+        Returns:
+            max_peaks, min_peaks: list
+                Lists of [sample, value] of new peaks.
+        """
+        y = self._buf = np.r_[self._buf, np.asarray(chunk,
+                                                    dtype=np.float64).ravel()]
+        fmax, fmin = _peak_lookahead(y, self.lookahead)
+        st = self._state
+        peaks = _peak_scan(y, fmax, fmin, len(y) - self.lookahead, self.delta,
+                           st)
+        # Remove the false hit on the first value :
+        if self._first and peaks:
+            peaks, self._first = peaks[1:], False
+        o = self._offset
+        mx = [[o + k, y[k]] for k, is_max in peaks if is_max]
+        mn = [[o + k, y[k]] for k, is_max in peaks if not is_max]
+        self.max_peaks += mx
+        self.min_peaks += mn
+        # Only keep samples from the current peak candidates :
+        cut = min([st['i']] + [st[k] for k in ['mxpos', 'mnpos'] if st[
+            k] is not None])
+        self._buf, self._offset = y[cut:], o + cut
+        st['i'] -= cut
+        for k in ['mxpos', 'mnpos']:
+            if st[k] is not None:
+                st[k] -= cut
+        return mx, mn
+
+    def finalize(self):
+        """Finalize the detection.
+
+        Peaks need lookahead points after them, so no peak can be found in
+        the remaining samples.
+        """
+        self._buf = np.zeros((0,), dtype=np.float64)
+        return [], []
+
+    def run(self, data, chunk=2 ** 20):
+        """Run the detection on an entire signal, chunk by chunk.
+
+        Returns:
+            max_peaks, min_peaks: list
+                Lists of [sample, value] of all the peaks.
+        """
+        for k in range(0, len(data), chunk):
+            self.feed(data[k:k + chunk])
+        self.finalize()
+        return [self.max_peaks, self.min_peaks]
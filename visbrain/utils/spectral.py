@@ -0,0 +1,178 @@
+"""Spectral estimation of (multi-channel) signals.
+
+Spectrograms are computed for all channels at once, by blocks of time
+segments, using one of the following estimators :
+- 'hamming' : periodogram of each segment (Hamming window)
+- 'welch' : average of periodograms of overlapping sub-segments
+- 'multitaper' : average of periodograms using DPSS (Slepian) tapers
+
+Tapers are cached and computations are performed in float32.
+"""
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy.signal import get_window
+from scipy.signal.windows import dpss
+try:
+    # Single precision FFT :
+    from scipy.fft import rfft, rfftfreq
+except ImportError:
+    from numpy.fft import rfft, rfftfreq
+
+__all__ = ['spectrogram']
+
+
+def spectrogram(x, sf, nperseg, noverlap=None, method='hamming', nw=4.,
+                n_tapers=None, nsub=None, chunk=2 ** 24, n_jobs=1, axis=-1):
+    """Compute the spectrogram (power spectral density) of signals.
+
+    Args:
+        x: np.ndarray
+            The signal(s).
+
+        sf: float
+            The sampling frequency.
+
+        nperseg: int
+            Number of points per time segment.
+
+    Kargs:
+        noverlap: int, optional, (def: None)
+            Number of overlapping points between segments. If None,
+            nperseg // 8 is used.
+
+        method: string, optional, (def: 'hamming')
+            Spectral estimator. Use either 'hamming', 'welch' or
+            'multitaper'.
+
+        nw: float, optional, (def: 4.)
+            Time half bandwidth product of the DPSS tapers (multitaper).
+
+        n_tapers: int, optional, (def: None)
+            Number of DPSS tapers (multitaper). If None, 2 * nw - 1 tapers
+            are used.
+
+        nsub: int, optional, (def: None)
+            Number of points of the sub-segments, overlapping by half
+            (welch). If None, nperseg // 4 is used.
+
+        chunk: int, optional, (def: 2**24)
+            Maximum number of values (channels * segments * tapers * points)
+            transformed at once.
+
+        n_jobs: int, optional, (def: 1)
+            Number of processes used to split the blocks of segments.
+
+        axis: int, optional, (def: -1)
+            Time axis of x.
+
+    Returns:
+        freq: np.ndarray
+            Frequency vector.
+
+        t: np.ndarray
+            Time of the center of each segment.
+
+        power: np.ndarray
+            Power spectral density (float32) of shape x.shape[:-1] +
+            (n_freqs, n_segments) (time axis moved at the end).
+    """
+    x = np.moveaxis(np.asarray(x, dtype=np.float32), axis, -1)
+    n = x.shape[-1]
+    if noverlap is None:
+        noverlap = nperseg // 8
+    step = nperseg - noverlap
+    nseg = max(0, (n - noverlap) // step)
+    if method not in ['hamming', 'welch', 'multitaper']:
+        raise ValueError("method must be 'hamming', 'welch' or 'multitaper'")
+    args = (sf, nperseg, step, method, nw, n_tapers, nsub)
+    tapers, _ = _get_tapers(nperseg, method, nw, n_tapers, nsub)
+
+    # Split segments into blocks :
+    nchan = int(np.prod(x.shape[:-1]))
+    per_seg = nchan * nperseg * (len(tapers) if method != 'welch' else 2)
+    bsize = max(1, chunk // per_seg)
+    blocks = [x[..., k * step:(min(nseg, k + bsize) - 1) * step + nperseg]
+              for k in range(0, nseg, bsize)]
+    if (n_jobs > 1) and (len(blocks) > 1):
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            power = list(executor.map(_spectral_block, blocks,
+                                      *[[k] * len(blocks) for k in args]))
+    else:
+        power = [_spectral_block(k, *args) for k in blocks]
+
+    # Frequency and time vectors :
+    nfft = nperseg if method != 'welch' else len(tapers[0])
+    freq = rfftfreq(nfft, 1. / sf)
+    t = (nperseg / 2. + np.arange(nseg) * step) / sf
+    if not power:
+        power = np.zeros(x.shape[:-1] + (len(freq), 0), dtype=np.float32)
+    else:
+        power = np.concatenate(power, axis=-1)
+    return freq, t, power
+
+
+@lru_cache(maxsize=16)
+def _get_tapers(nperseg, method, nw=4., n_tapers=None, nsub=None):
+    """Get the tapers of a spectral estimator.
+
+    Returns:
+        tapers: np.ndarray
+            Array of tapers of shape (n_tapers, n_points) (float32).
+
+        scale: float
+            Scaling factor of the squared magnitude of the FFT (density,
+            without the sampling frequency).
+    """
+    if method == 'hamming':
+        tapers = get_window('hamming', nperseg)[np.newaxis, :]
+    elif method == 'welch':
+        nsub = nperseg // 4 if nsub is None else nsub
+        tapers = get_window('hamming', nsub)[np.newaxis, :]
+    elif method == 'multitaper':
+        n_tapers = int(2 * nw - 1) if n_tapers is None else n_tapers
+        tapers = np.atleast_2d(dpss(nperseg, nw, n_tapers))
+    scale = 1. / (tapers ** 2).sum(-1).mean()
+    return tapers.astype(np.float32), scale
+
+
+def _segments(x, nperseg, step):
+    """Get a (..., n_segments, nperseg) view of detrended segments."""
+    nseg = (x.shape[-1] - nperseg) // step + 1
+    x = np.ascontiguousarray(x)
+    segs = as_strided(x, shape=x.shape[:-1] + (nseg, nperseg),
+                      strides=x.strides[:-1] + (step * x.strides[-1],
+                                                x.strides[-1]),
+                      writeable=False)
+    return segs - segs.mean(-1, keepdims=True)
+
+
+def _spectral_block(x, sf, nperseg, step, method, nw, n_tapers, nsub):
+    """Compute the power of consecutive segments of x.
+
+    Returns:
+        power: np.ndarray
+            Array of shape x.shape[:-1] + (n_freqs, n_segments).
+    """
+    tapers, scale = _get_tapers(nperseg, method, nw, n_tapers, nsub)
+    segs = _segments(x, nperseg, step)
+    if method == 'welch':
+        # Sub-segments of each segment (overlapping by half) :
+        nfft = tapers.shape[-1]
+        segs = _segments(segs, nfft, max(1, nfft // 2))
+    else:
+        nfft = nperseg
+        # Taper axis :
+        segs = segs[..., np.newaxis, :]
+    # Squared magnitude averaged over tapers (or sub-segments) :
+    spec = rfft(segs * tapers, axis=-1)
+    power = (spec.real ** 2 + spec.imag ** 2).mean(-2).astype(np.float32)
+    # One-sided density :
+    power *= scale / sf
+    if nfft % 2:
+        power[..., 1:] *= 2
+    else:
+        power[..., 1:-1] *= 2
+    return np.moveaxis(power, -1, -2)
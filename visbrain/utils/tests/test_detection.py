@@ -0,0 +1,157 @@
+"""Test the sleep detections against their reference implementation."""
+import numpy as np
+from scipy.signal import hilbert
+
+from visbrain.utils.filtering import filt
+from visbrain.utils.sleep.detection import (index2intervals,
+                                            intervals_overlap, peakdetect,
+                                            ndpeakdetect, spindlesdetect,
+                                            spindlesfeatures, spindlesdecide,
+                                            spindlessweep)
+
+
+def _peakdetect_loop(y, lookahead, delta=0):
+    """Sample by sample peak detection (original implementation)."""
+    max_peaks, min_peaks, dump = [], [], []
+    mn, mx = np.Inf, -np.Inf
+    for index, v in enumerate(y[:-lookahead]):
+        if v > mx:
+            mx, mxpos = v, index
+        if v < mn:
+            mn, mnpos = v, index
+        if v < mx - delta and mx != np.Inf:
+            if y[index:index + lookahead].max() < mx:
+                max_peaks.append([mxpos, mx])
+                dump.append(True)
+                mx, mn = np.Inf, np.Inf
+                continue
+        if v > mn + delta and mn != -np.Inf:
+            if y[index:index + lookahead].min() > mn:
+                min_peaks.append([mnpos, mn])
+                dump.append(False)
+                mn, mx = -np.Inf, -np.Inf
+    if dump:
+        (max_peaks if dump[0] else min_peaks).pop(0)
+    return [max_peaks, min_peaks]
+
+
+def _signals():
+    """Random, integer valued (ties) and random walk signals."""
+    rng = np.random.RandomState(0)
+    t = np.arange(5000) / 100.
+    return [np.sin(2 * np.pi * t) + .3 * rng.randn(len(t)),
+            rng.randint(0, 5, 3000).astype(float),
+            np.cumsum(rng.randn(5000))]
+
+
+def test_index2intervals():
+    """Intervals of consecutive indices cover exactly the indices."""
+    rng = np.random.RandomState(0)
+    index = np.flatnonzero(rng.rand(1000) > .6)
+    intervals = index2intervals(index)
+    assert np.all(intervals[1:, 0] > intervals[:-1, 1])
+    assert np.array_equal(np.concatenate([np.arange(a, b) for a, b in
+                                          intervals]), index)
+    assert index2intervals([]).shape == (0, 2)
+
+
+def test_intervals_overlap():
+    """Binary search of overlapping intervals equals a brute force search."""
+    rng = np.random.RandomState(1)
+    intervals = index2intervals(np.flatnonzero(rng.rand(1000) > .7))
+    for start, stop in rng.randint(0, 1000, (200, 2)):
+        ref = intervals[(intervals[:, 0] < stop) & (intervals[:, 1] > start)]
+        ref = np.clip(ref, start, stop)
+        assert np.array_equal(intervals_overlap(intervals, start, stop), ref)
+
+
+def test_peakdetect():
+    """The vectorized scan gives the peaks of the original loop."""
+    for y in _signals():
+        for lookahead, delta in [(1, 0), (20, 0), (50, .5)]:
+            ref = _peakdetect_loop(y, lookahead, delta)
+            assert peakdetect(y, None, lookahead, delta) == ref
+
+
+def test_ndpeakdetect():
+    """Peaks of several signals at once."""
+    y = np.c_[_signals()[0], _signals()[2]]
+    peaks = ndpeakdetect(y, lookahead=20, axis=0)
+    assert len(peaks) == 2
+    for k in range(2):
+        assert peaks[k] == _peakdetect_loop(y[:, k], 20)
+
+
+def _spindles(nchan=3, sf=100.):
+    """Noise with 13 Hz bursts of about one second and a hypnogram."""
+    rng = np.random.RandomState(0)
+    x = rng.randn(nchan, int(600 * sf))
+    t = np.arange(int(sf)) / sf
+    for c in range(nchan):
+        for k in np.arange(500, x.shape[1] - 400, 1500) + rng.randint(
+                0, 300, 40):
+            x[c, k:k + len(t)] += 5. * np.sin(2 * np.pi * 13. * t) * \
+                np.hanning(len(t))
+    hypno = np.repeat(rng.choice([0, 1, 2, 3, 4], 20), 30 * sf)
+    return x, sf, hypno
+
+
+def test_spindlesfeatures():
+    """Amplitude of the analytic signal of the filtered data."""
+    x, sf, hypno = _spindles()
+    amp, mean, std, length = spindlesfeatures(x[0], sf, hypno, True)
+    ref = np.abs(hilbert(filt(sf, [12., 14.], x[0], order=4)))
+    nrem = (hypno >= 1) & (hypno <= 3)
+    assert length == nrem.sum()
+    assert np.all(np.isnan(amp[~nrem]))
+    # Only edges depend on the zero padding of the FFT :
+    np.testing.assert_allclose(amp[nrem][100:-100], ref[nrem][100:-100],
+                               rtol=1e-3, atol=1e-3)
+    np.testing.assert_allclose([mean, std], [ref[nrem].mean(),
+                                             ref[nrem].std()], rtol=1e-2)
+
+
+def test_spindlesdetect_channels():
+    """2D detection (in one or two processes) equals 1D detections."""
+    x, sf, hypno = _spindles()
+    for nrem_only in [False, True]:
+        refs = [spindlesdetect(k, sf, 2., hypno, nrem_only) for k in x]
+        assert all(len(r[0]) for r in refs)
+        for n_jobs in [1, 2]:
+            idx, number, density = spindlesdetect(x, sf, 2., hypno,
+                                                  nrem_only, n_jobs=n_jobs)
+            for k, ref in enumerate(refs):
+                np.testing.assert_array_equal(idx[k], ref[0])
+                assert (number[k], density[k]) == ref[1:]
+
+
+def test_spindlesdecide():
+    """The decision stage on features equals the whole detection."""
+    x, sf, hypno = _spindles()
+    for data in [x[1], x]:
+        features = spindlesfeatures(data, sf, hypno, True)
+        for thr, dmin, dmax in [(2., 500, 1500), (1., 300, 2000)]:
+            ref = spindlesdetect(data, sf, thr, hypno, True,
+                                 min_dur_ms=dmin, max_dur_ms=dmax)
+            out = spindlesdecide(features, sf, thr, dmin, dmax)
+            np.testing.assert_array_equal(out[1], ref[1])
+            np.testing.assert_array_equal(out[2], ref[2])
+            idx, ref_idx = out[0], ref[0]
+            if data.ndim == 1:
+                idx, ref_idx = [idx], [ref_idx]
+            for i, r in zip(idx, ref_idx):
+                np.testing.assert_array_equal(i, r)
+
+
+def test_spindlessweep():
+    """Sweep counts equal one detection per threshold and duration."""
+    x, sf, hypno = _spindles(1)
+    features = spindlesfeatures(x[0], sf, hypno, False)
+    thresholds, durations = [1., 2., 3.], [(500, 1500), (200, 800)]
+    number, density = spindlessweep(features, sf, thresholds, durations)
+    assert number.shape == density.shape == (3, 2)
+    for i, thr in enumerate(thresholds):
+        for j, (dmin, dmax) in enumerate(durations):
+            ref = spindlesdetect(x[0], sf, thr, hypno, False,
+                                 min_dur_ms=dmin, max_dur_ms=dmax)
+            assert (number[i, j], density[i, j]) == ref[1:]
@@ -0,0 +1,63 @@
+"""Test the detection cache."""
+import numpy as np
+
+from visbrain.utils.sleep.detection import remdetect
+from visbrain.utils.sleep.detectioncache import DetectionCache, fingerprint
+
+
+def test_fingerprint():
+    """Fingerprints only depend on the content (and type) of objects."""
+    x = np.arange(100.)
+    assert fingerprint(x) == fingerprint(x.copy())
+    assert fingerprint(x) != fingerprint(x.astype(np.float32))
+    assert fingerprint(x) != fingerprint(x.reshape(10, 10))
+    y = x.copy()
+    y[50] += 1e-9
+    assert fingerprint(x) != fingerprint(y)
+    assert fingerprint({'a': 1, 'b': [x, 2.]}) == fingerprint(
+        {'b': [x.copy(), 2.], 'a': 1})
+    assert fingerprint((1, 2)) != fingerprint([1, 2])
+
+
+def test_lru():
+    """The least recently used results are evicted first."""
+    cache = DetectionCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert len(cache) == 2
+    assert (cache.get('b'), cache.get('a'), cache.get('c')) == (None, 1, 3)
+
+
+def test_call():
+    """Cached results equal the computed ones and are computed once."""
+    rng = np.random.RandomState(0)
+    eog, hypno = rng.randn(6000), np.zeros(6000)
+    calls = []
+
+    def fcn(*args):
+        calls.append(1)
+        return remdetect(*args)
+
+    cache = DetectionCache()
+    ref = remdetect(eog, 100., hypno, False, 2.)
+    for _ in range(3):
+        out = cache(fcn, eog, 100., hypno, False, 2.)
+        np.testing.assert_array_equal(out[0], ref[0])
+    assert len(calls) == 1
+    # Other parameters are computed :
+    cache(fcn, eog, 100., hypno, False, 3.)
+    assert len(calls) == 2
+
+
+def test_persistence(tmpdir):
+    """Results are read back from disk by another cache."""
+    path = str(tmpdir.join('cache'))
+    key = DetectionCache.key('fp', 'Cz', 'REM', (3., True), 'hypno')
+    DetectionCache(path=path).set(key, np.arange(10).reshape(5, 2))
+    cache = DetectionCache(path=path)
+    assert key in cache
+    np.testing.assert_array_equal(cache.get(key), np.arange(10).reshape(5, 2))
+    cache.clear(disk=True)
+    assert (key not in cache) and (cache.get(key) is None)
@@ -0,0 +1,40 @@
+"""Test the conversion of sleep files into arrays."""
+import numpy as np
+
+from visbrain.utils.sleep.fileconvert import edf2array
+
+
+def _write_edf(path, raw, n_records, sf=100):
+    """Write int16 data of shape (n_channels, n_points) in an EDF file."""
+    nchan = raw.shape[0]
+
+    def field(val, n):
+        return str(val).ljust(n)[:n].encode()
+
+    hdr = field(0, 8) + field('subj', 80) + field('rec', 80)
+    hdr += field('01.02.03', 8) + field('04.05.06', 8)
+    hdr += field(256 * (nchan + 1), 8) + field('', 44) + field(n_records, 8)
+    hdr += field(1, 8) + field(nchan, 4)
+    hdr += b''.join(field('ch' + str(k), 16) for k in range(nchan))
+    for val, n in [('', 80), ('uV', 8), (-100, 8), (100, 8),
+                   (-32768, 8), (32767, 8), ('', 80), (sf, 8), ('', 32)]:
+        hdr += b''.join(field(val, n) for _ in range(nchan))
+    # Records of sf samples of each channel :
+    body = raw.reshape(nchan, -1, sf).transpose(1, 0, 2).astype('<i2')
+    with open(path, 'wb') as f:
+        f.write(hdr + body.tobytes())
+
+
+def test_edf2array_records(tmpdir):
+    """The number of points is the number of records written on disk."""
+    raw = np.random.RandomState(0).randint(-1000, 1000, (2, 1000))
+    for n_records, n_points in [(10, 1000), (-1, 1000), (12, 1000),
+                                (7, 700)]:
+        path = str(tmpdir.join('rec.edf'))
+        _write_edf(path, raw, n_records)
+        for lazy in [False, True]:
+            sf, data, _ = edf2array(path, lazy=lazy)
+            data = np.asarray(data)
+            assert (sf, data.shape) == (100., (2, n_points))
+            np.testing.assert_allclose(data[1, :], raw[1, :n_points] *
+                                       200. / 65535, atol=1e-2)
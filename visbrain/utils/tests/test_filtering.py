@@ -0,0 +1,79 @@
+"""Test the filtering functions against their reference implementation."""
+import numpy as np
+from scipy.signal import resample_poly
+
+from visbrain.utils.filtering import (filt, decimate, convolve, ndmorlet,
+                                      tf_morlet, _morlet_wlt, _filt_blocks)
+
+
+def test_filt_blocks():
+    """Filtering by blocks equals filt on the whole signal."""
+    x = (200. + 50. * np.random.RandomState(0).randn(20011)).astype(
+        np.float32)
+    for way in ['filtfilt', 'lfilter']:
+        for btype, f in [('bandpass', [12., 16.]), ('highpass', [.5, 0.])]:
+            ref = filt(1000., np.array(f), x.astype(float), btype=btype,
+                       way=way)
+            for chunk in [1000, 7777, 2 ** 20]:
+                out = np.zeros(len(x), dtype=np.float32)
+                _filt_blocks(1000., f, lambda a, b: x[a:b], len(x), out,
+                             btype=btype, way=way, chunk=chunk)
+                np.testing.assert_allclose(out, ref, rtol=1e-5,
+                                           atol=1e-5 * np.abs(ref).max())
+
+
+def test_decimate():
+    """Block decimation equals scipy's resample_poly on the whole signal."""
+    x = np.random.RandomState(1).randn(3, 20000)
+    for sf, ds, up, down in [(1000., 100., 1, 10), (256., 100., 25, 64)]:
+        ref = resample_poly(x, up, down, axis=-1, window=('kaiser', 5.0))
+        out = decimate(x, sf, ds, chunk=5000)
+        assert out.dtype == np.float32
+        np.testing.assert_allclose(out, ref, rtol=1e-5, atol=1e-5)
+
+
+def test_convolve():
+    """All methods equal np.convolve(x, h, 'same')."""
+    rng = np.random.RandomState(0)
+    x = rng.randn(1000)
+    kernels = [np.ones(40) / 40., rng.randn(7), rng.randn(8), rng.randn(101),
+               np.exp(1j * rng.randn(33))]
+    for h in kernels:
+        ref = np.convolve(x, h, 'same')
+        methods = ['direct', 'fft', 'oa', 'auto']
+        methods += ['cumsum'] if np.all(h == h[0]) else []
+        for method in methods:
+            np.testing.assert_allclose(convolve(x, h, method=method), ref,
+                                       atol=1e-10)
+
+
+def test_convolve_axis():
+    """Several kernels and signals along any axis."""
+    rng = np.random.RandomState(1)
+    x, h = rng.randn(500, 3), rng.randn(2, 21)
+    for method in ['direct', 'fft', 'oa']:
+        y = convolve(x, h, axis=0, method=method)
+        assert y.shape == (2, 500, 3)
+        for i in range(2):
+            for j in range(3):
+                np.testing.assert_allclose(y[i, :, j], np.convolve(
+                    x[:, j], h[i], 'same'), atol=1e-10)
+
+
+def test_tf_morlet():
+    """Blocks of the decomposition equal the convolution by each wavelet."""
+    sf, freqs = 100., [4., 10., 13.5, 30.]
+    x = np.random.RandomState(2).randn(2, 3000)
+    ref = np.array([[np.convolve(k, _morlet_wlt(sf, f), 'same') for k in x]
+                    for f in freqs])
+    np.testing.assert_allclose(ndmorlet(x, sf, freqs, axis=1), ref,
+                               atol=1e-10)
+    for decim, chunk in [(1, None), (1, 700), (3, 500), (7, None)]:
+        tf = tf_morlet(x, sf, freqs, decim=decim, chunk=chunk)
+        assert tf.shape == (4, 2, -(-3000 // decim))
+        np.testing.assert_allclose(tf, ref[..., ::decim], atol=1e-10)
+    # Time along the first axis, single precision :
+    tf = tf_morlet(x.T, sf, freqs, decim=2, dtype=np.complex64, axis=0)
+    assert (tf.shape, tf.dtype) == ((4, 1500, 2), np.complex64)
+    np.testing.assert_allclose(tf, ref[..., ::2].transpose(0, 2, 1),
+                               atol=1e-5)
@@ -0,0 +1,139 @@
+"""Test the epoch-based hypnogram and the sleep statistics."""
+import numpy as np
+
+from visbrain.utils.sleep.hypnoprocessing import (EpochHypno, sleepstats,
+                                                  sleepstats_batch)
+
+
+def _check_edits(hypno, edits):
+    """Apply edits to an EpochHypno and to the equivalent sample vector."""
+    ref = np.asarray(hypno).copy()
+    epoch, n_epochs = hypno.epoch, len(hypno.values)
+    for start, stop, stage in edits:
+        hypno.set_samples(start, stop, stage)
+        ref[max(start, 0):max(stop, 0)] = stage
+        assert np.array_equal(np.asarray(hypno), ref)
+        # The epoch grid is unchanged :
+        assert (hypno.epoch, len(hypno.values)) == (epoch, n_epochs)
+    # Runs, masks and indexing are consistent with the sample vector :
+    starts, ends, stages = hypno.runs()
+    assert np.array_equal(np.repeat(stages, ends - starts), ref)
+    assert np.all(stages[1:] != stages[:-1])
+    assert np.array_equal(hypno.mask([2, 4]), np.isin(ref, [2, 4]))
+    assert np.array_equal(hypno[::7], ref[::7])
+    assert np.array_equal(hypno.stages(), np.unique(ref))
+    assert hypno[len(ref) - 1] == ref[-1]
+    return hypno
+
+
+def test_set_samples_aligned():
+    """Edits on the epoch grid do not create partial epochs."""
+    hypno = EpochHypno(np.zeros(10), 3000, 30000)
+    _check_edits(hypno, [(3000, 9000, 2), (0, 3000, 4), (27000, 30000, 3)])
+    assert not hypno.partial
+
+
+def test_set_samples_unaligned():
+    """Edits that are not on the epoch grid are applied exactly."""
+    # 30s epochs at 100Hz :
+    hypno = EpochHypno(np.zeros(10), 3000, 30000)
+    _check_edits(hypno, [(1000, 4000, 2)])
+    assert sorted(hypno.partial) == [0, 1]
+    _check_edits(hypno, [(1000, 2500, 3)])
+    assert sorted(hypno.partial) == [0, 1]
+    # Partial epochs are merged back once uniform :
+    _check_edits(hypno, [(0, 6000, 1)])
+    assert not hypno.partial
+    # Random edits (including out of bounds samples) :
+    rng = np.random.RandomState(0)
+    edits = [(a, a + rng.randint(1, 5000), rng.randint(-1, 5))
+             for a in rng.randint(-100, 30000, 50)]
+    _check_edits(EpochHypno(rng.randint(0, 5, 10), 3000, 30000), edits)
+
+
+def test_set_samples_offset():
+    """Unaligned edits of hypnograms with an offset or float epochs."""
+    rng = np.random.RandomState(1)
+    edits = [(a, a + rng.randint(1, 500), rng.randint(-1, 5))
+             for a in rng.randint(0, 3000, 20)]
+    _check_edits(EpochHypno(rng.randint(0, 5, 12), 250, 3000, 70), edits)
+    _check_edits(EpochHypno(rng.randint(0, 5, 12), 250, 3000, -70), edits)
+    _check_edits(EpochHypno(rng.randint(0, 5, 12), 250.5, 3000), edits)
+
+
+def test_from_samples():
+    """Compress sample vectors with unaligned changes and odd tails."""
+    ref = np.repeat([0, 2, 3, 2, 4], [3000, 6000, 2999, 3001, 1234])
+    hypno = EpochHypno.from_samples(ref, 3000)
+    assert np.array_equal(np.asarray(hypno), ref)
+    assert (hypno.epoch, len(hypno.values)) == (3000, 6)
+    assert sorted(hypno.partial) == [3]
+    # Longest exact epoch :
+    ref = np.repeat([0, 2, 3], [3000, 6000, 1234])
+    hypno = EpochHypno.from_samples(ref)
+    assert np.array_equal(np.asarray(hypno), ref)
+    assert (hypno.epoch, len(hypno.partial)) == (3000, 0)
+
+
+def test_resize_resample():
+    """Resize and resample hypnograms with partial epochs."""
+    ref = np.repeat([0, 2, 3, 2], [3000, 6000, 2999, 1001])
+    hypno = EpochHypno.from_samples(ref, 3000)
+    longer = np.asarray(hypno.resize(15000))
+    assert np.array_equal(longer, np.r_[ref, np.zeros(2000, dtype=int)])
+    assert np.array_equal(np.asarray(hypno.resize(10000)), ref[:10000])
+    assert np.array_equal(np.asarray(hypno.resample(4, 3250)), ref[::4])
+
+
+def _sleepstats_ref(hypno, sf=100, time_window=30.):
+    """Numeric sleep statistics of a single night (original code)."""
+    hypno = hypno[::int(round(sf * time_window))]
+    stats, tov = {}, np.nan
+    stats['Duration (TIB)_3'] = hypno.size
+    stats['TDT_4'] = np.where(hypno != 0)[0].max() if np.nonzero(
+        hypno)[0].size else tov
+    for k, name in enumerate(['Art_5', 'W_6', 'N1_7', 'N2_8', 'N3_9',
+                              'REM_10']):
+        stats[name] = hypno[hypno == k - 1].size
+    for k, name in enumerate(['LatN1_11', 'LatN2_12', 'LatN3_13',
+                              'LatREM_14']):
+        stats[name] = np.where(hypno == k + 1)[0].min() if (
+            k + 1 in hypno) else tov
+    if not np.isnan(stats['LatN1_11']) and not np.isnan(stats['TDT_4']):
+        hypno_s = hypno[stats['LatN1_11']:stats['TDT_4']]
+        stats['SPT_15'] = hypno_s.size
+        stats['WASO_16'] = hypno_s[hypno_s == 0].size
+        stats['TST_17'] = stats['SPT_15'] - stats['WASO_16']
+    else:
+        stats['SPT_15'] = stats['WASO_16'] = stats['TST_17'] = np.nan
+    stats = {k: v / (60. / time_window) for k, v in stats.items()}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats['SE (%)_18'] = np.round(stats['TST_17'] / stats['TDT_4'] *
+                                      100., 2)
+    return stats
+
+
+def test_sleepstats_batch():
+    """Statistics of several nights equal the ones of each night."""
+    rng = np.random.RandomState(0)
+    nights = [np.repeat(rng.randint(-1, 5, n), 300) for n in [40, 100, 73]]
+    nights += [np.zeros(3000), np.repeat([0, 0, 2, 2, 0], 300),
+               np.repeat([0, 3, 3, 4, 4], 300)]
+    nights[0][:3000] = 0
+    stats = sleepstats_batch(nights, sf=10, files=['/a/b.edf'] + [None] * 5)
+    assert list(stats['Filename_0']) == ['b.edf'] + [''] * 5
+    assert set(stats['Units_2']) == {'minutes'}
+    for k, night in enumerate(nights):
+        ref = _sleepstats_ref(night, sf=10)
+        for key, val in ref.items():
+            np.testing.assert_allclose(stats[key][k], val, err_msg=key)
+        # Same as sleepstats and as an EpochHypno :
+        for hypno in [night, EpochHypno.from_samples(night)]:
+            single = sleepstats(None, hypno, sf=10)
+            for key, val in ref.items():
+                np.testing.assert_allclose(single[key], val, err_msg=key)
+    # Nights of the same length as a 2D array :
+    h = np.array(nights[3:])
+    stack = sleepstats_batch(h, sf=10)
+    for key in _sleepstats_ref(h[0]):
+        np.testing.assert_allclose(stack[key], stats[key][3:], err_msg=key)
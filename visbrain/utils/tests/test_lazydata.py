@@ -0,0 +1,70 @@
+"""Test the lazy data sources against in-memory arrays."""
+import numpy as np
+import pytest
+
+from visbrain.utils.filtering import decimate
+from visbrain.utils.sleep.lazydata import LazyData, MemmapData
+
+
+def _memmap(tmpdir, order='C'):
+    """Get a raw int16 memmap, its gains and the scaled reference data."""
+    rng = np.random.RandomState(0)
+    raw = rng.randint(-2000, 2000, (5, 10000)).astype(np.int16)
+    mm = np.memmap(str(tmpdir.join('raw.dat')), dtype=np.int16, mode='w+',
+                   shape=raw.shape, order=order)
+    mm[:] = raw
+    gain = rng.uniform(.1, 2., 5)
+    return mm, gain, (raw * gain[:, np.newaxis]).astype(np.float32)
+
+
+def test_memmapdata_slicing(tmpdir):
+    """Slicing a MemmapData is the same as slicing the scaled array."""
+    keys = [np.s_[:, :], np.s_[1], np.s_[-1, 100:200], np.s_[:, 5],
+            np.s_[1:4, 10:9000:7], np.s_[[0, 3, 2], -500:], np.s_[..., 3:8],
+            np.s_[np.array([True, False, True, False, True]), ::1000],
+            np.s_[2, 50], np.s_[:, 200:100]]
+    for order in ['C', 'F']:
+        mm, gain, ref = _memmap(tmpdir, order)
+        data = MemmapData(mm, gain, chunk=1000)
+        assert data.shape == ref.shape
+        for key in keys:
+            np.testing.assert_allclose(data[key], ref[key], rtol=1e-6)
+        np.testing.assert_allclose(np.asarray(data), ref, rtol=1e-6)
+
+
+def test_memmapdata_channels(tmpdir):
+    """Select a subset of channels of the memmap."""
+    mm, gain, ref = _memmap(tmpdir)
+    data = MemmapData(mm, gain, chan=[4, 1, 2])
+    np.testing.assert_allclose(data[:, 10:20], ref[[4, 1, 2], 10:20],
+                               rtol=1e-6)
+
+
+def test_memmapdata_reductions(tmpdir):
+    """Reductions over time computed by chunks."""
+    mm, gain, ref = _memmap(tmpdir)
+    data = MemmapData(mm, gain, chunk=3000)
+    for name in ['min', 'max', 'mean', 'std']:
+        np.testing.assert_allclose(getattr(data, name)(axis=1),
+                                   getattr(ref.astype(float), name)(axis=1),
+                                   rtol=1e-5)
+        np.testing.assert_allclose(getattr(data, name)(),
+                                   getattr(ref.astype(float), name)(),
+                                   rtol=1e-5)
+
+
+def test_decimated_data(tmpdir):
+    """Lazy decimation only reads the requested points."""
+    mm, gain, ref = _memmap(tmpdir)
+    data = MemmapData(mm, gain).decimate(256., 100.)
+    full = decimate(ref, 256., 100.)
+    assert data.shape == full.shape
+    for key in [np.s_[:, :], np.s_[2, 1000:1500], np.s_[[0, 4], -300::3]]:
+        np.testing.assert_allclose(data[key], full[key], rtol=1e-4,
+                                   atol=1e-3)
+
+
+def test_lazydata_abstract():
+    """LazyData subclasses must implement _read."""
+    with pytest.raises(TypeError):
+        LazyData(2, 100)
@@ -0,0 +1,60 @@
+"""Test the spectrogram against scipy's spectral estimators."""
+import numpy as np
+from scipy import signal
+from scipy.signal.windows import dpss
+
+from visbrain.utils.spectral import spectrogram
+
+
+def _signals():
+    """Two channels of noise with a 10 Hz oscillation and an offset."""
+    rng = np.random.RandomState(0)
+    t = np.arange(30000) / 100.
+    return np.c_[np.sin(2 * np.pi * 10. * t), 3. + t / 100.].T + rng.randn(
+        2, len(t))
+
+
+def _assert_power(power, ref):
+    """Float32 precision relatively to the peak power."""
+    np.testing.assert_allclose(power, ref, rtol=1e-4,
+                               atol=1e-5 * np.abs(ref).max())
+
+
+def test_spectrogram_hamming():
+    """Periodograms of scipy.signal.spectrogram, computed by blocks."""
+    x, sf = _signals(), 100.
+    freq, t, ref = signal.spectrogram(x, sf, window='hamming', nperseg=400,
+                                      noverlap=50, detrend='constant')
+    for chunk, n_jobs in [(2 ** 24, 1), (10000, 1), (10000, 2)]:
+        f, tt, power = spectrogram(x, sf, 400, 50, chunk=chunk,
+                                   n_jobs=n_jobs)
+        np.testing.assert_allclose(f, freq)
+        np.testing.assert_allclose(tt, t)
+        assert power.dtype == np.float32
+        _assert_power(power, ref)
+    # Time along the first axis :
+    _assert_power(spectrogram(x.T, sf, 400, 50, axis=0)[2], ref)
+
+
+def test_spectrogram_welch():
+    """Each segment is the Welch's estimate of scipy.signal.welch."""
+    x, sf = _signals(), 100.
+    freq, t, power = spectrogram(x, sf, 1000, 0, method='welch', nsub=250)
+    for k, start in enumerate(range(0, x.shape[1] - 999, 1000)):
+        f, ref = signal.welch(x[:, start:start + 1000], sf, 'hamming', 250,
+                              125, detrend='constant')
+        np.testing.assert_allclose(freq, f)
+        _assert_power(power[..., k], ref)
+
+
+def test_spectrogram_multitaper():
+    """Average of the periodograms of the DPSS tapers."""
+    x, sf, nw = _signals()[0], 100., 3.
+    freq, t, power = spectrogram(x, sf, 500, 100, method='multitaper',
+                                 nw=nw)
+    tapers = dpss(500, nw, 5)
+    for k in range(len(t)):
+        seg = x[k * 400:k * 400 + 500]
+        ref = np.mean([signal.periodogram(seg, sf, w, detrend='constant')[1]
+                       for w in tapers], 0)
+        _assert_power(power[:, k], ref)
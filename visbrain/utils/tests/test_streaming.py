@@ -0,0 +1,66 @@
+"""Test the streaming detectors against the batch detections."""
+import numpy as np
+import pytest
+
+from visbrain.utils.sleep.detection import (remdetect, spindlesdetect,
+                                            peakdetect)
+from visbrain.utils.sleep.streaming import (RemStream, SpindlesStream,
+                                            PeakStream, _StreamDetector)
+
+
+def _eog(sf, duration=600., seed=0):
+    """Get a synthetic EOG (noise and saccades) and hypnogram."""
+    rng = np.random.RandomState(seed)
+    n = int(duration * sf)
+    eog = 30. + 5. * rng.randn(n)
+    for k in rng.randint(0, n - int(sf), 400):
+        eog[k:k + int(.05 * sf)] += 60. * rng.choice([-1, 1])
+    epoch = int(30 * sf)
+    hypno = np.repeat(rng.choice([0, 2, 4], n // epoch + 1), epoch)[:n]
+    return eog, hypno
+
+
+def test_remstream():
+    """RemStream gives the events of remdetect (warmup over the signal)."""
+    for sf in [100., 128.]:
+        eog, hypno = _eog(sf)
+        for rem_only in [False, True]:
+            ref = remdetect(eog, sf, hypno, rem_only, 2.)[0]
+            det = RemStream(sf, 2., rem_only=rem_only, warmup=len(eog) / sf)
+            events = det.run(eog, hypno if rem_only else None, chunk=7777)
+            assert len(ref)
+            np.testing.assert_array_equal(events, ref)
+
+
+def test_spindlesstream():
+    """SpindlesStream finds the spindles of spindlesdetect, delayed."""
+    sf, rng = 100., np.random.RandomState(0)
+    x = rng.randn(int(600 * sf))
+    t = np.arange(int(sf)) / sf
+    for k in np.arange(500, len(x) - 400, 1500) + rng.randint(0, 300, 40):
+        x[k:k + len(t)] += 5. * np.sin(2 * np.pi * 13. * t) * np.hanning(
+            len(t))
+    ref = spindlesdetect(x, sf, 2., np.zeros(len(x)), False)[0]
+    det = SpindlesStream(sf, 2., nrem_only=False, warmup=len(x) / sf)
+    events = det.run(x, chunk=7777)
+    assert abs(len(events) - len(ref)) <= 1
+    # Each spindle is found after the group delay of the causal filter :
+    lag = events[:, 0][:, np.newaxis] - ref[:, 0][np.newaxis, :]
+    assert np.all(((lag >= 0) & (lag <= .6 * sf)).any(0))
+
+
+def test_peakstream():
+    """PeakStream gives the peaks of peakdetect."""
+    y = np.cumsum(np.random.RandomState(0).randn(20000))
+    for lookahead, delta in [(1, 0), (50, 0), (50, 2.)]:
+        ref = peakdetect(y, None, lookahead, delta)
+        peaks = PeakStream(lookahead, delta).run(y, chunk=1234)
+        for k in range(2):
+            np.testing.assert_array_equal(np.array(peaks[k]).reshape(-1, 2),
+                                          np.array(ref[k]).reshape(-1, 2))
+
+
+def test_stream_abstract():
+    """Stream detectors must implement _transform."""
+    with pytest.raises(TypeError):
+        _StreamDetector(100., 2.)